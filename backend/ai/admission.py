@@ -0,0 +1,225 @@
+"""
+Допуск запросов к провайдеру: лимиты частоты и токенов, очередь с приоритетами
+"""
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+import asyncio
+import heapq
+import itertools
+import time
+from .core import Config, UpstreamError
+from . import deadline
+from .metrics import admission_rejected, admission_wait
+from .rate_limit import TokenBucket
+
+
+# Меньше — важнее: живой чат обгоняет пакеты, пакеты — анализ
+PRIORITIES = {"interactive": 0, "batch": 1, "analysis": 2}
+
+_priority: ContextVar[str] = ContextVar('admission_priority', default='interactive')
+
+
+def set_priority(name: str):
+    """Приоритет запросов к провайдеру из текущего обработчика (и его задач)"""
+    _priority.set(name if name in PRIORITIES else 'interactive')
+
+
+def current_priority() -> str:
+    return _priority.get()
+
+
+class _Waiter:
+    """Запрос в очереди модели"""
+    __slots__ = ('priority', 'seq', 'cost', 'future')
+
+    def __init__(self, priority: int, seq: int, cost: float, future: asyncio.Future):
+        self.priority = priority
+        self.seq = seq
+        self.cost = cost
+        self.future = future
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class ModelGate:
+    """Вёдра запросов в секунду и токенов в минуту одной модели и её очередь"""
+
+    def __init__(self, rps: float, burst: Optional[float], tpm: float):
+        self.requests = TokenBucket(rps, burst) if rps > 0 else None
+        self.tokens = TokenBucket(tpm / 60, tpm) if tpm > 0 else None
+        self.queue: List[_Waiter] = []
+        self.wakeup = asyncio.Event()
+        self.dispatcher: Optional[asyncio.Task] = None
+
+    def clamp(self, cost: float) -> float:
+        """Запрос дороже ёмкости ведра иначе не прошёл бы никогда"""
+        return min(cost, self.tokens.capacity) if self.tokens else cost
+
+    def wait_time(self, requests: int, cost: float) -> float:
+        """Сколько ждать, пока вёдра наберут requests запросов и cost токенов"""
+        wait = 0.0
+        if self.requests:
+            wait = self.requests.wait_time(requests)
+        if self.tokens:
+            wait = max(wait, self.tokens.wait_time(cost))
+        return wait
+
+    def take(self, cost: float):
+        if self.requests:
+            self.requests.try_acquire(1)
+        if self.tokens:
+            self.tokens.try_acquire(cost)
+
+    def to_dict(self) -> Dict[str, Any]:
+        result: Dict[str, Any] = {"queue": len(self.queue)}
+        if self.requests:
+            result["requests_available"] = round(self.requests.tokens, 2)
+        if self.tokens:
+            result["tokens_available"] = int(self.tokens.tokens)
+        return result
+
+
+class AdmissionController:
+    """Допуск запросов к провайдеру по лимитам модели
+
+    Для каждой модели — ведро запросов в секунду (rps, burst подряд) и
+    ведро токенов в минуту (tpm; стоимость запроса — оценка промпта плюс
+    max_tokens, после ответа уточняется по usage); 0 — без лимита. Запрос, которому сразу
+    не хватает вёдер, ждёт в очереди модели; очередь упорядочена по
+    приоритету (interactive, batch, analysis), внутри приоритета — по
+    времени прихода.
+
+    Очередь ограничена: больше max_queue ожидающих — сразу 503, ожидаемое
+    ожидание дольше max_wait — сразу 429, и в обоих случаях Retry-After
+    с оценкой. Запрос, простоявший в очереди max_wait, получает 503.
+    Отказ — UpstreamError, который не считается сбоем модели.
+    """
+
+    def __init__(self, config: Config):
+        self.rps = config.get('admission.rps', 0)
+        self.burst = config.get('admission.burst', None)
+        self.tpm = config.get('admission.tpm', 0)
+        self.max_queue = config.get('admission.max_queue', 32)
+        self.max_wait = config.get('admission.max_wait', 10)
+        self.overrides: Dict[str, Dict[str, Any]] = config.get('admission.models', {}) or {}
+        self._gates: Dict[str, ModelGate] = {}
+        self._seq = itertools.count()
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = {"rate": 0, "queue": 0, "timeout": 0}
+
+    def gate(self, model_name: str) -> ModelGate:
+        if model_name not in self._gates:
+            limits = self.overrides.get(model_name, {})
+            self._gates[model_name] = ModelGate(
+                limits.get('rps', self.rps),
+                limits.get('burst', self.burst),
+                limits.get('tpm', self.tpm),
+            )
+        return self._gates[model_name]
+
+    def _reject(self, model_name: str, reason: str, retry_after: float) -> UpstreamError:
+        self.rejected[reason] += 1
+        admission_rejected.inc(model_name, reason)
+        if reason == 'rate':
+            return UpstreamError(f"Превышен лимит запросов к модели {model_name}, повторите позже",
+                                 kind="rate_limited", retry_after=max(1.0, retry_after), model=model_name)
+        return UpstreamError(f"Модель {model_name} перегружена запросами, повторите позже",
+                             kind="overloaded", retry_after=max(1.0, retry_after), model=model_name)
+
+    async def acquire(self, model_name: str, cost: float):
+        """Дождаться допуска запроса стоимостью cost токенов (или UpstreamError)"""
+        gate = self.gate(model_name)
+        cost = gate.clamp(cost)
+        priority_name = _priority.get()
+        priority = PRIORITIES[priority_name]
+        if not gate.queue and gate.wait_time(1, cost) == 0:
+            gate.take(cost)
+            self.admitted += 1
+            admission_wait.observe(0.0, model_name, priority_name)
+            return
+
+        # Ждать дольше срока самого запроса бессмысленно
+        max_wait = self.max_wait
+        left = deadline.remaining()
+        if left is not None:
+            max_wait = max(0.0, min(max_wait, left))
+        ahead = [w for w in gate.queue if w.priority <= priority]
+        expected = gate.wait_time(len(ahead) + 1, sum(w.cost for w in ahead) + cost)
+        if len(gate.queue) >= self.max_queue:
+            raise self._reject(model_name, 'queue', expected)
+        if expected > max_wait:
+            raise self._reject(model_name, 'rate', expected)
+
+        waiter = _Waiter(priority, next(self._seq), cost, asyncio.get_running_loop().create_future())
+        heapq.heappush(gate.queue, waiter)
+        self.queued += 1
+        gate.wakeup.set()
+        if gate.dispatcher is None:
+            gate.dispatcher = asyncio.create_task(self._dispatch(gate))
+
+        started = time.monotonic()
+        try:
+            done, _ = await asyncio.wait({waiter.future}, timeout=max_wait)
+        finally:
+            # Отменённый (клиент ушёл) или просроченный запрос диспетчер пропустит
+            if not waiter.future.done():
+                waiter.future.cancel()
+        if not done:
+            raise self._reject(model_name, 'timeout', gate.wait_time(len(gate.queue), cost))
+        self.admitted += 1
+        admission_wait.observe(time.monotonic() - started, model_name, priority_name)
+
+    async def _dispatch(self, gate: ModelGate):
+        """Выпускает голову очереди модели, как только вёдра позволяют"""
+        try:
+            while gate.queue:
+                head = gate.queue[0]
+                if head.future.done():
+                    heapq.heappop(gate.queue)
+                    continue
+                wait = gate.wait_time(1, head.cost)
+                if wait == 0:
+                    heapq.heappop(gate.queue)
+                    gate.take(head.cost)
+                    head.future.set_result(None)
+                    continue
+                # Новый запрос мог встать в голову — пересчитываем раньше срока
+                gate.wakeup.clear()
+                try:
+                    await asyncio.wait_for(gate.wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            gate.dispatcher = None
+
+    def settle(self, model_name: str, cost: float, usage: Optional[Dict[str, int]]):
+        """Вернуть в ведро токенов разницу между оценкой и фактическим usage"""
+        gate = self._gates.get(model_name)
+        if gate is None or gate.tokens is None or not usage or not usage.get('total_tokens'):
+            return
+        bucket = gate.tokens
+        bucket.tokens = min(bucket.capacity, bucket.tokens + gate.clamp(cost) - usage['total_tokens'])
+        gate.wakeup.set()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected": dict(self.rejected),
+            "models": {name: gate.to_dict() for name, gate in self._gates.items()},
+        }
+
+
+_controller: Optional[AdmissionController] = None
+
+
+def get_admission(config: Config) -> Optional[AdmissionController]:
+    """Общий для процесса контроль допуска (None без admission.enabled в конфиге)"""
+    global _controller
+    if not config.get('admission.enabled', False):
+        return None
+    if _controller is None:
+        _controller = AdmissionController(config)
+    return _controller
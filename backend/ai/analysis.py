@@ -0,0 +1,171 @@
+"""
+Анализ дня и периода (map-reduce по дням)
+"""
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional
+import asyncio
+import hashlib
+import json
+from .core import Config, UpstreamError
+from . import deadline
+from .model_manager import ModelManager
+from .prompt import get_prompt_compiler, SECTIONS
+from .response_cache import ResponseCache, get_response_cache
+
+
+DAY_SYSTEM_PROMPT = """Ты — персональный AI-ассистент. Проанализируй день пользователя:
+что сделано, что осталось, финансы, тренировки, настроение. Дай 2–3 конкретных
+совета. Отвечай кратко, не более {limit} слов."""
+
+RANGE_SYSTEM_PROMPT = """Ты — персональный AI-ассистент. Ниже краткие итоги дней за период.
+Сделай обзор периода: тенденции, достижения, проблемы, финансы и тренировки в динамике,
+и 3–5 рекомендаций на следующий период. Отвечай структурированно и кратко."""
+
+
+def context_hash(context: Dict[str, Any]) -> str:
+    """Стабильный хэш контекста дня (служебные поля не учитываются)"""
+    data = {k: v for k, v in context.items() if not k.startswith('_')}
+    raw = json.dumps(data, sort_keys=True, ensure_ascii=False, default=str, separators=(',', ':'))
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def is_empty_day(context: Dict[str, Any]) -> bool:
+    return not any(spec.select(context) for spec in SECTIONS)
+
+
+class DayAnalyzer:
+    """Итоги по дням параллельно (под семафором) и одна финальная свёртка
+
+    Итог дня кэшируется по хэшу его контекста и имени модели: повторный
+    обзор недели платит только за изменившиеся дни. Запросы идут через
+    ModelManager.acomplete — с повторами и запасными моделями, как чат;
+    итог от запасной модели не кэшируется под именем основной.
+    """
+
+    def __init__(self, config: Config):
+        self.config = config
+        self.concurrency = config.get('analysis.concurrency', 4)
+        self.day_max_tokens = config.get('analysis.day_max_tokens', 400)
+        self.range_max_tokens = config.get('analysis.range_max_tokens', 1000)
+        self.compiler = get_prompt_compiler(config)
+        self.cache = get_response_cache(config)
+        self._memo: "OrderedDict[str, str]" = OrderedDict()
+        self._memo_size = config.get('analysis.memo_size', 512)
+        self.days_computed = 0
+        self.days_cached = 0
+
+    def _cache_key(self, model_name: str, context: Dict[str, Any]) -> str:
+        return ResponseCache.make_key({
+            "kind": "day_summary",
+            "model": model_name,
+            "context": context_hash(context),
+            "max_tokens": self.day_max_tokens,
+        })
+
+    async def _cached(self, key: str) -> Optional[str]:
+        if key in self._memo:
+            self._memo.move_to_end(key)
+            return self._memo[key]
+        if self.cache is not None:
+            value = await self.cache.aget(key)
+            if value:
+                self._remember(key, value['content'])
+                return value['content']
+        return None
+
+    def _remember(self, key: str, summary: str):
+        self._memo[key] = summary
+        if len(self._memo) > self._memo_size:
+            self._memo.popitem(last=False)
+
+    async def summarize_day(self, models: ModelManager, model_name: str, context: Dict[str, Any]) -> Dict[str, Any]:
+        """Итог одного дня"""
+        date = context.get('date')
+        if is_empty_day(context):
+            return {"date": date, "summary": "Нет данных за этот день", "cached": False, "empty": True}
+
+        key = self._cache_key(model_name, context)
+        cached = await self._cached(key)
+        if cached is not None:
+            self.days_cached += 1
+            return {"date": date, "summary": cached, "cached": True, "model": model_name}
+
+        result = await models.acomplete(
+            [
+                {"role": "system", "content": DAY_SYSTEM_PROMPT.format(limit=self.day_max_tokens // 2)},
+                {"role": "user", "content": self.compiler.render_data(context)},
+            ],
+            max_tokens=self.day_max_tokens,
+            model_name=model_name,
+        )
+        summary = result["content"]
+        self.days_computed += 1
+        if result["model"] == model_name:
+            self._remember(key, summary)
+            if self.cache is not None:
+                await self.cache.aput(key, {"content": summary})
+        return {"date": date, "summary": summary, "cached": False, "model": result["model"]}
+
+    async def analyze_range(self, models: ModelManager, model_name: str,
+                            contexts: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Map: итоги дней параллельно; reduce: один запрос по всем итогам
+
+        Ошибка дня не прерывает обзор; но если ни один день не удался,
+        поднимается последняя ошибка — сбой провайдера не выдаётся за
+        «нет данных». Истёкший срок запроса прерывает обзор целиком:
+        свёртка по части дней всё равно не успела бы.
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+        failures: List[Exception] = []
+
+        async def map_day(context: Dict[str, Any]) -> Dict[str, Any]:
+            async with semaphore:
+                try:
+                    return await self.summarize_day(models, model_name, context)
+                except UpstreamError as e:
+                    if e.kind == "deadline":
+                        raise
+                    failures.append(e)
+                    return {"date": context.get('date'), "summary": None, "error": str(e), "cached": False}
+                except Exception as e:
+                    failures.append(e)
+                    return {"date": context.get('date'), "summary": None, "error": str(e), "cached": False}
+
+        contexts = sorted(contexts, key=lambda c: c.get('date') or '')
+        tasks = [asyncio.ensure_future(map_day(c)) for c in contexts]
+        try:
+            days = await asyncio.gather(*tasks)
+        finally:
+            # Срок истёк в одном из дней — остальные ждать незачем
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+        summarized = [d for d in days if d.get('summary') and not d.get('empty')]
+        if not summarized:
+            if failures:
+                upstream = [e for e in failures if isinstance(e, UpstreamError)]
+                raise (upstream or failures)[-1]
+            return {"days": days, "analysis": "Нет данных за выбранный период", "model": model_name}
+
+        left = deadline.remaining()
+        if left is not None and left <= 0:
+            raise deadline.expired(model_name)
+
+        digest = "\n\n".join(f"## {d['date']}\n{d['summary']}" for d in summarized)
+        result = await models.acomplete(
+            [
+                {"role": "system", "content": RANGE_SYSTEM_PROMPT},
+                {"role": "user", "content": digest},
+            ],
+            max_tokens=self.range_max_tokens,
+            model_name=model_name,
+        )
+        return {"days": days, "analysis": result["content"], "model": result["model"]}
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "days_computed": self.days_computed,
+            "days_cached": self.days_cached,
+            "memo_entries": len(self._memo),
+        }
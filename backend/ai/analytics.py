@@ -0,0 +1,383 @@
+"""
+Аналитика по полной выгрузке данных приложения (AppDataV1) на NumPy
+"""
+from datetime import date as date_cls, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+import os
+import threading
+import time
+import numpy as np
+import orjson
+from .core import Config
+
+
+# Оценка 1ПМ по формуле Эпли — как на странице тренировок
+def epley(weight: np.ndarray, reps: np.ndarray) -> np.ndarray:
+    return weight * (1 + reps / 30)
+
+
+def _day(value: Any) -> Optional[str]:
+    """YYYY-MM-DD из даты или ISO-времени; None для пустых значений"""
+    if isinstance(value, str) and len(value) >= 10 and value[4] == '-' and value[7] == '-':
+        return value[:10]
+    return None
+
+
+def _num(value: float) -> str:
+    """Число для промпта: без хвоста .0 и экспоненты"""
+    return f"{value:.0f}" if float(value).is_integer() else f"{value:.2f}"
+
+
+def _month_label(month: int) -> str:
+    return str(np.datetime64(int(month), 'M'))
+
+
+def _encode(values: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """Словарь значений и коды строк (как pandas.factorize)"""
+    if not values:
+        return np.array([], dtype=object), np.array([], dtype=np.int64)
+    labels, codes = np.unique(np.array(values, dtype=object), return_inverse=True)
+    return labels, codes.astype(np.int64)
+
+
+class AppAnalytics:
+    """Колонки транзакций и подходов и агрегаты по ним
+
+    Выгрузка один раз раскладывается в массивы (даты — datetime64[D],
+    категории и упражнения — целочисленные коды), а все сводки считаются
+    векторно: np.bincount для сумм по группам, сортировка np.lexsort для
+    рекордов внутри групп.
+    """
+
+    def __init__(self, data: Dict[str, Any]):
+        money = data.get('money') or {}
+        transactions = money.get('transactions') if isinstance(money, dict) else money
+        self.currency = (data.get('settings') or {}).get('currency') or 'RUB'
+        self.monthly_budget = money.get('monthlyBudget') if isinstance(money, dict) else None
+
+        # Транзакции
+        days, categories, income, amounts = [], [], [], []
+        for t in transactions or []:
+            day = _day(t.get('date'))
+            if day is None or t.get('type') not in ('income', 'expense'):
+                continue
+            days.append(day)
+            categories.append(t.get('category') or 'Прочее')
+            income.append(t.get('type') == 'income')
+            amounts.append(float(t.get('amount') or 0))
+        self.tx_day = np.array(days, dtype='datetime64[D]')
+        self.tx_month = self.tx_day.astype('datetime64[M]').astype(np.int64)
+        self.tx_income = np.array(income, dtype=bool)
+        self.tx_amount = np.array(amounts, dtype=np.float64)
+        self.categories, self.tx_category = _encode(categories)
+
+        # Тренировки: сессии и подходы
+        session_days, set_days, exercises, reps, weights = [], [], [], [], []
+        for workout in data.get('workouts') or []:
+            day = _day(workout.get('date'))
+            if day is None:
+                continue
+            session_days.append(day)
+            for exercise in workout.get('exercises') or []:
+                sets = exercise.get('sets')
+                if not isinstance(sets, list):
+                    continue
+                for s in sets:
+                    set_days.append(day)
+                    exercises.append((exercise.get('name') or 'Упражнение').strip())
+                    reps.append(float(s.get('reps') or 0))
+                    weights.append(float(s.get('weight') or 0))
+        self.session_day = np.array(session_days, dtype='datetime64[D]')
+        self.set_day = np.array(set_days, dtype='datetime64[D]')
+        self.set_month = self.set_day.astype('datetime64[M]').astype(np.int64)
+        self.set_reps = np.array(reps, dtype=np.float64)
+        self.set_weight = np.array(weights, dtype=np.float64)
+        self.exercises, self.set_exercise = _encode(exercises)
+        self.set_volume = self.set_reps * self.set_weight
+        self.set_e1rm = epley(self.set_weight, self.set_reps)
+
+    @classmethod
+    def from_json(cls, raw: bytes) -> "AppAnalytics":
+        data = orjson.loads(raw)
+        if not isinstance(data, dict):
+            raise ValueError("Ожидается объект AppDataV1")
+        return cls(data)
+
+    # --- Финансы ---
+
+    def monthly(self, months: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Доходы, расходы и баланс по месяцам"""
+        if not self.tx_amount.size:
+            return []
+        first = int(self.tx_month.min())
+        index = self.tx_month - first
+        size = int(index.max()) + 1
+        income = np.bincount(index, np.where(self.tx_income, self.tx_amount, 0), minlength=size)
+        expense = np.bincount(index, np.where(self.tx_income, 0, self.tx_amount), minlength=size)
+        count = np.bincount(index, minlength=size)
+        start = max(0, size - months) if months else 0
+        return [
+            {
+                "month": _month_label(first + i),
+                "income": round(float(income[i]), 2),
+                "expense": round(float(expense[i]), 2),
+                "balance": round(float(income[i] - expense[i]), 2),
+                "transactions": int(count[i]),
+            }
+            for i in range(start, size)
+        ]
+
+    def categories_rollup(self, month: Optional[str] = None, kind: str = 'expense',
+                          top: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Суммы по категориям (за месяц YYYY-MM или за всё время)"""
+        mask = self.tx_income if kind == 'income' else ~self.tx_income
+        if month:
+            mask = mask & (self.tx_month == np.datetime64(month, 'M').astype(np.int64))
+        if not mask.any():
+            return []
+        totals = np.bincount(self.tx_category[mask], self.tx_amount[mask], minlength=len(self.categories))
+        counts = np.bincount(self.tx_category[mask], minlength=len(self.categories))
+        order = np.argsort(-totals)
+        order = order[totals[order] > 0][:top]
+        overall = float(totals.sum())
+        return [
+            {
+                "category": str(self.categories[i]),
+                "total": round(float(totals[i]), 2),
+                "share": round(float(totals[i]) / overall, 4) if overall else 0.0,
+                "transactions": int(counts[i]),
+            }
+            for i in order
+        ]
+
+    def rolling_spend(self, window: int = 30, days: int = 90,
+                      end: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Расходы по дням и скользящая сумма за window дней"""
+        expense = ~self.tx_income
+        if not expense.any():
+            return []
+        last = np.datetime64(end, 'D') if end else self.tx_day[expense].max()
+        first = last - np.timedelta64(days + window - 2, 'D')
+        mask = expense & (self.tx_day >= first) & (self.tx_day <= last)
+        size = int((last - first).astype(np.int64)) + 1
+        daily = np.bincount((self.tx_day[mask] - first).astype(np.int64), self.tx_amount[mask], minlength=size)
+        cumulative = np.concatenate(([0.0], np.cumsum(daily)))
+        rolling = cumulative[window:] - cumulative[:-window]
+        daily = daily[window - 1:]
+        labels = np.arange(first + np.timedelta64(window - 1, 'D'), last + np.timedelta64(1, 'D'))
+        return [
+            {"date": str(labels[i]), "spend": round(float(daily[i]), 2), "rolling": round(float(rolling[i]), 2)}
+            for i in range(len(labels))
+        ]
+
+    # --- Тренировки ---
+
+    def training_volume(self, by: str = 'month', periods: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Тоннаж (повторения × вес), подходы и тренировки по месяцам или неделям"""
+        if not self.set_volume.size:
+            return []
+        if by == 'week':
+            # Недели с понедельника: 1970-01-01 — четверг
+            key = (self.set_day.astype(np.int64) + 3) // 7
+            session_key = (self.session_day.astype(np.int64) + 3) // 7
+        else:
+            key = self.set_month
+            session_key = self.session_day.astype('datetime64[M]').astype(np.int64)
+        first = int(min(key.min(), session_key.min()))
+        size = int(max(key.max(), session_key.max())) - first + 1
+        volume = np.bincount(key - first, self.set_volume, minlength=size)
+        sets = np.bincount(key - first, minlength=size)
+        sessions = np.bincount(session_key - first, minlength=size)
+        start = max(0, size - periods) if periods else 0
+
+        def label(i: int) -> str:
+            if by == 'week':
+                return str(np.datetime64((first + i) * 7 - 3, 'D'))
+            return _month_label(first + i)
+
+        return [
+            {"period": label(i), "volume": round(float(volume[i]), 1), "sets": int(sets[i]),
+             "sessions": int(sessions[i])}
+            for i in range(start, size)
+        ]
+
+    def personal_records(self, top: Optional[int] = 8) -> List[Dict[str, Any]]:
+        """Лучший оценочный 1ПМ по упражнениям (и когда он был)"""
+        if not self.set_e1rm.size:
+            return []
+        # Последний элемент каждой группы после сортировки по (упражнение, 1ПМ) — рекорд
+        order = np.lexsort((self.set_e1rm, self.set_exercise))
+        grouped = self.set_exercise[order]
+        last = np.flatnonzero(np.append(grouped[1:] != grouped[:-1], True))
+        best = order[last]
+        volume = np.bincount(self.set_exercise, self.set_volume, minlength=len(self.exercises))
+        sets = np.bincount(self.set_exercise, minlength=len(self.exercises))
+        ranked = best[np.argsort(-self.set_e1rm[best], kind='stable')][:top]
+        return [
+            {
+                "exercise": str(self.exercises[self.set_exercise[i]]),
+                "e1rm": round(float(self.set_e1rm[i]), 1),
+                "weight": float(self.set_weight[i]),
+                "reps": int(self.set_reps[i]),
+                "date": str(self.set_day[i]),
+                "total_volume": round(float(volume[self.set_exercise[i]]), 1),
+                "sets": int(sets[self.set_exercise[i]]),
+            }
+            for i in ranked if self.set_e1rm[i] > 0
+        ]
+
+    # --- Сводки ---
+
+    def counts(self) -> Dict[str, int]:
+        return {
+            "transactions": int(self.tx_amount.size),
+            "categories": int(len(self.categories)),
+            "workouts": int(self.session_day.size),
+            "sets": int(self.set_volume.size),
+            "exercises": int(len(self.exercises)),
+        }
+
+    def summary(self, today: Optional[str] = None, window: int = 30) -> Dict[str, Any]:
+        """Главное за последний месяц для промпта и /api/stats/summary"""
+        today = today or date_cls.today().isoformat()
+        month = today[:7]
+        start = (date_cls.fromisoformat(today) - timedelta(days=window - 1)).isoformat()
+        monthly = {m["month"]: m for m in self.monthly()}
+        previous = str(np.datetime64(month, 'M') - np.timedelta64(1, 'M'))
+
+        in_window = (self.set_day >= np.datetime64(start, 'D')) & (self.set_day <= np.datetime64(today, 'D'))
+        sessions_in_window = (self.session_day >= np.datetime64(start, 'D')) & \
+                             (self.session_day <= np.datetime64(today, 'D'))
+        spend_window = (~self.tx_income) & (self.tx_day >= np.datetime64(start, 'D')) & \
+                       (self.tx_day <= np.datetime64(today, 'D'))
+        return {
+            "date": today,
+            "currency": self.currency,
+            "month": monthly.get(month),
+            "previous_month": monthly.get(previous),
+            "monthly_budget": self.monthly_budget,
+            "top_categories": self.categories_rollup(month, top=3),
+            "window_days": window,
+            "window_spend": round(float(self.tx_amount[spend_window].sum()), 2),
+            "window_workouts": int(sessions_in_window.sum()),
+            "window_volume": round(float(self.set_volume[in_window].sum()), 1),
+            "records": self.personal_records(top=3),
+        }
+
+    def prompt_lines(self, today: Optional[str] = None, window: int = 30) -> List[Dict[str, str]]:
+        """Сводка строками для секции промпта"""
+        s = self.summary(today, window)
+        lines = []
+        if s["month"]:
+            m = s["month"]
+            line = f"Месяц {m['month']}: доход {_num(m['income'])} ₽, расход {_num(m['expense'])} ₽"
+            if s["previous_month"]:
+                line += f" (в прошлом месяце расход {_num(s['previous_month']['expense'])} ₽)"
+            if s["monthly_budget"]:
+                line += f", бюджет {_num(s['monthly_budget'])} ₽"
+            lines.append(line)
+        if s["top_categories"]:
+            lines.append("Главные траты месяца: " + ", ".join(
+                f"{c['category']} {_num(c['total'])} ₽" for c in s["top_categories"]
+            ))
+        if s["window_spend"]:
+            lines.append(f"Расходы за {window} дней: {_num(s['window_spend'])} ₽")
+        if s["window_workouts"]:
+            lines.append(f"Тренировок за {window} дней: {s['window_workouts']}, тоннаж {_num(s['window_volume'])} кг")
+        if s["records"]:
+            lines.append("Рекорды (оценка 1ПМ): " + ", ".join(
+                f"{r['exercise']} {_num(r['e1rm'])} кг" for r in s["records"]
+            ))
+        return [{"text": line} for line in lines]
+
+
+class AnalyticsStore:
+    """Последняя загруженная выгрузка: файл на диске и разобранные колонки в памяти
+
+    Файл общий для воркеров: при каждом обращении сверяется его время
+    изменения, и колонки перестраиваются, только если выгрузку заменили.
+    Сводки для промпта кэшируются по дате.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._analytics: Optional[AppAnalytics] = None
+        self._mtime: Optional[float] = None
+        self._prompt_cache: Dict[Tuple[str, int], List[Dict[str, str]]] = {}
+        self.build_ms: Optional[float] = None
+
+    def _build(self, raw: bytes) -> AppAnalytics:
+        started = time.perf_counter()
+        analytics = AppAnalytics.from_json(raw)
+        self.build_ms = round((time.perf_counter() - started) * 1000, 1)
+        return analytics
+
+    def ingest(self, raw: bytes) -> AppAnalytics:
+        """Разобрать и сохранить новую выгрузку (ошибка формата — ValueError)"""
+        try:
+            analytics = self._build(raw)
+        except orjson.JSONDecodeError as e:
+            raise ValueError(f"Неверный JSON: {e}")
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(raw)
+        os.replace(tmp, self.path)
+        with self._lock:
+            self._analytics = analytics
+            self._mtime = os.path.getmtime(self.path)
+            self._prompt_cache.clear()
+        return analytics
+
+    def get(self) -> Optional[AppAnalytics]:
+        """Колонки текущей выгрузки или None, если её ещё не загружали"""
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return None
+        with self._lock:
+            if self._analytics is None or mtime != self._mtime:
+                with open(self.path, 'rb') as f:
+                    self._analytics = self._build(f.read())
+                self._mtime = mtime
+                self._prompt_cache.clear()
+            return self._analytics
+
+    def prompt_lines(self, today: Optional[str], window: int = 30) -> List[Dict[str, str]]:
+        """Сводка для промпта на дату контекста (пусто без выгрузки)"""
+        analytics = self.get()
+        if analytics is None:
+            return []
+        today = _day(today) or date_cls.today().isoformat()
+        key = (today, window)
+        if key not in self._prompt_cache:
+            if len(self._prompt_cache) > 64:
+                self._prompt_cache.clear()
+            try:
+                self._prompt_cache[key] = analytics.prompt_lines(today, window)
+            except ValueError:
+                # Дата контекста вида 2024-13-40
+                return []
+        return self._prompt_cache[key]
+
+    def stats(self) -> Dict[str, Any]:
+        analytics = self._analytics
+        return {
+            "loaded": analytics is not None,
+            "build_ms": self.build_ms,
+            **(analytics.counts() if analytics is not None else {}),
+        }
+
+
+_stores: Dict[str, AnalyticsStore] = {}
+
+
+def get_analytics_store(config: Config) -> AnalyticsStore:
+    """Общее хранилище выгрузки для пути из stats.path"""
+    path = config.get('stats.path', 'data/appdata.json')
+    if path not in _stores:
+        _stores[path] = AnalyticsStore(path)
+    return _stores[path]
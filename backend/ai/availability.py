@@ -0,0 +1,154 @@
+"""
+Кэшированное состояние доступности моделей и фоновый опрос провайдеров
+"""
+from dataclasses import dataclass
+from typing import Dict, Any, Optional, Tuple
+import asyncio
+import random
+import time
+from .core import AIModel, Config
+
+
+@dataclass
+class AvailabilityState:
+    """Последнее известное состояние модели"""
+    available: Optional[bool] = None
+    checked_at: float = 0.0
+    next_check_at: float = 0.0
+    failures: int = 0
+    last_error: Optional[str] = None
+    source: str = "none"
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "available": self.available,
+            "checked_at": self.checked_at,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "source": self.source,
+        }
+
+
+class AvailabilityRegistry:
+    """Общее состояние доступности по (провайдер, модель)
+
+    Чтение — O(1) из словаря; обновление — фоновой задачей по TTL
+    с экспоненциальной задержкой и джиттером после ошибок, а также
+    сразу по итогам реальных запросов к модели.
+    """
+
+    def __init__(self):
+        self._states: Dict[Tuple[str, str], AvailabilityState] = {}
+        self._models: Dict[Tuple[str, str], AIModel] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.ttl = 60.0
+        self.backoff_min = 2.0
+        self.backoff_max = 60.0
+        self.jitter = 0.2
+
+    def configure(self, config: Config):
+        """Параметры опроса из config.yaml (секция availability)"""
+        self.ttl = float(config.get('availability.ttl', 60))
+        self.backoff_min = float(config.get('availability.backoff_min', 2))
+        self.backoff_max = float(config.get('availability.backoff_max', 60))
+        self.jitter = float(config.get('availability.jitter', 0.2))
+
+    def track(self, provider: str, model_name: str, model: AIModel):
+        """Регистрация модели для фонового опроса"""
+        key = (provider, model_name)
+        self._models[key] = model
+        if key not in self._states:
+            self._states[key] = AvailabilityState()
+            self._wake()
+
+    def get(self, provider: str, model_name: str) -> AvailabilityState:
+        """Текущее состояние (без сетевых запросов)"""
+        return self._states.get((provider, model_name)) or AvailabilityState()
+
+    def mark(self, provider: str, model_name: str, available: bool,
+             error: Optional[str] = None, source: str = "request"):
+        """Обновление состояния по результату реального запроса или проверки"""
+        key = (provider, model_name)
+        state = self._states.setdefault(key, AvailabilityState())
+        now = time.monotonic()
+        state.available = available
+        state.checked_at = time.time()
+        state.source = source
+        if available:
+            state.failures = 0
+            state.last_error = None
+            state.next_check_at = now + self._with_jitter(self.ttl)
+        else:
+            state.failures += 1
+            state.last_error = error
+            state.next_check_at = now + self._backoff(state.failures)
+            self._wake()
+
+    def _with_jitter(self, delay: float) -> float:
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def _backoff(self, failures: int) -> float:
+        """Экспоненциальная задержка с полным джиттером"""
+        delay = min(self.backoff_max, self.backoff_min * (2 ** (failures - 1)))
+        return random.uniform(delay / 2, delay)
+
+    def _wake(self):
+        """Разбудить фоновый цикл (mark и track бывают вызваны из asyncio.to_thread)"""
+        if self._wakeup is None or self._loop is None:
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+        except RuntimeError:
+            # Цикл событий уже закрыт (остановка сервера)
+            pass
+
+    async def _probe(self, key: Tuple[str, str], model: AIModel):
+        try:
+            ok = await model.aprobe()
+            self.mark(*key, available=ok, error=None if ok else "probe failed", source="probe")
+        except Exception as e:
+            self.mark(*key, available=False, error=str(e), source="probe")
+
+    async def _run(self):
+        """Фоновый цикл: проверяем модели, у которых истёк срок"""
+        while True:
+            now = time.monotonic()
+            due = [
+                (key, model) for key, model in list(self._models.items())
+                if self._states[key].next_check_at <= now
+            ]
+            if due:
+                await asyncio.gather(*(self._probe(key, model) for key, model in due))
+
+            next_at = min((s.next_check_at for s in self._states.values()), default=now + self.ttl)
+            timeout = max(0.05, next_at - time.monotonic())
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self, config: Config):
+        """Запуск фоновой задачи (при старте приложения)"""
+        self.configure(config)
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._loop = asyncio.get_running_loop()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Остановка фоновой задачи"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+        self._wakeup = None
+        self._loop = None
+
+
+availability = AvailabilityRegistry()
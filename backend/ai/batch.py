@@ -0,0 +1,71 @@
+"""
+Пакетное выполнение запросов к моделям с ограничением параллелизма и частоты
+"""
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+import asyncio
+from .core import Config
+from .rate_limit import RateBudget, use_budget
+
+
+class BatchRunner:
+    """Выполняет элементы пакета параллельно и отдаёт результаты по мере готовности
+
+    Не больше concurrency элементов одновременно; кроме того, запросы
+    к каждой модели проходят через её ведро токенов (batch.rate_per_minute),
+    чтобы ночные задачи не выбирали весь лимит API. Ведро общее для всех
+    пакетов процесса; токен списывается только перед настоящим запросом
+    к провайдеру, ответ из кэша его не тратит.
+    """
+
+    def __init__(self, config: Config):
+        self.concurrency = config.get('batch.concurrency', 4)
+        self.max_items = config.get('batch.max_items', 100)
+        self.budget = RateBudget(
+            config.get('batch.rate_per_minute', 60),
+            config.get('batch.model_rates', {}) or {},
+            config.get('batch.burst', 10),
+        )
+        self.items_total = 0
+        self.items_failed = 0
+
+    async def run(self, items: List[Any], model_of: Callable[[int, Any], Optional[str]],
+                  call: Callable[[int, Any], Awaitable[Dict[str, Any]]]) -> AsyncIterator[Tuple[int, Dict[str, Any]]]:
+        """(индекс, результат) в порядке завершения
+
+        model_of — модель элемента (None — заведомо ошибочный элемент, без
+        лимита частоты). call сам превращает
+        ошибки элемента в результат; если он всё же бросит исключение, оно
+        становится результатом этого элемента, а не всего пакета. При
+        закрытии итератора незавершённые элементы отменяются.
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run_item(index: int, item: Any) -> Tuple[int, Dict[str, Any]]:
+            try:
+                if model_of(index, item) is not None:
+                    # Задача элемента — своя копия контекста: ведро только для неё
+                    use_budget(self.budget)
+                async with semaphore:
+                    result = await call(index, item)
+            except Exception as e:
+                result = {"success": False, "status": 500, "error": str(e)}
+            self.items_total += 1
+            if not result.get("success"):
+                self.items_failed += 1
+            return index, result
+
+        tasks = [asyncio.ensure_future(run_item(i, item)) for i, item in enumerate(items)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "items": self.items_total,
+            "failed": self.items_failed,
+            "concurrency": self.concurrency,
+        }
@@ -0,0 +1,76 @@
+"""
+Кэш списка моделей провайдера (GET /models)
+"""
+from typing import Dict, Any, Optional, Tuple
+import asyncio
+import time
+import httpx
+
+
+class ModelCatalog:
+    """Список моделей провайдера с TTL
+
+    Один запрос /models обслуживает и каталог, и проверки доступности
+    всех моделей провайдера; одновременные обновления объединяются.
+    """
+
+    def __init__(self, base_url: str, ttl: float = 300):
+        self.base_url = base_url
+        self.ttl = ttl
+        self._models: Optional[Dict[str, Dict[str, Any]]] = None
+        self._fetched_at = 0.0
+        self._lock = asyncio.Lock()
+        self.last_error: Optional[str] = None
+
+    def _is_fresh(self, max_age: float) -> bool:
+        return self._models is not None and time.monotonic() - self._fetched_at < max_age
+
+    async def fetch(self, client: httpx.AsyncClient, headers: Dict[str, str],
+                    max_age: Optional[float] = None) -> Dict[str, Dict[str, Any]]:
+        """Список моделей: из кэша, если он моложе max_age, иначе один запрос к API"""
+        max_age = self.ttl if max_age is None else max_age
+        if self._is_fresh(max_age):
+            return self._models
+
+        async with self._lock:
+            # Пока ждали блокировку, список мог обновить другой запрос
+            if self._is_fresh(max_age):
+                return self._models
+            try:
+                response = await client.get(f'{self.base_url}/models', headers=headers)
+                response.raise_for_status()
+                data = response.json().get('data', [])
+            except Exception as e:
+                self.last_error = str(e) or type(e).__name__
+                raise
+
+            models = {}
+            for entry in data:
+                models[entry['id']] = entry
+                for alias in entry.get('aliases') or []:
+                    models.setdefault(alias, entry)
+            self._models = models
+            self._fetched_at = time.monotonic()
+            self.last_error = None
+            return models
+
+    def cached(self) -> Optional[Dict[str, Dict[str, Any]]]:
+        """Последний полученный список (без сетевых запросов)"""
+        return self._models
+
+    def lookup(self, model_name: str) -> Optional[Dict[str, Any]]:
+        """Метаданные модели по имени или алиасу"""
+        if self._models is None:
+            return None
+        return self._models.get(model_name)
+
+
+_catalogs: Dict[Tuple[str, str], ModelCatalog] = {}
+
+
+def get_catalog(base_url: str, api_key: str, ttl: float = 300) -> ModelCatalog:
+    """Общий каталог для пары (base_url, ключ API)"""
+    key = (base_url, api_key or '')
+    if key not in _catalogs:
+        _catalogs[key] = ModelCatalog(base_url, ttl)
+    return _catalogs[key]
@@ -0,0 +1,218 @@
+"""
+Серверное хранилище контекста дня с версиями и дельта-синхронизацией
+"""
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, NamedTuple, Union
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+COLLECTIONS = ('tasks', 'finances', 'workouts', 'diary', 'events', 'notes')
+
+
+class ContextConflict(Exception):
+    """Версия клиента не совпадает с версией на сервере"""
+
+    def __init__(self, date: str, current_version: int):
+        super().__init__(f"Контекст {date} уже имеет версию {current_version}")
+        self.date = date
+        self.current_version = current_version
+
+
+class StoredContext(NamedTuple):
+    """Контекст дня в хранилище"""
+    date: str
+    version: int
+    context: Dict[str, Any]
+    section_versions: Dict[str, int]
+
+    @property
+    def etag(self) -> str:
+        return f'"{self.date}:{self.version}"'
+
+    def section_keys(self) -> Dict[str, str]:
+        """Ключи секций для мемоизации промпта без хэширования данных"""
+        return {name: f"{self.date}:{name}:{v}" for name, v in self.section_versions.items()}
+
+
+class ContextStore:
+    """Контексты по датам в SQLite
+
+    Каждая коллекция (tasks, finances, ...) хранится отдельной строкой со
+    своей версией, поэтому дельта переписывает только затронутые коллекции.
+    Разобранные контексты кэшируются в памяти по (дата, версия) — не
+    больше max_parsed последних дней; версия сверяется с базой на каждом
+    чтении, так что несколько воркеров видят изменения друг друга.
+    """
+
+    def __init__(self, path: str, max_parsed: int = 64):
+        self.path = path
+        self.max_parsed = max_parsed
+        self._db: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._parsed: "OrderedDict[str, StoredContext]" = OrderedDict()
+
+    def _conn(self) -> sqlite3.Connection:
+        """Ленивое открытие базы"""
+        if self._db is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA busy_timeout=5000')
+            db.execute('''
+                CREATE TABLE IF NOT EXISTS contexts (
+                    date TEXT PRIMARY KEY,
+                    version INTEGER NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            ''')
+            db.execute('''
+                CREATE TABLE IF NOT EXISTS sections (
+                    date TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    version INTEGER NOT NULL,
+                    data TEXT NOT NULL,
+                    PRIMARY KEY (date, name)
+                )
+            ''')
+            self._db = db
+        return self._db
+
+    def _current_version(self, db: sqlite3.Connection, date: str) -> int:
+        row = db.execute('SELECT version FROM contexts WHERE date = ?', (date,)).fetchone()
+        return row[0] if row else 0
+
+    def get(self, date: str) -> Optional[StoredContext]:
+        """Контекст дня или None"""
+        with self._lock:
+            db = self._conn()
+            version = self._current_version(db, date)
+            if version == 0:
+                return None
+            cached = self._parsed.get(date)
+            if cached is not None and cached.version == version:
+                self._parsed.move_to_end(date)
+                return cached
+
+            context: Dict[str, Any] = {'date': date}
+            section_versions = {}
+            for name, section_version, data in db.execute(
+                'SELECT name, version, data FROM sections WHERE date = ?', (date,)
+            ):
+                context[name] = json.loads(data)
+                section_versions[name] = section_version
+            for name in COLLECTIONS:
+                context.setdefault(name, [])
+                section_versions.setdefault(name, 0)
+
+            stored = StoredContext(date, version, context, section_versions)
+            self._parsed[date] = stored
+            self._parsed.move_to_end(date)
+            while len(self._parsed) > self.max_parsed:
+                self._parsed.popitem(last=False)
+            return stored
+
+    def _write(self, date: str, base_version: Optional[int],
+               sections: Dict[str, List[Dict[str, Any]]]) -> int:
+        """Запись коллекций с проверкой версии (compare-and-set)"""
+        with self._lock:
+            db = self._conn()
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                current = self._current_version(db, date)
+                if base_version is not None and base_version != current:
+                    raise ContextConflict(date, current)
+                version = current + 1
+                for name, items in sections.items():
+                    db.execute(
+                        'INSERT OR REPLACE INTO sections (date, name, version, data) VALUES (?, ?, ?, ?)',
+                        (date, name, version, json.dumps(items, ensure_ascii=False))
+                    )
+                db.execute(
+                    'INSERT OR REPLACE INTO contexts (date, version, updated_at) VALUES (?, ?, ?)',
+                    (date, version, time.time())
+                )
+                db.execute('COMMIT')
+            except Exception:
+                db.execute('ROLLBACK')
+                raise
+            self._parsed.pop(date, None)
+            return version
+
+    def changed_since(self, timestamp: float) -> List[tuple]:
+        """(дата, версия, время записи) дней, изменённых не раньше timestamp"""
+        with self._lock:
+            return self._conn().execute(
+                'SELECT date, version, updated_at FROM contexts WHERE updated_at >= ? ORDER BY updated_at',
+                (timestamp,)
+            ).fetchall()
+
+    @staticmethod
+    def normalize(context: Dict[str, Any]) -> Dict[str, List[Dict[str, Any]]]:
+        """Коллекции из контекста клиента (money — старое имя finances)"""
+        sections = {name: list(context.get(name) or []) for name in COLLECTIONS}
+        if not sections['finances'] and context.get('money'):
+            sections['finances'] = list(context['money'])
+        return sections
+
+    def put(self, date: str, context: Dict[str, Any], base_version: Optional[int] = None) -> StoredContext:
+        """Полная замена контекста дня"""
+        self._write(date, base_version, self.normalize(context))
+        return self.get(date)
+
+    def apply_delta(self, date: str, base_version: int,
+                    upserts: Dict[str, List[Dict[str, Any]]],
+                    deletes: Dict[str, List[Union[str, int]]]) -> StoredContext:
+        """Применение дельты: upsert по id и удаление по id в каждой коллекции
+
+        Id сравниваются строками (клиент может прислать 7 и "7"); запись
+        без id добавляется как новая.
+        """
+        stored = self.get(date)
+        current = stored.version if stored else 0
+        if base_version != current:
+            raise ContextConflict(date, current)
+
+        changed = {}
+        for name in set(upserts) | set(deletes):
+            if name not in COLLECTIONS:
+                raise ValueError(f"Неизвестная коллекция: {name}")
+            items = list(stored.context.get(name, [])) if stored else []
+            removed = {str(item_id) for item_id in deletes.get(name) or []}
+            if removed:
+                items = [item for item in items if _item_id(item) not in removed]
+            index = {_item_id(item): i for i, item in enumerate(items) if _item_id(item) is not None}
+            for item in upserts.get(name) or []:
+                item_id = _item_id(item)
+                position = index.get(item_id) if item_id is not None else None
+                if position is None:
+                    if item_id is not None:
+                        index[item_id] = len(items)
+                    items.append(item)
+                else:
+                    items[position] = item
+            changed[name] = items
+
+        # base_version ещё раз проверяется внутри транзакции
+        self._write(date, base_version, changed)
+        return self.get(date)
+
+
+def _item_id(item: Dict[str, Any]) -> Optional[str]:
+    item_id = item.get('id')
+    return None if item_id is None else str(item_id)
+
+
+_stores: Dict[str, ContextStore] = {}
+
+
+def get_context_store(path: str, max_parsed: int = 64) -> ContextStore:
+    """Общее хранилище для пути к базе"""
+    if path not in _stores:
+        _stores[path] = ContextStore(path, max_parsed)
+    return _stores[path]
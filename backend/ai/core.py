@@ -2,12 +2,74 @@
 Базовые интерфейсы для AI моделей
 """
 from abc import ABC, abstractmethod
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, AsyncIterator
 from pydantic import BaseModel
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+import asyncio
 import yaml
 import os
 
 
+class UpstreamError(Exception):
+    """Ошибка обращения к провайдеру модели
+    
+    kind: http (ответ с ошибкой), timeout, network, config (нет ключа),
+    circuit_open (модель временно исключена), unavailable, local (сбой
+    локальной модели), rate_limited и overloaded (запрос не допущен к
+    провайдеру нашими лимитами или очередью), deadline (истёк срок
+    запроса клиента).
+    """
+    
+    RETRYABLE_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+    
+    def __init__(self, message: str, kind: str = "http", status_code: Optional[int] = None,
+                 retry_after: Optional[float] = None, model: Optional[str] = None):
+        super().__init__(message)
+        self.message = message
+        self.kind = kind
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.model = model
+    
+    @property
+    def retryable(self) -> bool:
+        """Имеет ли смысл повторить запрос"""
+        if self.kind in ("timeout", "network"):
+            return True
+        return self.kind == "http" and self.status_code in self.RETRYABLE_STATUSES
+    
+    @property
+    def http_status(self) -> int:
+        """HTTP статус для ответа нашего API"""
+        if self.kind in ("timeout", "deadline"):
+            return 504
+        if self.kind in ("config", "circuit_open", "unavailable", "overloaded"):
+            return 503
+        if self.kind == "rate_limited" or self.status_code == 429:
+            return 429
+        if self.kind == "local":
+            return 500
+        return 502
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Заголовок Retry-After: секунды или HTTP-дата"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        moment = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return max(0.0, (moment - datetime.now(timezone.utc)).total_seconds())
+
+
 class AIModel(ABC):
     """Абстрактный класс для AI моделей"""
     
@@ -16,6 +78,43 @@ class AIModel(ABC):
         """Генерация ответа"""
         pass
     
+    async def agenerate(self, messages: List[Dict[str, str]], context: Dict[str, Any], use_cache: bool = True) -> str:
+        """Асинхронная генерация ответа (по умолчанию — синхронная в пуле потоков)"""
+        return await asyncio.to_thread(self.generate, messages, context)
+    
+    async def acompletion(self, messages: List[Dict[str, str]], context: Dict[str, Any], use_cache: bool = True) -> Dict[str, Any]:
+        """Генерация с метаданными {"content", "usage", "cached"}; ошибки — UpstreamError"""
+        content = await self.agenerate(messages, context, use_cache=use_cache)
+        return {"content": content, "usage": None, "cached": False}
+    
+    async def astream(self, messages: List[Dict[str, str]], context: Dict[str, Any], use_cache: bool = True) -> AsyncIterator[Dict[str, Any]]:
+        """Потоковая генерация: события token/done/error (по умолчанию — одним куском)"""
+        text = await self.agenerate(messages, context, use_cache=use_cache)
+        yield {"type": "token", "content": text}
+        yield {"type": "done", "usage": None, "finish_reason": "stop"}
+    
+    @abstractmethod
+    async def acomplete(self, messages: List[Dict[str, str]], max_tokens: int = 500,
+                        temperature: float = 0.3) -> str:
+        """Служебный запрос без контекста дня (резюме, анализ); ошибки — UpstreamError"""
+        pass
+    
+    async def ais_available(self) -> bool:
+        """Асинхронная проверка доступности"""
+        return await asyncio.to_thread(self.is_available)
+    
+    def probe(self) -> bool:
+        """Живая проверка доступности (при явном переключении модели)"""
+        return self.is_available()
+    
+    async def aprobe(self) -> bool:
+        """Живая проверка доступности (для фонового опроса)"""
+        return await asyncio.to_thread(self.probe)
+    
+    def close(self):
+        """Освобождение ресурсов модели"""
+        pass
+    
     @abstractmethod
     def get_info(self) -> Dict[str, Any]:
         """Информация о модели"""
@@ -0,0 +1,107 @@
+"""
+Срок ответа на запрос и отмена работы при отключении клиента
+"""
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Optional
+import asyncio
+import time
+from .core import UpstreamError
+from .metrics import deadline_exceeded, requests_cancelled
+
+
+# Момент (time.monotonic), к которому нужно ответить; задачи запроса наследуют его
+_deadline: ContextVar[Optional[float]] = ContextVar('request_deadline', default=None)
+
+counters = {"cancelled": 0, "expired": 0}
+
+
+class ClientDisconnected(Exception):
+    """Клиент закрыл соединение, не дождавшись ответа"""
+
+
+def parse_timeout(value: Optional[str]) -> Optional[float]:
+    """Заголовок X-Request-Timeout: секунды (дробные можно); ошибка формата — ValueError"""
+    if value is None or not value.strip():
+        return None
+    seconds = float(value)
+    if not seconds > 0:
+        raise ValueError(value)
+    return seconds
+
+
+def start(seconds: Optional[float]):
+    """Срок для текущего запроса: через seconds секунд (None — без срока)"""
+    _deadline.set(time.monotonic() + seconds if seconds else None)
+
+
+def remaining() -> Optional[float]:
+    """Секунд до срока (может быть отрицательным) или None"""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def expired(model: Optional[str] = None) -> UpstreamError:
+    counters["expired"] += 1
+    deadline_exceeded.inc(model or '')
+    return UpstreamError("⏱️ Истёк срок ответа на запрос", kind="deadline", model=model)
+
+
+def upstream_timeout(default: float, model: Optional[str] = None) -> float:
+    """Таймаут обращения к провайдеру: не дольше, чем осталось до срока"""
+    left = remaining()
+    if left is None:
+        return default
+    if left <= 0:
+        raise expired(model)
+    return min(default, left)
+
+
+async def guard(awaitable: Awaitable[Any], receive: Optional[Callable[[], Awaitable[Dict[str, Any]]]] = None,
+                route: str = '', model: Optional[str] = None, enforce: bool = True) -> Any:
+    """Результат awaitable, но не дольше срока запроса и не после ухода клиента
+
+    receive — ASGI receive запроса (тело уже прочитано, поэтому следующее
+    сообщение — http.disconnect). Отключение клиента отменяет работу, в том
+    числе запрос к провайдеру (соединение закрывается), и даёт
+    ClientDisconnected; истёкший срок — UpstreamError kind=deadline.
+    enforce=False — только следить за клиентом (срок соблюдает сама работа).
+    Отменённая работа дожидается завершения до выхода из guard.
+    """
+    work = asyncio.ensure_future(awaitable)
+    watcher = asyncio.ensure_future(_wait_disconnect(receive)) if receive is not None else None
+    try:
+        waiting = {work, watcher} if watcher is not None else {work}
+        left = remaining() if enforce else None
+        done, _ = await asyncio.wait(waiting, timeout=max(0.0, left) if left is not None else None,
+                                     return_when=asyncio.FIRST_COMPLETED)
+        if work in done:
+            return work.result()
+        work.cancel()
+        if watcher is not None and watcher in done:
+            counters["cancelled"] += 1
+            requests_cancelled.inc(route)
+            raise ClientDisconnected()
+        raise expired(model)
+    finally:
+        if watcher is not None:
+            watcher.cancel()
+        if not work.done():
+            work.cancel()
+            await asyncio.wait({work})
+
+
+def record_cancelled(route: str):
+    """Отмена потока ответа (StreamingResponse сам следит за отключением)"""
+    counters["cancelled"] += 1
+    requests_cancelled.inc(route)
+
+
+async def _wait_disconnect(receive: Callable[[], Awaitable[Dict[str, Any]]]):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+
+def stats() -> Dict[str, Any]:
+    return dict(counters)
@@ -0,0 +1,166 @@
+"""
+Сжатие истории диалога перед отправкой модели
+"""
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
+import hashlib
+from .core import Config
+from .model_manager import ModelManager
+from .tokens import estimate_messages_tokens
+
+
+SUMMARY_PREAMBLE = "Краткое содержание предыдущей части диалога:\n{summary}"
+
+SUMMARY_SYSTEM_PROMPT = """Ты сжимаешь переписку пользователя с персональным ассистентом.
+Составь краткое содержание на русском: факты о пользователе, принятые решения,
+договорённости и открытые вопросы. Без вступлений, не более {limit} слов."""
+
+ROLE_NAMES = {'user': 'Пользователь', 'assistant': 'Ассистент', 'system': 'Система'}
+
+
+def _chain_hash(previous: str, message: Dict[str, str]) -> str:
+    """Хэш префикса диалога: хэш предыдущего префикса + очередное сообщение"""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(previous.encode('utf-8'))
+    h.update(b'\x00' + (message.get('role') or '').encode('utf-8'))
+    h.update(b'\x00' + (message.get('content') or '').encode('utf-8'))
+    return h.hexdigest()
+
+
+class HistoryManager:
+    """Свежие сообщения — дословно, более старые — в накопительное резюме
+
+    Граница свёртки сдвигается порциями по fold_chunk сообщений, поэтому
+    резюме пересчитывается раз в несколько ходов и только для новой порции:
+    резюме префикса кэшируется по хэшу этого префикса. Резюме идёт в начало
+    первой дословной реплики пользователя, а не отдельным системным
+    сообщением: канал инструкций остаётся за системным промптом.
+    """
+
+    def __init__(self, max_tokens: int = 4000, keep_recent: int = 6, fold_chunk: int = 8,
+                 summary_max_tokens: int = 400, cache_size: int = 256):
+        self.max_tokens = max_tokens
+        self.keep_recent = keep_recent
+        self.fold_chunk = max(1, fold_chunk)
+        self.summary_max_tokens = summary_max_tokens
+        self.cache_size = cache_size
+        self._summaries: "OrderedDict[str, str]" = OrderedDict()
+        self.summaries_computed = 0
+        self.summaries_reused = 0
+
+    @classmethod
+    def from_config(cls, config: Config) -> Optional["HistoryManager"]:
+        """Менеджер по настройкам history.* (None, если сжатие выключено)"""
+        if not config.get('history.enabled', True):
+            return None
+        return cls(
+            max_tokens=config.get('history.max_tokens', 4000),
+            keep_recent=config.get('history.keep_recent', 6),
+            fold_chunk=config.get('history.fold_chunk', 8),
+            summary_max_tokens=config.get('history.summary_max_tokens', 400),
+        )
+
+    def _split_point(self, messages: List[Dict[str, str]]) -> int:
+        """Индекс первого сообщения, которое уходит дословно"""
+        split = max(0, len(messages) - self.keep_recent)
+        # Сдвигаем границу порциями, чтобы резюме переиспользовалось между ходами
+        split -= split % self.fold_chunk
+
+        # Если даже свежая часть не помещается в бюджет — сворачиваем больше
+        budget = self.max_tokens - self.summary_max_tokens
+        while split < len(messages) - 1 and estimate_messages_tokens(messages[split:]) > budget:
+            split += 1
+
+        # Дословная часть должна начинаться с реплики пользователя
+        while split < len(messages) - 1 and messages[split].get('role') != 'user':
+            split += 1
+        return split
+
+    def _cached_prefix(self, messages: List[Dict[str, str]], split: int) -> Tuple[int, Optional[str], List[str]]:
+        """Самый длинный префикс (не длиннее split) с готовым резюме"""
+        hashes = []
+        current = ''
+        for message in messages[:split]:
+            current = _chain_hash(current, message)
+            hashes.append(current)
+
+        for index in range(split, 0, -1):
+            summary = self._summaries.get(hashes[index - 1])
+            if summary is not None:
+                self._summaries.move_to_end(hashes[index - 1])
+                return index, summary, hashes
+        return 0, None, hashes
+
+    def _remember(self, key: str, summary: str):
+        self._summaries[key] = summary
+        if len(self._summaries) > self.cache_size:
+            self._summaries.popitem(last=False)
+
+    async def _summarize(self, models: ModelManager, model_name: str, previous: Optional[str],
+                         messages: List[Dict[str, str]]) -> str:
+        """Резюме = предыдущее резюме + новые сообщения"""
+        transcript = "\n".join(
+            f"{ROLE_NAMES.get(m.get('role'), m.get('role'))}: {m.get('content', '')}" for m in messages
+        )
+        user_content = f"Новые сообщения:\n{transcript}"
+        if previous:
+            user_content = f"Краткое содержание ранее:\n{previous}\n\n{user_content}"
+
+        limit = max(30, self.summary_max_tokens // 2)
+        result = await models.acomplete(
+            [
+                {"role": "system", "content": SUMMARY_SYSTEM_PROMPT.format(limit=limit)},
+                {"role": "user", "content": user_content},
+            ],
+            max_tokens=self.summary_max_tokens,
+            model_name=model_name,
+        )
+        return result["content"]
+
+    @staticmethod
+    def _fallback_summary(messages: List[Dict[str, str]], limit_chars: int) -> str:
+        """Резюме без модели: начала старых реплик пользователя"""
+        lines = [
+            f"- {m.get('content', '')[:120]}" for m in messages if m.get('role') == 'user'
+        ]
+        return "\n".join(lines)[-limit_chars:]
+
+    async def compact(self, messages: List[Dict[str, str]], models: ModelManager,
+                      model_name: str) -> List[Dict[str, str]]:
+        """Сообщения для отправки модели с учётом бюджета токенов
+
+        Резюме считает model_name через ModelManager.acomplete (повторы и
+        запасные модели, как у чата).
+        """
+        if estimate_messages_tokens(messages) <= self.max_tokens:
+            return messages
+
+        split = self._split_point(messages)
+        if split == 0:
+            return messages
+
+        done, summary, hashes = self._cached_prefix(messages, split)
+        if done == split:
+            self.summaries_reused += 1
+        else:
+            try:
+                summary = await self._summarize(models, model_name, summary, messages[done:split])
+                self._remember(hashes[split - 1], summary)
+                self.summaries_computed += 1
+            except Exception as e:
+                print(f"⚠️ Не удалось сжать историю диалога: {e}")
+                summary = self._fallback_summary(messages[:split], self.summary_max_tokens * 3)
+
+        preamble = SUMMARY_PREAMBLE.format(summary=summary)
+        recent = messages[split:]
+        if recent and recent[0].get('role') == 'user':
+            first = {**recent[0], "content": f"{preamble}\n\n{recent[0].get('content', '')}"}
+            return [first] + recent[1:]
+        return [{"role": "user", "content": preamble}] + recent
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "summaries_cached": len(self._summaries),
+            "summaries_computed": self.summaries_computed,
+            "summaries_reused": self.summaries_reused,
+        }
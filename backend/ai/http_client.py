@@ -0,0 +1,65 @@
+"""
+Общий асинхронный HTTP клиент для обращений к провайдерам
+"""
+from typing import Optional
+import asyncio
+import httpx
+from .core import Config
+
+
+class SharedAsyncClient:
+    """Один httpx.AsyncClient с keep-alive на весь процесс"""
+
+    def __init__(self):
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def _http2_enabled(self, config: Config) -> bool:
+        """HTTP/2 включается только если установлен пакет h2"""
+        if not config.get('mistral.http2', False):
+            return False
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            print("⚠️ HTTP/2 запрошен в конфиге, но пакет h2 не установлен — используем HTTP/1.1")
+            return False
+        return True
+
+    def _build(self, config: Config) -> httpx.AsyncClient:
+        limits = httpx.Limits(
+            max_connections=config.get('mistral.pool.max_connections', 20),
+            max_keepalive_connections=config.get('mistral.pool.max_keepalive_connections', 10),
+            keepalive_expiry=config.get('mistral.pool.keepalive_expiry', 30),
+        )
+        return httpx.AsyncClient(
+            limits=limits,
+            timeout=config.get('mistral.timeout', 30),
+            http2=self._http2_enabled(config),
+        )
+
+    def get(self, config: Config) -> httpx.AsyncClient:
+        """Получение (и ленивое создание) общего клиента"""
+        if self._client is None or self._client.is_closed:
+            self._client = self._build(config)
+        return self._client
+
+    async def prepare(self, config: Config):
+        """Создание клиента в потоке при старте
+
+        Загрузка сертификатов TLS занимает десятки миллисекунд, и в цикле
+        событий она задержала бы первые ответы сервера.
+        """
+        if self._client is None or self._client.is_closed:
+            client = await asyncio.to_thread(self._build, config)
+            if self._client is None or self._client.is_closed:
+                self._client = client
+            else:
+                await client.aclose()
+
+    async def aclose(self):
+        """Закрытие клиента (вызывается при остановке приложения)"""
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
+
+
+shared_client = SharedAsyncClient()
@@ -0,0 +1,249 @@
+"""
+Локальная модель на CPU в отдельных рабочих процессах
+"""
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, AsyncIterator, Dict, List, Optional
+import asyncio
+import multiprocessing
+import time
+
+from .core import AIModel, Config, UpstreamError
+from .availability import availability
+from .prompt import PromptCompiler, get_prompt_compiler
+from .metrics import UpstreamCall, prompt_build, record_usage
+from . import local_worker
+
+
+class LocalWorkerPool:
+    """Пул процессов для инференса с ограниченной очередью
+
+    Инференс идёт в отдельных процессах: он не держит GIL и не блокирует
+    цикл событий API. Процессы живут всё время работы сервера, и загруженные
+    в них модели остаются в памяти. Одновременно выполняется не больше
+    запросов, чем процессов; ещё max_queue ждут, остальные сразу получают
+    отказ (503 с Retry-After), а не копятся без ограничения. Место в пуле
+    освобождается, когда процесс действительно закончил задачу, а не когда
+    запрос перестал её ждать (таймаут, отмена).
+    """
+
+    def __init__(self, config: Config):
+        self.workers = config.get('local.workers', 1)
+        self.max_queue = config.get('local.max_queue', 8)
+        self.timeout = config.get('local.timeout', 120)
+        self.preload = [spec for spec in model_specs(config) if spec.get('preload')]
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self.waiting = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn: дочерние процессы не наследуют потоки и цикл событий сервера
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=local_worker.preload,
+                initargs=(self.preload,),
+            )
+        return self._executor
+
+    async def submit(self, fn, *args) -> Any:
+        """Выполнить fn(*args) в рабочем процессе, дождавшись свободного места"""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.workers)
+        if self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise UpstreamError("Очередь локальной модели переполнена", kind="unavailable", retry_after=1)
+
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        loop = asyncio.get_running_loop()
+        self.running += 1
+        try:
+            job = self._get_executor().submit(fn, *args)
+        except BrokenProcessPool:
+            self._release()
+            self.failed += 1
+            self._executor = None
+            raise UpstreamError("Рабочий процесс локальной модели завершился аварийно", kind="local")
+        job.add_done_callback(lambda _: loop.call_soon_threadsafe(self._release))
+        try:
+            result = await asyncio.wait_for(asyncio.wrap_future(job), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            self.failed += 1
+            raise UpstreamError("Локальная модель не ответила вовремя", kind="timeout")
+        except BrokenProcessPool:
+            # Процесс упал (например, нехватка памяти) — следующий запрос создаст пул заново
+            self.failed += 1
+            self._executor = None
+            raise UpstreamError("Рабочий процесс локальной модели завершился аварийно", kind="local")
+        except Exception:
+            self.failed += 1
+            raise
+        self.completed += 1
+        return result
+
+    def _release(self):
+        """Задача в процессе завершилась (или не была принята): место свободно"""
+        self.running -= 1
+        self._slots.release()
+
+    def warm_up(self):
+        """Запустить процессы (и загрузку моделей с preload) заранее"""
+        if self.preload:
+            executor = self._get_executor()
+            for _ in range(self.workers):
+                executor.submit(local_worker.backend_ready, {'backend': 'echo'})
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "started": self._executor is not None,
+            "running": self.running,
+            "waiting": self.waiting,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+        }
+
+
+def model_specs(config: Config) -> List[Dict[str, Any]]:
+    """Описания локальных моделей из models.local.available"""
+    return list(config.get('models.local.available', []) or [])
+
+
+_pool: Optional[LocalWorkerPool] = None
+
+
+def get_local_pool(config: Config) -> LocalWorkerPool:
+    """Общий пул процессов для всех локальных моделей"""
+    global _pool
+    if _pool is None:
+        _pool = LocalWorkerPool(config)
+    return _pool
+
+
+def shutdown_local_pool():
+    if _pool is not None:
+        _pool.shutdown()
+
+
+class LocalModel(AIModel):
+    """Модель из models.local.available (GGUF через llama.cpp или заглушка echo)"""
+
+    provider = "local"
+
+    def __init__(self, model_name: str, config: Optional[Config] = None):
+        self.model_name = model_name
+        self.config = config or Config()
+        self.spec = next((s for s in model_specs(self.config) if s.get('name') == model_name),
+                         {'name': model_name, 'backend': 'echo'})
+        self.max_tokens = self.spec.get('max_tokens', 512)
+        self.temperature = self.spec.get('temperature', 0.7)
+        self.pool = get_local_pool(self.config)
+        # Окно маленьких моделей узкое: промпт укладываем в половину контекста
+        n_ctx = self.spec.get('n_ctx')
+        self.prompt_compiler = PromptCompiler(max_tokens=n_ctx // 2) if n_ctx else get_prompt_compiler(self.config)
+        self._ready: Optional[bool] = None
+
+        availability.track(self.provider, self.model_name, self)
+
+    def is_available(self) -> bool:
+        """Бэкенд установлен и файл модели на месте (без загрузки модели)"""
+        if self._ready is None:
+            self._ready = local_worker.backend_ready(self.spec)
+        return self._ready
+
+    def probe(self) -> bool:
+        self._ready = None
+        return self.is_available()
+
+    async def aprobe(self) -> bool:
+        return self.probe()
+
+    def _create_system_prompt(self, context: Dict[str, Any]) -> str:
+        started = time.perf_counter()
+        prompt = self.prompt_compiler.compile(context)
+        prompt_build.observe(time.perf_counter() - started, self.model_name)
+        return prompt
+
+    async def _chat(self, messages: List[Dict[str, str]], max_tokens: int, temperature: float) -> Dict[str, Any]:
+        if not self.is_available():
+            raise UpstreamError(f"Локальная модель {self.model_name} не установлена",
+                                kind="config", model=self.model_name)
+        with UpstreamCall(self.model_name) as call:
+            try:
+                result = await self.pool.submit(local_worker.chat, self.spec, messages, max_tokens, temperature)
+            except UpstreamError as e:
+                e.model = self.model_name
+                raise
+            except Exception as e:
+                raise UpstreamError(f"❌ Ошибка локальной модели: {e}", kind="local", model=self.model_name)
+            call.first_byte(200)
+        record_usage(self.model_name, result.get('usage'))
+        return result
+
+    async def acompletion(self, messages: List[Dict[str, str]], context: Dict[str, Any],
+                          use_cache: bool = True) -> Dict[str, Any]:
+        full = [{"role": "system", "content": self._create_system_prompt(context)}] + messages
+        result = await self._chat(full, self.max_tokens, self.temperature)
+        return {"content": result['content'], "usage": result.get('usage'), "cached": False}
+
+    async def agenerate(self, messages: List[Dict[str, str]], context: Dict[str, Any],
+                        use_cache: bool = True) -> str:
+        try:
+            return (await self.acompletion(messages, context, use_cache))['content']
+        except UpstreamError as e:
+            return e.message
+
+    async def astream(self, messages: List[Dict[str, str]], context: Dict[str, Any],
+                      use_cache: bool = True) -> AsyncIterator[Dict[str, Any]]:
+        """Ответ одним событием: генерация идёт в другом процессе целиком"""
+        try:
+            result = await self.acompletion(messages, context, use_cache)
+        except UpstreamError as e:
+            yield {"type": "error", "message": e.message, "error": e}
+            return
+        yield {"type": "token", "content": result['content']}
+        yield {"type": "done", "usage": result['usage'], "finish_reason": "stop"}
+
+    async def acomplete(self, messages: List[Dict[str, str]], max_tokens: int = 500,
+                        temperature: float = 0.3) -> str:
+        return (await self._chat(messages, max_tokens, temperature))['content']
+
+    def generate(self, messages: List[Dict[str, str]], context: Dict[str, Any]) -> str:
+        """Синхронный вызов (вне цикла событий), тоже в рабочем процессе"""
+        full = [{"role": "system", "content": self._create_system_prompt(context)}] + messages
+        try:
+            future = self.pool._get_executor().submit(
+                local_worker.chat, self.spec, full, self.max_tokens, self.temperature
+            )
+            return future.result(timeout=self.pool.timeout)['content']
+        except Exception as e:
+            return f"❌ Ошибка локальной модели: {e}"
+
+    def get_info(self) -> Dict[str, Any]:
+        return {
+            "name": self.model_name,
+            "provider": self.provider,
+            "type": "local",
+            "backend": self.spec.get('backend', 'llama_cpp'),
+            "available": self.is_available(),
+            "availability": availability.get(self.provider, self.model_name).to_dict(),
+            "description": self.spec.get('description', "Локальная модель на CPU"),
+            "context_length": self.spec.get('n_ctx'),
+            "requires_api_key": False,
+            "pool": self.pool.stats(),
+        }
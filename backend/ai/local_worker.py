@@ -0,0 +1,96 @@
+"""
+Код рабочих процессов локальных моделей (выполняется в ProcessPoolExecutor)
+
+Загруженные модели остаются в памяти процесса между запросами, поэтому
+тяжёлая загрузка GGUF выполняется один раз на процесс.
+"""
+from typing import Any, Dict, List
+import os
+
+from .tokens import estimate_messages_tokens, estimate_tokens
+
+
+class EchoBackend:
+    """Заглушка без модели: детерминированный ответ для тестов и офлайн-проверок"""
+
+    def __init__(self, spec: Dict[str, Any]):
+        self.spec = spec
+
+    def chat(self, messages: List[Dict[str, str]], max_tokens: int, temperature: float) -> Dict[str, Any]:
+        question = next((m['content'] for m in reversed(messages) if m['role'] == 'user'), '')
+        content = f"Эхо: {question}"[:max_tokens * 3]
+        return {
+            "content": content,
+            "usage": {
+                "prompt_tokens": estimate_messages_tokens(messages),
+                "completion_tokens": estimate_tokens(content),
+            },
+        }
+
+
+class LlamaCppBackend:
+    """GGUF-модель через llama-cpp-python"""
+
+    def __init__(self, spec: Dict[str, Any]):
+        from llama_cpp import Llama
+
+        self.llm = Llama(
+            model_path=spec['path'],
+            n_ctx=spec.get('n_ctx', 4096),
+            n_threads=spec.get('threads') or None,
+            chat_format=spec.get('chat_format'),
+            verbose=False,
+        )
+
+    def chat(self, messages: List[Dict[str, str]], max_tokens: int, temperature: float) -> Dict[str, Any]:
+        result = self.llm.create_chat_completion(
+            messages=messages, max_tokens=max_tokens, temperature=temperature
+        )
+        return {
+            "content": result['choices'][0]['message']['content'].strip(),
+            "usage": result.get('usage'),
+        }
+
+
+BACKENDS = {
+    'echo': EchoBackend,
+    'llama_cpp': LlamaCppBackend,
+}
+
+_loaded: Dict[str, Any] = {}
+
+
+def backend_ready(spec: Dict[str, Any]) -> bool:
+    """Можно ли загрузить модель (проверка без загрузки, в основном процессе)"""
+    backend = spec.get('backend', 'llama_cpp')
+    if backend == 'echo':
+        return True
+    if backend == 'llama_cpp':
+        import importlib.util
+        return importlib.util.find_spec('llama_cpp') is not None and os.path.exists(spec.get('path') or '')
+    return False
+
+
+def _load(spec: Dict[str, Any]):
+    name = spec['name']
+    if name not in _loaded:
+        backend = spec.get('backend', 'llama_cpp')
+        if backend not in BACKENDS:
+            raise ValueError(f"Неизвестный бэкенд локальной модели: {backend}")
+        _loaded[name] = BACKENDS[backend](spec)
+    return _loaded[name]
+
+
+def preload(specs: List[Dict[str, Any]]):
+    """Инициализатор процесса: заранее загрузить модели"""
+    for spec in specs:
+        try:
+            _load(spec)
+        except Exception as e:
+            print(f"⚠️ Локальная модель {spec.get('name')} не загружена: {e}")
+
+
+def chat(spec: Dict[str, Any], messages: List[Dict[str, str]],
+         max_tokens: int, temperature: float) -> Dict[str, Any]:
+    """Генерация в рабочем процессе"""
+    return _load(spec).chat(messages, max_tokens, temperature)
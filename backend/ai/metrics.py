@@ -0,0 +1,324 @@
+"""
+Метрики в формате Prometheus (без внешних зависимостей)
+"""
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Sequence, Tuple
+import time
+
+import httpx
+
+from .core import UpstreamError
+
+
+# Задержки от единиц миллисекунд (сборка промпта) до минут (длинная генерация)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+
+    def _header(self) -> List[str]:
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(_Metric):
+    """Монотонный счётчик; значения меток передаются позиционно"""
+    kind = 'counter'
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        super().__init__(name, help_text, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        for labels, value in self._values.items():
+            lines.append(f'{self.name}{_format_labels(self.labels, labels)} {_format_value(value)}')
+        return lines
+
+
+class Gauge(Counter):
+    """Значение, которое может уменьшаться (например, запросы в полёте)"""
+    kind = 'gauge'
+
+    def dec(self, *labels: str, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) - amount
+
+
+class Histogram(_Metric):
+    """Гистограмма с фиксированными корзинами
+
+    На наблюдение — один bisect и два сложения; накопительные суммы по
+    корзинам считаются только при выдаче /metrics.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+        # Счётчики по корзинам (последняя — +Inf) и сумма наблюдений
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, *labels: str):
+        row = self._values.get(labels)
+        if row is None:
+            row = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        row[bisect_left(self.buckets, value)] += 1
+        row[-1] += value
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        bounds = self.buckets + (float('inf'),)
+        for labels, row in self._values.items():
+            total = 0
+            for bound, count in zip(bounds, row):
+                total += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labels, labels, le)} {total}')
+            label_text = _format_labels(self.labels, labels)
+            lines.append(f'{self.name}_sum{label_text} {_format_value(row[-1])}')
+            lines.append(f'{self.name}_count{label_text} {total}')
+        return lines
+
+
+class MetricsRegistry:
+    """Набор метрик процесса и их выдача в текстовом формате Prometheus"""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help_text: str, labels: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help_text, labels))
+
+    def gauge(self, name: str, help_text: str, labels: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, help_text, labels))
+
+    def histogram(self, name: str, help_text: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, labels, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+request_duration = registry.histogram(
+    'assistant_request_duration_seconds',
+    'Полное время обработки HTTP запроса (для потока — до последнего события)',
+    ('route', 'method', 'status', 'model'))
+context_validation = registry.histogram(
+    'assistant_context_validation_seconds',
+    'От получения запроса до входа в обработчик: чтение тела и валидация контекста',
+    ('model',))
+prompt_build = registry.histogram(
+    'assistant_prompt_build_seconds',
+    'Сборка системного промпта из контекста дня',
+    ('model',))
+upstream_ttfb = registry.histogram(
+    'assistant_upstream_ttfb_seconds',
+    'От отправки запроса к провайдеру до получения заголовков ответа',
+    ('model',))
+upstream_duration = registry.histogram(
+    'assistant_upstream_duration_seconds',
+    'Полное время запроса к провайдеру',
+    ('model',))
+upstream_inflight = registry.gauge(
+    'assistant_upstream_inflight',
+    'Запросы к провайдеру, выполняющиеся сейчас',
+    ('model',))
+tokens = registry.counter(
+    'assistant_tokens_total',
+    'Токены по данным usage провайдера (in — промпт, out — ответ)',
+    ('model', 'direction'))
+admission_wait = registry.histogram(
+    'assistant_admission_wait_seconds',
+    'Ожидание в очереди допуска к провайдеру (лимиты частоты и токенов)',
+    ('model', 'priority'))
+admission_rejected = registry.counter(
+    'assistant_admission_rejected_total',
+    'Запросы, отклонённые до обращения к провайдеру: rate, queue или timeout',
+    ('model', 'reason'))
+requests_cancelled = registry.counter(
+    'assistant_requests_cancelled_total',
+    'Запросы, прерванные из-за отключения клиента (вызов провайдера отменён)',
+    ('route',))
+deadline_exceeded = registry.counter(
+    'assistant_deadline_exceeded_total',
+    'Запросы, не уложившиеся в срок (X-Request-Timeout или deadline.default)',
+    ('model',))
+cache_requests = registry.counter(
+    'assistant_cache_requests_total',
+    'Обращения к кэшу ответов',
+    ('model', 'result'))
+singleflight_requests = registry.counter(
+    'assistant_singleflight_requests_total',
+    'Одинаковые одновременные запросы: call — новый вызов API, coalesced — ждал уже идущий',
+    ('model', 'result'))
+upstream_errors = registry.counter(
+    'assistant_upstream_errors_total',
+    'Ошибки запросов к провайдеру: HTTP статус или timeout/network',
+    ('model', 'status'))
+
+
+class _RequestState:
+    """Данные текущего HTTP запроса, которые дополняет обработчик"""
+    __slots__ = ('started', 'model')
+
+    def __init__(self, started: float):
+        self.started = started
+        self.model = ''
+
+
+_request_state: ContextVar[Optional[_RequestState]] = ContextVar('metrics_request_state', default=None)
+
+
+class MetricsMiddleware:
+    """ASGI middleware: время запроса по шаблону маршрута, методу, статусу и модели"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        state = _RequestState(time.perf_counter())
+        token = _request_state.set(state)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            _request_state.reset(token)
+            # Шаблон маршрута, а не путь: /api/context/{date} — одна серия
+            route = getattr(scope.get('route'), 'path', None) or 'unmatched'
+            request_duration.observe(time.perf_counter() - state.started,
+                                     route, scope['method'], str(status), state.model)
+
+
+def enter_handler(model: str):
+    """Вызывается в начале обработчика: метка модели и время валидации запроса"""
+    state = _request_state.get()
+    if state is None:
+        return
+    state.model = model
+    context_validation.observe(time.perf_counter() - state.started, model)
+
+
+def record_usage(model: str, usage: Optional[Dict[str, int]]):
+    if not usage:
+        return
+    tokens.inc(model, 'in', amount=usage.get('prompt_tokens') or 0)
+    tokens.inc(model, 'out', amount=usage.get('completion_tokens') or 0)
+
+
+def record_cache(model: str, hit: bool):
+    cache_requests.inc(model, 'hit' if hit else 'miss')
+
+
+# Длительности удачных запросов к провайдеру внутри UpstreamLatencies
+# (для EWMA предохранителя); задачи, созданные в блоке, пишут в тот же список
+_upstream_latencies: ContextVar[Optional[List[float]]] = ContextVar('upstream_latencies', default=None)
+
+
+class UpstreamLatencies:
+    """Сбор длительностей запросов к провайдеру: без ожидания допуска, без ответов из кэша
+
+        with UpstreamLatencies() as latencies:
+            result = await call(model)
+        latencies.samples
+    """
+    __slots__ = ('samples', '_token')
+
+    def __enter__(self) -> 'UpstreamLatencies':
+        self.samples: List[float] = []
+        self._token = _upstream_latencies.set(self.samples)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _upstream_latencies.reset(self._token)
+        return False
+
+
+class UpstreamCall:
+    """Замер одного запроса к провайдеру
+
+        with UpstreamCall(model) as call:
+            response = ...
+            call.first_byte(response.status_code)
+    """
+    __slots__ = ('model', 'started', 'status')
+
+    def __init__(self, model: str):
+        self.model = model
+        self.status: Optional[int] = None
+
+    def __enter__(self) -> 'UpstreamCall':
+        self.started = time.perf_counter()
+        upstream_inflight.inc(self.model)
+        return self
+
+    def first_byte(self, status: int):
+        self.status = status
+        upstream_ttfb.observe(time.perf_counter() - self.started, self.model)
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.started
+        upstream_inflight.dec(self.model)
+        upstream_duration.observe(duration, self.model)
+        samples = _upstream_latencies.get()
+        if samples is not None and exc is None and self.status in (None, 200):
+            samples.append(duration)
+        if self.status is not None and self.status != 200:
+            upstream_errors.inc(self.model, str(self.status))
+        elif isinstance(exc, UpstreamError):
+            upstream_errors.inc(self.model, exc.kind)
+        elif isinstance(exc, httpx.TimeoutException):
+            upstream_errors.inc(self.model, 'timeout')
+        elif isinstance(exc, httpx.TransportError):
+            upstream_errors.inc(self.model, 'network')
+        return False
@@ -3,14 +3,33 @@
 """
 import os
 import httpx
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, AsyncIterator
+import asyncio
 import json
-from .core import AIModel, Config
+from .core import AIModel, Config, UpstreamError, parse_retry_after
+from .http_client import shared_client
+from .availability import availability
+from .catalog import get_catalog
+from .response_cache import ResponseCache, get_response_cache
+from .prompt import get_prompt_compiler
+from .singleflight import singleflight
+from .admission import get_admission
+from . import deadline
+from .rate_limit import spend_budget
+from .tokens import estimate_messages_tokens
+from .tools import DayTools, TOOL_SPECS
+from .metrics import UpstreamCall, prompt_build, record_cache, record_usage
+import time
 
 
 class MistralModel(AIModel):
     """Реализация модели через Mistral API"""
     
+    provider = "mistral"
+    
+    NO_API_KEY_MESSAGE = "❌ Ошибка: Mistral API ключ не установлен. Добавьте MISTRAL_API_KEY в переменные окружения или config.yaml"
+    TIMEOUT_MESSAGE = "❌ Таймаут при обращении к Mistral API. Проверьте интернет-соединение."
+    
     def __init__(self, model_name: str = "mistral-small-latest", config: Optional[Config] = None):
         self.model_name = model_name
         self.config = config or Config()
@@ -18,199 +37,449 @@ class MistralModel(AIModel):
         self.base_url = self.config.get('mistral.base_url', 'https://api.mistral.ai/v1')
         self.timeout = self.config.get('mistral.timeout', 30)
         self.client = None
+        self.catalog = get_catalog(self.base_url, self.api_key, self.config.get('catalog.ttl', 300))
+        self.response_cache = get_response_cache(self.config)
+        self.prompt_compiler = get_prompt_compiler(self.config)
+        self.admission = get_admission(self.config)
+        self.tool_rounds = self.config.get('tools.max_rounds', 3)
+        
+        # Доступность проверяется фоновой задачей, здесь только регистрация
+        availability.track(self.provider, self.model_name, self)
         
+    def _headers(self) -> Dict[str, str]:
+        """Заголовки запросов к API"""
+        return {
+            'Authorization': f'Bearer {self.api_key}',
+            'Content-Type': 'application/json',
+            'Accept': 'application/json'
+        }
+    
     def _get_client(self) -> httpx.Client:
         """Получение HTTP клиента"""
         if self.client is None:
             self.client = httpx.Client(
                 base_url=self.base_url,
-                headers={
-                    'Authorization': f'Bearer {self.api_key}',
-                    'Content-Type': 'application/json',
-                    'Accept': 'application/json'
-                },
+                headers=self._headers(),
                 timeout=self.timeout
             )
         return self.client
     
+    def _get_async_client(self) -> httpx.AsyncClient:
+        """Общий асинхронный клиент с пулом соединений"""
+        return shared_client.get(self.config)
+    
+    def close(self):
+        """Закрытие синхронного HTTP клиента"""
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+    
     def is_available(self) -> bool:
-        """Проверка доступности API"""
+        """Доступность API по кэшированному состоянию (без сетевых запросов)"""
+        if not self.api_key:
+            return False
+        
+        state = availability.get(self.provider, self.model_name)
+        if state.available is None:
+            # Ещё не проверяли — считаем доступной, первый же запрос уточнит
+            return True
+        return state.available
+    
+    async def ais_available(self) -> bool:
+        """Асинхронная проверка доступности (чтение кэша)"""
+        return self.is_available()
+    
+    def probe(self) -> bool:
+        """Живая проверка доступности API с обновлением общего состояния"""
         if not self.api_key:
             return False
         
         try:
             client = self._get_client()
             response = client.get('/models')
-            return response.status_code == 200
-        except:
+            ok = response.status_code == 200
+            availability.mark(self.provider, self.model_name, ok,
+                              error=None if ok else f"HTTP {response.status_code}", source="probe")
+            return ok
+        except Exception as e:
+            availability.mark(self.provider, self.model_name, False, error=str(e), source="probe")
+            return False
+    
+    async def alist_models(self, max_age: Optional[float] = None) -> Dict[str, Dict[str, Any]]:
+        """Список моделей провайдера (общий кэш на все модели с этим ключом)"""
+        return await self.catalog.fetch(self._get_async_client(), self._headers(), max_age=max_age)
+    
+    async def aprobe(self) -> bool:
+        """Асинхронная живая проверка: модель есть в свежем списке /models"""
+        if not self.api_key:
             return False
+        
+        # Короткий max_age объединяет одновременные проверки разных моделей в один запрос
+        await self.alist_models(max_age=1.0)
+        return self.catalog.lookup(self.model_name) is not None
+    
+    def _record_status(self, status_code: int):
+        """Обновление доступности по итогам реального запроса"""
+        if status_code == 200:
+            availability.mark(self.provider, self.model_name, True)
+        # 503 и 429 — перегрузка, а не недоступность: ими занимается предохранитель
+        elif (status_code >= 500 and status_code != 503) or status_code in (401, 403):
+            availability.mark(self.provider, self.model_name, False, error=f"HTTP {status_code}")
     
-    def generate(self, messages: List[Dict[str, str]], context: Dict[str, Any]) -> str:
+    def _record_failure(self, error: Exception):
+        """Сетевая ошибка или таймаут — модель считаем недоступной до проверки"""
+        availability.mark(self.provider, self.model_name, False, error=str(error) or type(error).__name__)
+    
+    def _build_payload(self, messages: List[Dict[str, str]], context: Dict[str, Any], stream: bool = False) -> Dict[str, Any]:
+        """Тело запроса /chat/completions"""
+        # Формируем системное сообщение с контекстом
+        system_message = self._create_system_prompt(context)
+        
+        # Добавляем системное сообщение в начало
+        all_messages = [{"role": "system", "content": system_message}] + messages
+        
+        return {
+            "model": self.model_name,
+            "messages": all_messages,
+            "temperature": 0.7,
+            "max_tokens": 1000,
+            "top_p": 0.95,
+            "stream": stream
+        }
+    
+    def _error_message(self, response: httpx.Response) -> str:
+        """Текст ошибки по неуспешному ответу API"""
+        error_msg = f"❌ Ошибка API: {response.status_code}"
+        try:
+            error_data = response.json()
+            error_msg += f" - {error_data.get('error', {}).get('message', 'Неизвестная ошибка')}"
+        except:
+            error_msg += f" - {response.text}"
+        return error_msg
+    
+    def _cache_key(self, payload: Dict[str, Any], use_cache: bool) -> Optional[str]:
+        """Ключ кэша ответов или None, если кэш выключен или обойдён"""
+        if self.response_cache is None or not use_cache:
+            return None
+        return ResponseCache.make_key(payload)
+    
+    def generate(self, messages: List[Dict[str, str]], context: Dict[str, Any], use_cache: bool = True) -> str:
         """Генерация ответа через Mistral API"""
         if not self.api_key:
-            return "❌ Ошибка: Mistral API ключ не установлен. Добавьте MISTRAL_API_KEY в переменные окружения или config.yaml"
+            return self.NO_API_KEY_MESSAGE
         
         try:
-            # Формируем системное сообщение с контекстом
-            system_message = self._create_system_prompt(context)
-            
-            # Добавляем системное сообщение в начало
-            all_messages = [{"role": "system", "content": system_message}] + messages
+            payload = self._build_payload(messages, context)
+            cache_key = self._cache_key(payload, use_cache)
+            if cache_key:
+                cached = self.response_cache.get(cache_key)
+                record_cache(self.model_name, bool(cached))
+                if cached:
+                    return cached['content']
             
             client = self._get_client()
+            with UpstreamCall(self.model_name) as call:
+                response = client.post('/chat/completions', json=payload)
+                call.first_byte(response.status_code)
+            self._record_status(response.status_code)
+            if response.status_code != 200:
+                return self._error_message(response)
             
-            response = client.post(
-                '/chat/completions',
-                json={
-                    "model": self.model_name,
-                    "messages": all_messages,
-                    "temperature": 0.7,
-                    "max_tokens": 1000,
-                    "top_p": 0.95,
-                    "stream": False
-                }
-            )
-            
-            if response.status_code == 200:
-                data = response.json()
-                return data['choices'][0]['message']['content'].strip()
-            else:
-                error_msg = f"❌ Ошибка API: {response.status_code}"
-                try:
-                    error_data = response.json()
-                    error_msg += f" - {error_data.get('error', {}).get('message', 'Неизвестная ошибка')}"
-                except:
-                    error_msg += f" - {response.text}"
-                return error_msg
+            data = response.json()
+            record_usage(self.model_name, data.get('usage'))
+            content = data['choices'][0]['message']['content'].strip()
+            if cache_key:
+                self.response_cache.put(cache_key, {"content": content, "usage": data.get('usage')})
+            return content
                 
-        except httpx.TimeoutException:
-            return "❌ Таймаут при обращении к Mistral API. Проверьте интернет-соединение."
+        except httpx.TimeoutException as e:
+            self._record_failure(e)
+            return self.TIMEOUT_MESSAGE
+        except httpx.TransportError as e:
+            self._record_failure(e)
+            return f"❌ Ошибка при обращении к Mistral API: {str(e)}"
         except Exception as e:
             return f"❌ Ошибка при обращении к Mistral API: {str(e)}"
     
-    def _create_system_prompt(self, context: Dict[str, Any]) -> str:
-        """Создание системного промпта с контекстом"""
-        prompt = """Ты — полезный персональный AI-ассистент. У тебя есть данные о дне пользователя.
-
-Данные пользователя:"""
+    def _upstream_error(self, response: httpx.Response) -> UpstreamError:
+        """Исключение по неуспешному ответу API"""
+        return UpstreamError(
+            self._error_message(response),
+            status_code=response.status_code,
+            retry_after=parse_retry_after(response.headers.get('Retry-After')),
+            model=self.model_name
+        )
+    
+    def _transport_error(self, error: Exception) -> UpstreamError:
+        """Исключение по таймауту или сетевой ошибке (модель помечается недоступной)"""
+        left = deadline.remaining()
+        if isinstance(error, httpx.TimeoutException) and left is not None and left <= 0.05:
+            # Таймаут урезан сроком клиента — модель в этом не виновата
+            return deadline.expired(self.model_name)
+        self._record_failure(error)
+        if isinstance(error, httpx.TimeoutException):
+            return UpstreamError(self.TIMEOUT_MESSAGE, kind="timeout", model=self.model_name)
+        return UpstreamError(f"❌ Ошибка при обращении к Mistral API: {str(error)}",
+                             kind="network", model=self.model_name)
+    
+    async def acompletion(self, messages: List[Dict[str, str]], context: Dict[str, Any], use_cache: bool = True) -> Dict[str, Any]:
+        """Генерация с метаданными; ошибки API — UpstreamError"""
+        if not self.api_key:
+            raise UpstreamError(self.NO_API_KEY_MESSAGE, kind="config", model=self.model_name)
         
-        # Детализированный контекст
-        detailed_context = f"""
-Дата: {context.get('date', 'Не указана')}
-
-### Задачи:
-"""
-        tasks = context.get('tasks', [])
-        if tasks:
-            for task in tasks:
-                status = "✅ Выполнено" if task.get('completed') or task.get('done') else "❌ Не выполнено"
-                priority = task.get('priority', 'средний')
-                detailed_context += f"- {status} [{priority}]: {task.get('title', 'Без названия')}"
-                if task.get('notes'):
-                    detailed_context += f" — {task['notes']}"
-                detailed_context += "\n"
-        else:
-            detailed_context += "Нет задач\n"
-        
-        detailed_context += "\n### Финансы (детали):\n"
-        finances = context.get('finances', context.get('money', []))
-        if finances:
-            # По категориям
-            income_by_category = {}
-            expenses_by_category = {}
-            
-            for f in finances:
-                category = f.get('category', 'Без категории')
-                amount = f.get('amount', 0)
-                if f.get('type') == 'income':
-                    if category not in income_by_category:
-                        income_by_category[category] = 0
-                    income_by_category[category] += amount
-                elif f.get('type') == 'expense':
-                    if category not in expenses_by_category:
-                        expenses_by_category[category] = 0
-                    expenses_by_category[category] += amount
-            
-            # Доходы
-            if income_by_category:
-                detailed_context += "Доходы:\n"
-                for cat, amt in income_by_category.items():
-                    detailed_context += f"  • {cat}: {amt} ₽\n"
-            
-            # Расходы
-            if expenses_by_category:
-                detailed_context += "Расходы:\n"
-                for cat, amt in expenses_by_category.items():
-                    detailed_context += f"  • {cat}: {amt} ₽\n"
+        payload = self._build_payload(messages, context)
+        cache_key = self._cache_key(payload, use_cache)
+        if cache_key:
+            cached = await self.response_cache.aget(cache_key)
+            record_cache(self.model_name, bool(cached))
+            if cached:
+                return {"content": cached['content'], "usage": cached.get('usage'), "cached": True}
+        
+        # Одинаковые одновременные запросы разделяют один вызов API
+        flight_key = cache_key or ResponseCache.make_key(payload)
+        return await singleflight.do(flight_key, lambda: self._apost_completion(payload, cache_key), self.model_name)
+    
+    async def agenerate(self, messages: List[Dict[str, str]], context: Dict[str, Any], use_cache: bool = True) -> str:
+        """Асинхронная генерация ответа через общий пул соединений (ошибки — текстом)"""
+        try:
+            result = await self.acompletion(messages, context, use_cache=use_cache)
+            return result['content']
+        except UpstreamError as e:
+            return e.message
+        except Exception as e:
+            return f"❌ Ошибка при обращении к Mistral API: {str(e)}"
+    
+    async def _admit(self, payload: Dict[str, Any]) -> float:
+        """Дождаться допуска по лимитам пакета и admission.*; оценка стоимости в токенах"""
+        await spend_budget(self.model_name)
+        if self.admission is None:
+            return 0
+        cost = estimate_messages_tokens(payload['messages']) + payload.get('max_tokens', 0)
+        await self.admission.acquire(self.model_name, cost)
+        return cost
+    
+    def _record_usage(self, cost: float, usage: Optional[Dict[str, int]]):
+        record_usage(self.model_name, usage)
+        if self.admission is not None:
+            self.admission.settle(self.model_name, cost, usage)
+    
+    async def _apost(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """POST /chat/completions с замером времени до заголовков и полного ответа"""
+        cost = await self._admit(payload)
+        client = self._get_async_client()
+        with UpstreamCall(self.model_name) as call:
+            try:
+                async with client.stream(
+                    'POST',
+                    f'{self.base_url}/chat/completions',
+                    json=payload,
+                    headers=self._headers(),
+                    timeout=deadline.upstream_timeout(self.timeout, self.model_name)
+                ) as response:
+                    call.first_byte(response.status_code)
+                    await response.aread()
+            except httpx.TransportError as e:
+                raise self._transport_error(e)
+        
+        self._record_status(response.status_code)
+        if response.status_code != 200:
+            raise self._upstream_error(response)
+        data = response.json()
+        self._record_usage(cost, data.get('usage'))
+        return data
+    
+    async def _apost_completion(self, payload: Dict[str, Any], cache_key: Optional[str]) -> Dict[str, Any]:
+        """Запрос /chat/completions"""
+        data = await self._apost(payload)
+        result = {
+            "content": data['choices'][0]['message']['content'].strip(),
+            "usage": data.get('usage'),
+            "cached": False
+        }
+        if cache_key:
+            await self.response_cache.aput(cache_key, {"content": result['content'], "usage": result['usage']})
+        return result
+    
+    def supports_tools(self) -> bool:
+        """Function calling: по каталогу /models, пока он не загружен — считаем, что да"""
+        capabilities = (self.catalog.lookup(self.model_name) or {}).get('capabilities') or {}
+        return capabilities.get('function_calling', True)
+    
+    async def acompletion_with_tools(self, messages: List[Dict[str, str]], tools: DayTools,
+                                     use_cache: bool = True) -> Dict[str, Any]:
+        """Генерация в режиме инструментов: обзор дня в промпте, записи — вызовами функций
+        
+        Не больше tools.max_rounds раундов с вызовами; последний раунд —
+        с tool_choice none, чтобы модель ответила по уже полученным данным.
+        """
+        if not self.api_key:
+            raise UpstreamError(self.NO_API_KEY_MESSAGE, kind="config", model=self.model_name)
+        
+        started = time.perf_counter()
+        system_message = tools.system_prompt()
+        prompt_build.observe(time.perf_counter() - started, self.model_name)
+        payload = {
+            "model": self.model_name,
+            "messages": [{"role": "system", "content": system_message}] + messages,
+            "temperature": 0.7,
+            "max_tokens": 1000,
+            "top_p": 0.95,
+            "tools": TOOL_SPECS,
+            "tool_choice": "auto",
+            "stream": False
+        }
+        # Данных дня в промпте нет — ключ кэша учитывает их хэш
+        cache_key = None
+        if use_cache and self.response_cache is not None:
+            cache_key = ResponseCache.make_key({**payload, "day": tools.fingerprint()})
+            cached = await self.response_cache.aget(cache_key)
+            record_cache(self.model_name, bool(cached))
+            if cached:
+                return {"content": cached['content'], "usage": cached.get('usage'), "cached": True, "tools": []}
+        
+        flight_key = cache_key or ResponseCache.make_key({**payload, "day": tools.fingerprint()})
+        return await singleflight.do(flight_key, lambda: self._tool_loop(payload, tools, cache_key), self.model_name)
+    
+    async def _tool_loop(self, payload: Dict[str, Any], tools: DayTools, cache_key: Optional[str]) -> Dict[str, Any]:
+        conversation = list(payload['messages'])
+        usage: Dict[str, int] = {}
+        called: List[str] = []
+        for round_index in range(self.tool_rounds + 1):
+            last = round_index == self.tool_rounds
+            data = await self._apost({**payload, "messages": conversation, "tool_choice": "none" if last else "auto"})
+            for key, value in (data.get('usage') or {}).items():
+                if isinstance(value, int):
+                    usage[key] = usage.get(key, 0) + value
+            message = data['choices'][0]['message']
+            calls = message.get('tool_calls') or []
+            if not calls or last:
+                break
+            conversation.append({"role": "assistant", "content": message.get('content') or "", "tool_calls": calls})
+            # search_notes читает индекс истории — вызовы в потоке
+            results = await asyncio.to_thread(
+                lambda: [tools.call(c['function']['name'], c['function'].get('arguments')) for c in calls]
+            )
+            for call, content in zip(calls, results):
+                conversation.append({
+                    "role": "tool",
+                    "name": call['function']['name'],
+                    "content": content,
+                    "tool_call_id": call.get('id'),
+                })
+                called.append(call['function']['name'])
+        
+        result = {
+            "content": (message.get('content') or '').strip(),
+            "usage": usage or None,
+            "cached": False,
+            "tools": called
+        }
+        if cache_key:
+            await self.response_cache.aput(cache_key, {"content": result['content'], "usage": result['usage']})
+        return result
+    
+    async def acomplete(self, messages: List[Dict[str, str]], max_tokens: int = 500,
+                        temperature: float = 0.3) -> str:
+        """Служебный запрос к /chat/completions без системного промпта с контекстом"""
+        if not self.api_key:
+            raise UpstreamError(self.NO_API_KEY_MESSAGE, kind="config", model=self.model_name)
+        
+        data = await self._apost({
+            "model": self.model_name,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "stream": False
+        })
+        return data['choices'][0]['message']['content'].strip()
+    
+    async def astream(self, messages: List[Dict[str, str]], context: Dict[str, Any], use_cache: bool = True) -> AsyncIterator[Dict[str, Any]]:
+        """Потоковая генерация через Mistral API (stream: true)
+        
+        События: token, done и error (с исключением UpstreamError в поле error).
+        """
+        if not self.api_key:
+            error = UpstreamError(self.NO_API_KEY_MESSAGE, kind="config", model=self.model_name)
+            yield {"type": "error", "message": error.message, "error": error}
+            return
+        
+        usage = None
+        finish_reason = None
+        parts = []
+        try:
+            payload = self._build_payload(messages, context, stream=True)
+            cache_key = self._cache_key(payload, use_cache)
+            if cache_key:
+                cached = await self.response_cache.aget(cache_key)
+                record_cache(self.model_name, bool(cached))
+                if cached:
+                    # Ответ из кэша отдаём одним событием
+                    yield {"type": "token", "content": cached['content']}
+                    yield {"type": "done", "usage": cached.get('usage'), "finish_reason": "stop", "cached": True}
+                    return
             
-            # Итого
-            income = sum(f.get('amount', 0) for f in finances if f.get('type') == 'income')
-            expenses = sum(f.get('amount', 0) for f in finances if f.get('type') == 'expense')
-            balance = income - expenses
-            detailed_context += f"Итого: доход {income} ₽, расход {expenses} ₽, баланс {balance} ₽\n"
-        else:
-            detailed_context += "Нет финансовых транзакций\n"
-        
-        detailed_context += "\n### Тренировки:\n"
-        workouts = context.get('workouts', [])
-        if workouts:
-            for workout in workouts:
-                detailed_context += f"- {workout.get('title', 'Без названия')}"
-                if workout.get('exercises'):
-                    detailed_context += f" ({len(workout['exercises'])} упражнений):\n"
-                    for exercise in workout['exercises']:
-                        detailed_context += f"  • {exercise.get('name', 'Упражнение')}: {exercise.get('sets', 0)} подходов, {exercise.get('reps', 0)} повторений, {exercise.get('weight', 0)} кг\n"
-                detailed_context += "\n"
-        else:
-            detailed_context += "Нет тренировок\n"
-        
-        detailed_context += "\n### Дневник:\n"
-        diary = context.get('diary', [])
-        if diary:
-            for entry in diary:
-                detailed_context += f"- Настроение: {entry.get('mood', 'Не указано')}\n"
-                detailed_context += f"  {entry.get('content', 'Нет содержимого')}\n"
-                if entry.get('tags'):
-                    detailed_context += f"  Теги: {', '.join(entry['tags'])}\n"
-        else:
-            detailed_context += "Нет записей в дневнике\n"
-        
-        detailed_context += "\n### События:\n"
-        events = context.get('events', [])
-        if events:
-            for event in events:
-                detailed_context += f"- {event.get('time', '')} {event.get('title', 'Без названия')}\n"
-                if event.get('description'):
-                    detailed_context += f"  {event['description']}\n"
-                if event.get('location'):
-                    detailed_context += f"  Местоположение: {event['location']}\n"
-        else:
-            detailed_context += "Нет событий\n"
-        
-        detailed_context += "\n### Заметки:\n"
-        notes = context.get('notes', [])
-        if notes:
-            for note in notes:
-                detailed_context += f"- {note.get('title', 'Без названия')}\n"
-                if note.get('content'):
-                    detailed_context += f"  {note['content'][:100]}..." if len(note['content']) > 100 else f"  {note['content']}\n"
-                if note.get('tags'):
-                    detailed_context += f"  Теги: {', '.join(note['tags'])}\n"
-        else:
-            detailed_context += "Нет заметок\n"
-        
-        prompt += detailed_context
-        
-        prompt += """
-
-Инструкции:
-1. Используй данные пользователя для персонализированных ответов
-2. Будь дружелюбным и полезным
-3. Отвечай кратко и по делу
-4. Если данных мало, спроси у пользователя подробности
-5. Предлагай конкретные советы и рекомендации
-"""
+            cost = await self._admit(payload)
+            client = self._get_async_client()
+            with UpstreamCall(self.model_name) as call:
+                async with client.stream(
+                    'POST',
+                    f'{self.base_url}/chat/completions',
+                    json=payload,
+                    headers={**self._headers(), 'Accept': 'text/event-stream'},
+                    timeout=deadline.upstream_timeout(self.timeout, self.model_name)
+                ) as response:
+                    call.first_byte(response.status_code)
+                    self._record_status(response.status_code)
+                    if response.status_code != 200:
+                        await response.aread()
+                        error = self._upstream_error(response)
+                        yield {"type": "error", "message": error.message, "error": error}
+                        return
+                    
+                    async for line in response.aiter_lines():
+                        # Формат SSE: строки "data: {...}", завершение — "data: [DONE]"
+                        if not line.startswith('data:'):
+                            continue
+                        data = line[len('data:'):].strip()
+                        if data == '[DONE]':
+                            break
+                        left = deadline.remaining()
+                        if left is not None and left <= 0:
+                            raise deadline.expired(self.model_name)
+                        chunk = json.loads(data)
+                        if chunk.get('usage'):
+                            usage = chunk['usage']
+                        for choice in chunk.get('choices', []):
+                            content = choice.get('delta', {}).get('content')
+                            if content:
+                                parts.append(content)
+                                yield {"type": "token", "content": content}
+                            if choice.get('finish_reason'):
+                                finish_reason = choice['finish_reason']
+        
+        except httpx.TransportError as e:
+            error = self._transport_error(e)
+            yield {"type": "error", "message": error.message, "error": error}
+            return
+        except UpstreamError as e:
+            yield {"type": "error", "message": e.message, "error": e}
+            return
+        except Exception as e:
+            error = UpstreamError(f"❌ Ошибка при обращении к Mistral API: {str(e)}", model=self.model_name)
+            yield {"type": "error", "message": error.message, "error": error}
+            return
         
+        self._record_usage(cost, usage)
+        if cache_key and finish_reason == 'stop':
+            await self.response_cache.aput(cache_key, {"content": ''.join(parts).strip(), "usage": usage})
+        
+        yield {"type": "done", "usage": usage, "finish_reason": finish_reason}
+    
+    def _create_system_prompt(self, context: Dict[str, Any]) -> str:
+        """Создание системного промпта с контекстом"""
+        started = time.perf_counter()
+        prompt = self.prompt_compiler.compile(context)
+        prompt_build.observe(time.perf_counter() - started, self.model_name)
         return prompt
     
     def get_info(self) -> Dict[str, Any]:
@@ -220,7 +489,9 @@ class MistralModel(AIModel):
             "provider": "mistral",
             "type": "api",
             "available": self.is_available(),
+            "availability": availability.get(self.provider, self.model_name).to_dict(),
             "description": "Mistral AI через API",
+            "context_length": (self.catalog.lookup(self.model_name) or {}).get('max_context_length'),
             "requires_api_key": True,
             "api_key_set": bool(self.api_key)
         }
\ No newline at end of file
@@ -1,97 +1,250 @@
 """
-Менеджер для работы с Mistral API моделью
+Менеджер моделей: Mistral API и локальные модели через реестр провайдеров
 """
 from typing import Dict, Any, List, Optional
 from .core import AIModel, Config
 from .mistral_client import MistralModel
+from .availability import availability
+from .providers import create_model, provider_names, provider_of
+from .resilience import ResilientExecutor
+from .settings_store import get_shared_settings
+from .tools import DayTools
+from functools import lru_cache
+import asyncio
 import psutil
 
 
 class ModelManager:
-    """Управление AI моделями"""
+    """Управление AI моделями
+    
+    Модель по умолчанию и модели сессий хранятся в общей SQLite-базе, а не
+    в памяти процесса: при нескольких воркерах uvicorn переключение,
+    сделанное в одном из них, сразу видят остальные.
+    """
     
     def __init__(self, config: Optional[Config] = None):
         self.config = config or Config()
-        self.current_model: Optional[AIModel] = None
-        self.current_provider = "api"
-        self.current_model_name = self.config.get('defaults.model', 'mistral-small-latest')
-        
-        # Загружаем начальную модель
-        self._load_initial_model()
+        self._models: Dict[str, AIModel] = {}
+        self.resilience = ResilientExecutor(self.config)
+        self.settings = get_shared_settings(
+            self.config.get('routing.store_path', 'data/settings.sqlite3'),
+            self.config.get('routing.session_ttl', 7 * 24 * 3600),
+            self.config.get('routing.refresh_interval', 0.5)
+        )
     
-    def _load_initial_model(self):
-        """Загрузка начальной модель"""
+    def warm_up(self) -> str:
+        """Создание модели по умолчанию заранее (регистрирует её для фоновой проверки)
+        
+        В конструкторе модель не создаётся, чтобы импорт main и старт сервера
+        не зависели от базы настроек и сети.
+        """
         model_name = self.current_model_name
         
-        print(f"🎯 Инициализация модели: {model_name} (api)")
+        print(f"🎯 Инициализация модели: {model_name} ({self.provider_of(model_name)})")
         
-        self.current_model = MistralModel(model_name, self.config)
+        self.get_model(model_name)
+        return model_name
+    
+    @property
+    def current_model_name(self) -> str:
+        """Модель по умолчанию (общая для всех воркеров)"""
+        return (self.settings.get_default_model()
+                or self.config.get('defaults.model', 'mistral-small-latest'))
+    
+    @property
+    def cached_model_name(self) -> str:
+        """Модель по умолчанию из снимка настроек, без обращения к базе"""
+        return (self.settings.peek(self.settings.DEFAULT_MODEL_KEY)
+                or self.config.get('defaults.model', 'mistral-small-latest'))
+    
+    @property
+    def current_provider(self) -> str:
+        return self.provider_of(self.current_model_name)
+    
+    def provider_of(self, model_name: str) -> str:
+        """Провайдер модели по каталогу конфига (неизвестные имена — api)"""
+        return provider_of(self.config, model_name) or "api"
+    
+    @property
+    def current_model(self) -> AIModel:
+        return self.get_model(self.current_model_name)
     
     def get_current_model(self) -> AIModel:
         """Получение текущей модели"""
         return self.current_model
     
-    def switch_to_api(self, model_name: str = "mistral-small-latest") -> bool:
-        """Переключение на Mistral API модель"""
-        print(f"🔄 Переключение на API модель: {model_name}")
+    def is_known_model(self, model_name: str) -> bool:
+        """Модель есть в каталоге конфига (у любого провайдера)"""
+        return provider_of(self.config, model_name) is not None
+    
+    def resolve_model_name(self, requested: Optional[str] = None,
+                           session_id: Optional[str] = None) -> str:
+        """Модель для запроса: явно указанная, затем модель сессии, затем по умолчанию"""
+        if requested:
+            return requested
+        if session_id:
+            session_model = self.settings.get_session_model(session_id)
+            if session_model:
+                return session_model
+        return self.current_model_name
+    
+    def get_model(self, model_name: str) -> AIModel:
+        """Экземпляр модели по имени (один на имя, для запасных моделей)"""
+        if model_name not in self._models:
+            self._models[model_name] = create_model(self.provider_of(model_name), model_name, self.config)
+        return self._models[model_name]
+    
+    async def agenerate(self, messages: List[Dict[str, str]], context: Dict[str, Any],
+                        use_cache: bool = True, model_name: Optional[str] = None,
+                        tools: Optional[DayTools] = None) -> Dict[str, Any]:
+        """Генерация с повторами и запасными моделями
         
-        new_model = MistralModel(model_name, self.config)
+        Возвращает {"content", "usage", "cached", "model"}; если ни одна модель
+        цепочки не ответила — UpstreamError с последней ошибкой. С tools модели
+        с function calling работают в режиме инструментов, остальные получают
+        полный промпт.
+        """
+        primary = model_name or self.current_model_name
         
-        if new_model.is_available():
-            self.current_model = new_model
-            self.current_provider = "api"
-            self.current_model_name = model_name
-            
-            # Сохраняем в конфиг
-            self.config.set('defaults.provider', 'api')
-            self.config.set('defaults.model', model_name)
-            
-            print(f"✅ Переключено на {model_name}")
-            return True
-        else:
-            print(f"❌ API модель {model_name} недоступна")
+        def call(model: AIModel):
+            if tools is not None and getattr(model, 'supports_tools', lambda: False)():
+                return model.acompletion_with_tools(messages, tools, use_cache=use_cache)
+            return model.acompletion(messages, context, use_cache=use_cache)
+        
+        result, used = await self.resilience.run(primary, self.get_model, call)
+        if used != primary:
+            print(f"↪️ Ответ получен от запасной модели {used}")
+        return {**result, "model": used}
+    
+    async def acomplete(self, messages: List[Dict[str, str]], max_tokens: int = 500,
+                        temperature: float = 0.3, model_name: Optional[str] = None) -> Dict[str, Any]:
+        """Служебный запрос (анализ) с повторами и запасными моделями: {"content", "model"}"""
+        primary = model_name or self.current_model_name
+        content, used = await self.resilience.run(
+            primary, self.get_model,
+            lambda model: model.acomplete(messages, max_tokens=max_tokens, temperature=temperature)
+        )
+        return {"content": content, "model": used}
+    
+    async def aswitch_to_api(self, model_name: str = "mistral-small-latest",
+                             session_id: Optional[str] = None) -> bool:
+        """Переключение модели (любого провайдера; имя метода историческое)
+        
+        С session_id меняется только модель этой сессии, без него — модель
+        по умолчанию. config.yaml не переписывается: выбор хранится в общей
+        базе настроек и переживает перезапуск. Модель создаётся в цикле
+        событий (как при обычных запросах), в поток уходят только живая
+        проверка и запись в базу.
+        """
+        target = f"сессии {session_id}" if session_id else "по умолчанию"
+        print(f"🔄 Переключение на модель {model_name} ({target})")
+        
+        new_model = self.get_model(model_name)
+        
+        # Явное переключение — единственное место с живой проверкой
+        if not await asyncio.to_thread(new_model.probe):
+            print(f"❌ Модель {model_name} недоступна")
             return False
+        
+        if session_id:
+            await asyncio.to_thread(self.settings.set_session_model, session_id, model_name)
+        else:
+            await asyncio.to_thread(self.settings.set_default_model, model_name)
+        
+        print(f"✅ Переключено на {model_name}")
+        return True
     
-    def get_available_models(self) -> Dict[str, List[Dict[str, Any]]]:
-        """Получение списка доступных моделей"""
-        available = {
-            "api": []
-        }
+    def close(self):
+        """Закрытие клиентов всех созданных моделей"""
+        for model in self._models.values():
+            model.close()
+    
+    def _api_model(self) -> Optional[MistralModel]:
+        """Любая модель Mistral: через неё доступен общий каталог провайдера"""
+        current_model = self.current_model
+        if isinstance(current_model, MistralModel):
+            return current_model
+        api_models = self.config.get('models.api.available', []) or []
+        return self.get_model(api_models[0]['name']) if api_models else None
+    
+    async def refresh_catalog(self):
+        """Обновление списка моделей провайдера, если истёк TTL"""
+        api_model = self._api_model()
+        if api_model is None or not api_model.api_key:
+            return
+        try:
+            await api_model.alist_models()
+        except Exception as e:
+            print(f"⚠️ Не удалось получить список моделей: {e}")
+    
+    def get_available_models(self, current_name: Optional[str] = None) -> Dict[str, List[Dict[str, Any]]]:
+        """Получение списка доступных моделей (из кэша каталога, без запросов)"""
+        available = {name: [] for name in provider_names()}
+        
+        current_name = current_name or self.current_model_name
+        api_model = self._api_model()
+        catalog = api_model.catalog if api_model else None
+        listing = catalog.cached() if catalog else None
+        api_key_set = bool(getattr(api_model, 'api_key', None))
         
-        # API модели
+        # API модели: каталог из конфига + метаданные провайдера
         api_models = self.config.get('models.api.available', [])
         for model in api_models:
             model_info = model.copy()
             model_info['provider'] = 'api'
             model_info['type'] = 'api'
-            model_info['current'] = (
-                self.current_provider == 'api' and 
-                self.current_model_name == model['name']
-            )
+            model_info['current'] = current_name == model['name']
             
-            # Проверяем доступность Mistral
-            if model['name'].startswith('mistral'):
-                test_model = MistralModel(model['name'], self.config)
-                model_info['available'] = test_model.is_available()
+            entry = catalog.lookup(model['name']) if catalog else None
+            if not api_key_set:
+                model_info['available'] = False
+            elif listing is not None:
+                model_info['available'] = entry is not None
+            else:
+                model_info['available'] = bool(availability.get(MistralModel.provider, model['name']).available)
+            
+            if entry:
+                model_info['context_length'] = entry.get('max_context_length')
+                model_info['capabilities'] = entry.get('capabilities', {})
+                model_info['aliases'] = entry.get('aliases', [])
+                if not model_info.get('description') and entry.get('description'):
+                    model_info['description'] = entry['description']
             
             available['api'].append(model_info)
         
+        # Локальные модели: доступность — установлен ли бэкенд и файл модели
+        for model in self.config.get('models.local.available', []) or []:
+            model_info = {k: v for k, v in model.items() if k != 'path'}
+            model_info['provider'] = 'local'
+            model_info['type'] = 'local'
+            model_info['current'] = current_name == model['name']
+            model_info['available'] = self.get_model(model['name']).is_available()
+            model_info['context_length'] = model.get('n_ctx')
+            available['local'].append(model_info)
+        
         return available
     
-    def get_system_info(self) -> Dict[str, Any]:
+    def get_system_info(self, model_name: Optional[str] = None) -> Dict[str, Any]:
         """Информация о системе"""
+        model_name = model_name or self.current_model_name
         info = {
-            "system": {
-                "cuda_available": False,
-                "torch_version": "N/A",
-                "cpu_cores": psutil.cpu_count(),
-                "total_ram_gb": psutil.virtual_memory().total / 1e9,
-            },
+            "system": dict(static_system_info()),
             "current_model": {
-                "provider": self.current_provider,
-                "name": self.current_model_name,
-                "available": self.current_model.is_available() if self.current_model else False,
+                "provider": self.provider_of(model_name),
+                "name": model_name,
+                "available": self.get_model(model_name).is_available(),
             }
         }
         
-        return info
\ No newline at end of file
+        return info
+
+
+@lru_cache(maxsize=1)
+def static_system_info() -> Dict[str, Any]:
+    """Неизменные за время работы процесса сведения о машине (считаются один раз)"""
+    return {
+        "cuda_available": False,
+        "torch_version": "N/A",
+        "cpu_cores": psutil.cpu_count(),
+        "total_ram_gb": psutil.virtual_memory().total / 1e9,
+    }
@@ -0,0 +1,261 @@
+"""
+Профилирование отдельных запросов по запросу клиента (заголовок X-Profile или ?profile=)
+"""
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+import cProfile
+import io
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+from starlette.datastructures import Headers, MutableHeaders
+
+
+MODES = ('cprofile', 'sample')
+
+# Функции, в которых поток просто ждёт: такие потоки не попадают в speedscope
+_IDLE = {'wait', 'select', 'poll', 'epoll', 'get', 'acquire', '_worker', 'sleep', 'accept'}
+
+
+class StackSampler(threading.Thread):
+    """Статистический профилировщик: стеки всех потоков каждые interval секунд
+
+    Не замедляет профилируемый код (в отличие от cProfile), поэтому
+    соотношение этапов запроса видно честно; время в потоках
+    asyncio.to_thread тоже попадает в профиль.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        super().__init__(name='profile-sampler', daemon=True)
+        self.interval = interval
+        self.samples: Dict[int, List[Tuple[float, Tuple[Tuple[str, str, int], ...]]]] = {}
+        self.thread_names: Dict[int, str] = {}
+        self._stopped = threading.Event()
+
+    def run(self):
+        previous = time.perf_counter()
+        while not self._stopped.wait(self.interval):
+            now = time.perf_counter()
+            weight, previous = now - previous, now
+            for ident, frame in sys._current_frames().items():
+                if ident == self.ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+                    frame = frame.f_back
+                stack.reverse()
+                self.samples.setdefault(ident, []).append((weight, tuple(stack)))
+        self.thread_names = {t.ident: t.name for t in threading.enumerate()}
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+class Profile:
+    """Снятый профиль запроса и его выгрузка в pstats, speedscope или текст"""
+
+    def __init__(self, mode: str, method: str, path: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.mode = mode
+        self.method = method
+        self.path = path
+        self.status: Optional[int] = None
+        self.created_at = datetime.now()
+        self.duration = 0.0
+        self.loop_thread = threading.get_ident()
+        self._profiler: Optional[cProfile.Profile] = None
+        self._sampler: Optional[StackSampler] = None
+
+    def start(self, interval: float):
+        self._started = time.perf_counter()
+        if self.mode == 'sample':
+            self._sampler = StackSampler(interval)
+            self._sampler.start()
+        else:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+
+    def stop(self):
+        if self._profiler is not None:
+            self._profiler.disable()
+            self._profiler.create_stats()
+        if self._sampler is not None:
+            self._sampler.stop()
+        self.duration = time.perf_counter() - self._started
+
+    @property
+    def formats(self) -> Tuple[str, ...]:
+        return ('pstats', 'text') if self.mode == 'cprofile' else ('speedscope', 'text')
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "mode": self.mode,
+            "method": self.method,
+            "path": self.path,
+            "status": self.status,
+            "duration_ms": round(self.duration * 1000, 1),
+            "created_at": self.created_at.isoformat(),
+            "formats": list(self.formats),
+        }
+
+    def pstats(self) -> bytes:
+        """Формат pstats (как cProfile.dump_stats): python -m pstats файл, snakeviz"""
+        return marshal.dumps(self._profiler.stats)
+
+    def text(self, limit: int = 60) -> str:
+        if self._profiler is not None:
+            buffer = io.StringIO()
+            stats = pstats.Stats(self._profiler, stream=buffer)
+            stats.sort_stats('cumulative').print_stats(limit)
+            return buffer.getvalue()
+        # Свёрнутые стеки (flamegraph.pl, speedscope): "поток;f1;f2 число_мс"
+        lines = []
+        for ident, stacks in self._busy_threads():
+            counts: Dict[str, float] = {}
+            for weight, stack in stacks:
+                key = ';'.join([self._thread_name(ident)] + [f"{name} ({os.path.basename(file)})" for name, file, _ in stack])
+                counts[key] = counts.get(key, 0.0) + weight
+            lines.extend(f"{key} {round(ms * 1000, 3)}" for key, ms in counts.items())
+        return '\n'.join(lines) + '\n'
+
+    def speedscope(self) -> Dict[str, Any]:
+        """Формат https://www.speedscope.app: профиль на каждый занятый поток"""
+        frames: List[Dict[str, Any]] = []
+        index: Dict[Tuple[str, str, int], int] = {}
+        profiles = []
+        for ident, stacks in self._busy_threads():
+            samples, weights = [], []
+            for weight, stack in stacks:
+                sample = []
+                for frame in stack:
+                    if frame not in index:
+                        index[frame] = len(frames)
+                        frames.append({"name": frame[0], "file": frame[1], "line": frame[2]})
+                    sample.append(index[frame])
+                samples.append(sample)
+                weights.append(round(weight * 1000, 3))
+            profiles.append({
+                "type": "sampled",
+                "name": self._thread_name(ident),
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": round(sum(weights), 3),
+                "samples": samples,
+                "weights": weights,
+            })
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": f"{self.method} {self.path}",
+            "activeProfileIndex": 0,
+            "exporter": "personal-assistant-backend",
+            "shared": {"frames": frames},
+            "profiles": profiles,
+        }
+
+    def _thread_name(self, ident: int) -> str:
+        if ident == self.loop_thread:
+            return 'event loop'
+        return self._sampler.thread_names.get(ident, str(ident))
+
+    def _busy_threads(self):
+        """Поток цикла событий первым, остальные — если хоть раз не ждали"""
+        samples = self._sampler.samples
+        for ident in sorted(samples, key=lambda i: i != self.loop_thread):
+            stacks = samples[ident]
+            if ident == self.loop_thread or any(stack and stack[-1][0] not in _IDLE for _, stack in stacks):
+                yield ident, stacks
+
+
+class ProfileStore:
+    """Последние capacity профилей в памяти (кольцевой буфер)"""
+
+    def __init__(self, capacity: int = 20):
+        self.capacity = capacity
+        self._profiles: "OrderedDict[str, Profile]" = OrderedDict()
+        self.captured = 0
+        self.skipped = 0
+
+    def add(self, profile: Profile):
+        self._profiles[profile.id] = profile
+        self.captured += 1
+        while len(self._profiles) > self.capacity:
+            self._profiles.popitem(last=False)
+
+    def get(self, profile_id: str) -> Optional[Profile]:
+        return self._profiles.get(profile_id)
+
+    def summaries(self) -> List[Dict[str, Any]]:
+        return [p.summary() for p in reversed(self._profiles.values())]
+
+    def stats(self) -> Dict[str, Any]:
+        return {"stored": len(self._profiles), "captured": self.captured, "skipped": self.skipped}
+
+
+class ProfilingMiddleware:
+    """ASGI middleware: профиль запроса с заголовком X-Profile или ?profile=
+
+    Значение выбирает профилировщик: sample — статистический (speedscope),
+    иначе cProfile (pstats). Если задан token, он должен прийти в
+    X-Profile-Token. Одновременно профилируется один запрос: cProfile
+    видит весь поток цикла событий, и соседние профили смешались бы;
+    остальные выполняются без профиля. Id профиля — в заголовке ответа
+    X-Profile-Id. Без флага запрос проходит насквозь.
+    """
+
+    def __init__(self, app, store: ProfileStore, token: Optional[str] = None, interval: float = 0.005):
+        self.app = app
+        self.store = store
+        self.token = token
+        self.interval = interval
+        self._active = False
+
+    def _requested_mode(self, scope) -> Optional[str]:
+        headers = Headers(scope=scope)
+        value = headers.get('x-profile')
+        if value is None and b'profile=' in scope.get('query_string', b''):
+            value = parse_qs(scope['query_string'].decode('latin-1')).get('profile', [None])[0]
+        if not value or value in ('0', 'false'):
+            return None
+        if self.token and headers.get('x-profile-token') != self.token:
+            return None
+        return value if value in MODES else 'cprofile'
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        mode = self._requested_mode(scope)
+        if mode is None:
+            await self.app(scope, receive, send)
+            return
+        if self._active:
+            self.store.skipped += 1
+            await self.app(scope, receive, send)
+            return
+
+        profile = Profile(mode, scope['method'], scope['path'])
+
+        async def send_with_id(message):
+            if message['type'] == 'http.response.start':
+                profile.status = message['status']
+                MutableHeaders(raw=message['headers'])['X-Profile-Id'] = profile.id
+            await send(message)
+
+        self._active = True
+        profile.start(self.interval)
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            profile.stop()
+            self._active = False
+            self.store.add(profile)
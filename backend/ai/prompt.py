@@ -0,0 +1,318 @@
+"""
+Компилятор системного промпта: секции с мемоизацией и бюджет токенов
+"""
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Callable, NamedTuple, Tuple
+import hashlib
+import json
+import marshal
+from .core import Config
+from .tokens import estimate_tokens
+
+
+PROMPT_HEADER = """Ты — полезный персональный AI-ассистент. У тебя есть данные о дне пользователя.
+
+Данные пользователя:"""
+
+PROMPT_INSTRUCTIONS = """
+
+Инструкции:
+1. Используй данные пользователя для персонализированных ответов
+2. Будь дружелюбным и полезным
+3. Отвечай кратко и по делу
+4. Если данных мало, спроси у пользователя подробности
+5. Предлагай конкретные советы и рекомендации
+"""
+
+
+class RenderedSection(NamedTuple):
+    """Отрисованная секция: записи (можно отбрасывать) и итог (оставляем всегда)"""
+    blocks: Tuple[str, ...]
+    summary: str
+    tokens: Tuple[int, ...]
+    summary_tokens: int
+
+
+def _render_tasks(tasks: List[Dict[str, Any]]) -> Tuple[List[str], str]:
+    blocks = []
+    for task in tasks:
+        status = "✅ Выполнено" if task.get('completed') or task.get('done') else "❌ Не выполнено"
+        priority = task.get('priority') or 'средний'
+        line = f"- {status} [{priority}]: {task.get('title') or 'Без названия'}"
+        if task.get('notes'):
+            line += f" — {task['notes']}"
+        blocks.append(line)
+    return blocks, ""
+
+
+def _render_finances(finances: List[Dict[str, Any]]) -> Tuple[List[str], str]:
+    # Один проход: суммы по категориям и итоги
+    income_by_category: Dict[str, float] = {}
+    expenses_by_category: Dict[str, float] = {}
+    for f in finances:
+        category = f.get('category') or 'Без категории'
+        amount = f.get('amount') or 0
+        if f.get('type') == 'income':
+            income_by_category[category] = income_by_category.get(category, 0) + amount
+        elif f.get('type') == 'expense':
+            expenses_by_category[category] = expenses_by_category.get(category, 0) + amount
+
+    blocks = []
+    if income_by_category:
+        blocks.append("Доходы:\n" + "\n".join(f"  • {cat}: {amt} ₽" for cat, amt in income_by_category.items()))
+    if expenses_by_category:
+        blocks.append("Расходы:\n" + "\n".join(f"  • {cat}: {amt} ₽" for cat, amt in expenses_by_category.items()))
+
+    income = sum(income_by_category.values())
+    expenses = sum(expenses_by_category.values())
+    summary = f"Итого: доход {income} ₽, расход {expenses} ₽, баланс {income - expenses} ₽"
+    return blocks, summary
+
+
+def _render_workouts(workouts: List[Dict[str, Any]]) -> Tuple[List[str], str]:
+    blocks = []
+    for workout in workouts:
+        lines = [f"- {workout.get('title') or 'Без названия'}"]
+        exercises = workout.get('exercises') or []
+        if exercises:
+            lines[0] += f" ({len(exercises)} упражнений):"
+            for exercise in exercises:
+                sets = exercise.get('sets') or 0
+                if isinstance(sets, list):
+                    # Формат клиента: список подходов {reps, weight}
+                    done = ", ".join(f"{s.get('reps') or 0}×{s.get('weight') or 0} кг" for s in sets)
+                    lines.append(f"  • {exercise.get('name') or 'Упражнение'}: {len(sets)} подходов ({done})")
+                else:
+                    lines.append(
+                        f"  • {exercise.get('name') or 'Упражнение'}: {sets} подходов, "
+                        f"{exercise.get('reps', 0)} повторений, {exercise.get('weight', 0)} кг"
+                    )
+        blocks.append("\n".join(lines))
+    return blocks, ""
+
+
+def _render_diary(diary: List[Dict[str, Any]]) -> Tuple[List[str], str]:
+    blocks = []
+    for entry in diary:
+        lines = [
+            f"- Настроение: {entry.get('mood') or 'Не указано'}",
+            f"  {entry.get('content') or 'Нет содержимого'}",
+        ]
+        if entry.get('tags'):
+            lines.append(f"  Теги: {', '.join(entry['tags'])}")
+        blocks.append("\n".join(lines))
+    return blocks, ""
+
+
+def _render_events(events: List[Dict[str, Any]]) -> Tuple[List[str], str]:
+    blocks = []
+    for event in events:
+        lines = [f"- {event.get('time') or ''} {event.get('title') or 'Без названия'}"]
+        if event.get('description'):
+            lines.append(f"  {event['description']}")
+        if event.get('location'):
+            lines.append(f"  Местоположение: {event['location']}")
+        blocks.append("\n".join(lines))
+    return blocks, ""
+
+
+def _render_notes(notes: List[Dict[str, Any]]) -> Tuple[List[str], str]:
+    blocks = []
+    for note in notes:
+        lines = [f"- {note.get('title') or 'Без названия'}"]
+        content = note.get('content')
+        if content:
+            lines.append(f"  {content[:100]}..." if len(content) > 100 else f"  {content}")
+        if note.get('tags'):
+            lines.append(f"  Теги: {', '.join(note['tags'])}")
+        blocks.append("\n".join(lines))
+    return blocks, ""
+
+
+def _render_stats(lines: List[Dict[str, Any]]) -> Tuple[List[str], str]:
+    return [f"- {line.get('text')}" for line in lines], ""
+
+
+def _render_retrieved(snippets: List[Dict[str, Any]]) -> Tuple[List[str], str]:
+    return [f"- {s.get('date')}, {s.get('type')}: {s.get('text')}" for s in snippets], ""
+
+
+class SectionSpec(NamedTuple):
+    """Описание секции промпта (empty_text None — пустая секция не выводится)"""
+    name: str
+    title: str
+    empty_text: Optional[str]
+    render: Callable[[List[Dict[str, Any]]], Tuple[List[str], str]]
+    select: Callable[[Dict[str, Any]], List[Dict[str, Any]]]
+
+
+# Порядок секций в промпте
+SECTIONS: List[SectionSpec] = [
+    SectionSpec('tasks', 'Задачи', 'Нет задач', _render_tasks,
+                lambda c: c.get('tasks') or []),
+    SectionSpec('finances', 'Финансы (детали)', 'Нет финансовых транзакций', _render_finances,
+                lambda c: c.get('finances') or c.get('money') or []),
+    SectionSpec('workouts', 'Тренировки', 'Нет тренировок', _render_workouts,
+                lambda c: c.get('workouts') or []),
+    SectionSpec('diary', 'Дневник', 'Нет записей в дневнике', _render_diary,
+                lambda c: c.get('diary') or []),
+    SectionSpec('events', 'События', 'Нет событий', _render_events,
+                lambda c: c.get('events') or []),
+    SectionSpec('notes', 'Заметки', 'Нет заметок', _render_notes,
+                lambda c: c.get('notes') or []),
+    # Сводка по всей выгрузке данных (ai/analytics.py)
+    SectionSpec('stats', 'Статистика за последнее время', None, _render_stats,
+                lambda c: c.get('stats') or []),
+    # Найденное в истории по последнему вопросу (ai/retrieval.py)
+    SectionSpec('retrieved', 'Из прошлых записей', None, _render_retrieved,
+                lambda c: c.get('retrieved') or []),
+]
+
+# Чем меньше число, тем позже секция урезается при нехватке бюджета
+DEFAULT_PRIORITIES = {
+    'tasks': 1,
+    'events': 2,
+    'finances': 3,
+    'diary': 4,
+    'workouts': 5,
+    'notes': 6,
+    'retrieved': 7,
+    'stats': 8,
+}
+
+
+def _section_hash(name: str, items: List[Dict[str, Any]]) -> str:
+    # marshal для JSON-подобных данных на порядок быстрее json.dumps; ключ живёт
+    # только в памяти процесса, поэтому переносимость формата не нужна
+    try:
+        raw = marshal.dumps(items)
+    except ValueError:
+        raw = repr(items).encode('utf-8')
+    return hashlib.blake2b(name.encode('utf-8') + b':' + raw, digest_size=16).hexdigest()
+
+
+class PromptCompiler:
+    """Сборка системного промпта из независимо отрисованных секций
+
+    Каждая секция мемоизируется по хэшу своих данных, поэтому между
+    ходами диалога пересобираются только изменившиеся секции. Если задан
+    бюджет токенов, секции с низким приоритетом урезаются первыми:
+    сначала отбрасываются записи (с пометкой, сколько скрыто), затем
+    секция сворачивается до одной строки-сводки.
+    """
+
+    def __init__(self, max_tokens: Optional[int] = None,
+                 priorities: Optional[Dict[str, int]] = None, memo_size: int = 512):
+        self.max_tokens = max_tokens
+        self.priorities = {**DEFAULT_PRIORITIES, **(priorities or {})}
+        self.memo_size = memo_size
+        self._memo: "OrderedDict[str, RenderedSection]" = OrderedDict()
+        self.memo_hits = 0
+        self.memo_misses = 0
+
+    def _render(self, spec: SectionSpec, items: List[Dict[str, Any]],
+                key: Optional[str] = None) -> RenderedSection:
+        """Отрисовка секции с мемоизацией по хэшу входных данных (или готовому ключу)"""
+        key = key or _section_hash(spec.name, items)
+        cached = self._memo.get(key)
+        if cached is not None:
+            self._memo.move_to_end(key)
+            self.memo_hits += 1
+            return cached
+
+        self.memo_misses += 1
+        blocks, summary = spec.render(items)
+        rendered = RenderedSection(
+            blocks=tuple(blocks),
+            summary=summary,
+            tokens=tuple(estimate_tokens(b) + 1 for b in blocks),
+            summary_tokens=estimate_tokens(summary),
+        )
+        self._memo[key] = rendered
+        if len(self._memo) > self.memo_size:
+            self._memo.popitem(last=False)
+        return rendered
+
+    def _fit(self, rendered: Dict[str, RenderedSection], budget: Optional[int]) -> Dict[str, int]:
+        """Сколько записей каждой секции помещается в бюджет"""
+        keep = {name: len(section.blocks) for name, section in rendered.items()}
+        if budget is None:
+            return keep
+
+        # Итоговые строки и заголовки оставляем всегда
+        remaining = budget - sum(s.summary_tokens + 8 for s in rendered.values())
+        for name in sorted(rendered, key=lambda n: self.priorities.get(n, 100)):
+            section = rendered[name]
+            count = 0
+            for tokens in section.tokens:
+                if tokens > remaining:
+                    break
+                remaining -= tokens
+                count += 1
+            keep[name] = count
+        return keep
+
+    def render_data(self, context: Dict[str, Any], max_tokens: Optional[int] = None) -> str:
+        """Данные дня по секциям (без вступления и инструкций)
+
+        Контекст из серверного хранилища приносит готовые ключи секций
+        (_section_keys: дата + версия коллекции), тогда данные не хэшируются.
+        """
+        section_keys = context.get('_section_keys') or {}
+        rendered = {
+            spec.name: self._render(spec, spec.select(context), section_keys.get(spec.name))
+            for spec in SECTIONS
+        }
+        keep = self._fit(rendered, max_tokens)
+
+        parts = [f"\nДата: {context.get('date') or 'Не указана'}\n"]
+        for spec in SECTIONS:
+            section = rendered[spec.name]
+            lines = [f"\n### {spec.title}:"]
+            total = len(section.blocks)
+            if not total and not section.summary:
+                if spec.empty_text is None:
+                    continue
+                lines.append(spec.empty_text)
+            else:
+                lines.extend(section.blocks[:keep[spec.name]])
+                hidden = total - keep[spec.name]
+                if hidden:
+                    lines.append(f"… ещё {hidden} из {total} записей не показано (лимит контекста)")
+                if section.summary:
+                    lines.append(section.summary)
+            parts.append("\n".join(lines) + "\n")
+        return "".join(parts)
+
+    def compile(self, context: Dict[str, Any]) -> str:
+        """Системный промпт для контекста дня"""
+        budget = None
+        if self.max_tokens:
+            fixed = estimate_tokens(PROMPT_HEADER) + estimate_tokens(PROMPT_INSTRUCTIONS) + 10
+            budget = max(0, self.max_tokens - fixed)
+        return PROMPT_HEADER + self.render_data(context, budget) + PROMPT_INSTRUCTIONS
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sections_cached": len(self._memo),
+            "memo_hits": self.memo_hits,
+            "memo_misses": self.memo_misses,
+            "max_tokens": self.max_tokens,
+        }
+
+
+_compilers: Dict[Tuple[Optional[int], str], PromptCompiler] = {}
+
+
+def get_prompt_compiler(config: Config) -> PromptCompiler:
+    """Общий компилятор (мемо секций разделяется между моделями)"""
+    max_tokens = config.get('prompt.max_tokens')
+    priorities = config.get('prompt.priorities') or {}
+    key = (max_tokens, json.dumps(priorities, sort_keys=True))
+    if key not in _compilers:
+        _compilers[key] = PromptCompiler(
+            max_tokens=max_tokens,
+            priorities=priorities,
+            memo_size=config.get('prompt.memo_size', 512),
+        )
+    return _compilers[key]
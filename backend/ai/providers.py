@@ -0,0 +1,45 @@
+"""
+Реестр провайдеров моделей
+"""
+from typing import Callable, Dict, List, Optional
+from .core import AIModel, Config
+
+
+ProviderFactory = Callable[[str, Config], AIModel]
+
+_providers: Dict[str, ProviderFactory] = {}
+
+
+def register_provider(name: str, factory: ProviderFactory):
+    """Регистрация провайдера: модели из models.<name>.available создаются через factory"""
+    _providers[name] = factory
+
+
+def provider_names() -> List[str]:
+    return list(_providers)
+
+
+def provider_of(config: Config, model_name: str) -> Optional[str]:
+    """Провайдер, в каталоге которого (models.<provider>.available) есть модель"""
+    for name in _providers:
+        for model in config.get(f'models.{name}.available', []) or []:
+            if model.get('name') == model_name:
+                return name
+    return None
+
+
+def create_model(provider: str, model_name: str, config: Config) -> AIModel:
+    if provider not in _providers:
+        raise ValueError(f"Неизвестный провайдер: {provider}")
+    return _providers[provider](model_name, config)
+
+
+def _register_builtin():
+    from .mistral_client import MistralModel
+    from .local_model import LocalModel
+
+    register_provider('api', MistralModel)
+    register_provider('local', LocalModel)
+
+
+_register_builtin()
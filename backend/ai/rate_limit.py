@@ -0,0 +1,86 @@
+"""
+Ограничение частоты запросов к моделям (token bucket)
+"""
+from contextvars import ContextVar
+from typing import Dict, Optional
+import asyncio
+import time
+
+
+class TokenBucket:
+    """Ведро токенов: rate в секунду, не больше capacity подряд
+
+    Ожидающие обслуживаются по очереди (FIFO), поэтому поток запросов
+    выходит равномерным, а не пачками после каждой паузы.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float = 1.0) -> float:
+        """Сколько секунд ждать amount токенов (без списания)"""
+        self._refill()
+        return max(0.0, (amount - self.tokens) / self.rate)
+
+    def try_acquire(self, amount: float = 1.0) -> float:
+        """Списать токены сразу; 0 — списаны, иначе сколько секунд ждать"""
+        self._refill()
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    async def acquire(self, amount: float = 1.0):
+        """Дождаться и списать токены"""
+        async with self._lock:
+            while True:
+                wait = self.try_acquire(amount)
+                if wait == 0:
+                    return
+                await asyncio.sleep(wait)
+
+
+class RateBudget:
+    """Ведро на каждую модель: rate_per_minute по умолчанию и переопределения по именам"""
+
+    def __init__(self, rate_per_minute: float, overrides: Optional[Dict[str, float]] = None,
+                 burst: Optional[float] = None):
+        self.rate_per_minute = rate_per_minute
+        self.overrides = overrides or {}
+        self.burst = burst
+        self._buckets: Dict[str, TokenBucket] = {}
+
+    def bucket(self, model_name: str) -> TokenBucket:
+        if model_name not in self._buckets:
+            rate = self.overrides.get(model_name, self.rate_per_minute) / 60
+            self._buckets[model_name] = TokenBucket(rate, self.burst)
+        return self._buckets[model_name]
+
+    async def acquire(self, model_name: str):
+        await self.bucket(model_name).acquire()
+
+
+# Ведро пакета для запросов текущей задачи (элемента BatchRunner): списывается
+# перед настоящим обращением к провайдеру, ответы из кэша его не тратят
+_budget: ContextVar[Optional[RateBudget]] = ContextVar('rate_budget', default=None)
+
+
+def use_budget(budget: Optional[RateBudget]):
+    """Запросы к провайдеру из текущей задачи (и её подзадач) идут через budget"""
+    _budget.set(budget)
+
+
+async def spend_budget(model_name: str):
+    """Дождаться места в ведре текущего пакета (вне пакета — сразу)"""
+    budget = _budget.get()
+    if budget is not None:
+        await budget.acquire(model_name)
@@ -0,0 +1,248 @@
+"""
+Повторы, предохранители и переключение на запасные модели
+"""
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+import asyncio
+import random
+import time
+from .core import AIModel, Config, UpstreamError
+from . import deadline
+from .metrics import UpstreamLatencies
+
+
+class CircuitBreaker:
+    """Предохранитель модели: closed → open после серии ошибок → half_open
+
+    Дополнительно ведёт экспоненциальное среднее задержки запросов к
+    провайдеру: модель, которая стабильно медленнее SLO, считается
+    деградировавшей. Оценка старше degraded_retry секунд устаревает: модель
+    снова пробуется первой, и новая оценка начинается с чистого листа.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30,
+                 latency_slo: Optional[float] = None, ewma_alpha: float = 0.3,
+                 degraded_retry: float = 60):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.latency_slo = latency_slo
+        self.ewma_alpha = ewma_alpha
+        self.degraded_retry = degraded_retry
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.latency_ewma: Optional[float] = None
+        self.latency_at: Optional[float] = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    @property
+    def latency_stale(self) -> bool:
+        return self.latency_at is None or time.monotonic() - self.latency_at >= self.degraded_retry
+
+    @property
+    def degraded(self) -> bool:
+        return (self.latency_slo is not None and self.latency_ewma is not None
+                and self.latency_ewma > self.latency_slo and not self.latency_stale)
+
+    def allow(self) -> bool:
+        """Можно ли сейчас отправить запрос (в half_open — один пробный)"""
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self, latency: Optional[float] = None):
+        """Удачный запрос; latency — время ответа провайдера (None — ответ из кэша и т. п.)"""
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        if latency is None:
+            return
+        if self.latency_ewma is None or self.latency_stale:
+            self.latency_ewma = latency
+        else:
+            self.latency_ewma += self.ewma_alpha * (latency - self.latency_ewma)
+        self.latency_at = time.monotonic()
+
+    def record_failure(self):
+        self.failures += 1
+        self._trial_in_flight = False
+        if self.failures >= self.failure_threshold or self.opened_at is not None:
+            self.opened_at = time.monotonic()
+
+    def release(self):
+        """Пробный запрос завершился без вердикта (например, отменён)"""
+        self._trial_in_flight = False
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "latency_ewma": self.latency_ewma,
+            "degraded": self.degraded,
+        }
+
+
+class ResilientExecutor:
+    """Выполнение запроса по цепочке моделей: основная, затем запасные
+
+    Для каждой модели — ограниченные повторы с экспоненциальной задержкой
+    и джиттером (с учётом Retry-After) и предохранитель. Модели с открытым
+    предохранителем или недоступные пропускаются, деградировавшие по
+    задержке уходят в конец цепочки. При hedge основной запрос дублируется
+    на запасную модель, если не ответил за hedge_after секунд.
+    """
+
+    def __init__(self, config: Config):
+        self.retries = config.get('resilience.retries', 2)
+        self.backoff_base = config.get('resilience.backoff_base', 0.5)
+        self.backoff_max = config.get('resilience.backoff_max', 8)
+        self.max_retry_after = config.get('resilience.max_retry_after', 20)
+        self.failure_threshold = config.get('resilience.breaker_failures', 5)
+        self.reset_timeout = config.get('resilience.breaker_reset', 30)
+        self.latency_slo = config.get('resilience.latency_slo', 15)
+        self.degraded_retry = config.get('resilience.degraded_retry', 60)
+        self.hedge = config.get('resilience.hedge', False)
+        self.hedge_after = config.get('resilience.hedge_after', 5)
+        self.fallbacks: Dict[str, List[str]] = config.get('resilience.fallbacks', {}) or {}
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self.retries_total = 0
+        self.fallbacks_total = 0
+        self.hedges_total = 0
+
+    def breaker(self, model_name: str) -> CircuitBreaker:
+        if model_name not in self._breakers:
+            self._breakers[model_name] = CircuitBreaker(
+                self.failure_threshold, self.reset_timeout, self.latency_slo,
+                degraded_retry=self.degraded_retry
+            )
+        return self._breakers[model_name]
+
+    def chain(self, primary: str) -> List[str]:
+        """Основная модель и запасные в порядке предпочтения"""
+        chain = [primary] + [m for m in self.fallbacks.get(primary, []) if m != primary]
+        # Медленные модели пробуем после быстрых (порядок сохраняется)
+        return sorted(chain, key=lambda name: self.breaker(name).degraded)
+
+    def _delay(self, attempt: int, retry_after: Optional[float]) -> Optional[float]:
+        """Пауза перед повтором; None — ждать дольше разумного, повтор не делаем"""
+        if retry_after is not None:
+            if retry_after > self.max_retry_after:
+                return None
+            return retry_after + random.uniform(0, self.backoff_base)
+        delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return random.uniform(0, delay)
+
+    async def _attempt(self, name: str, model: AIModel,
+                       call: Callable[[AIModel], Awaitable[Any]]) -> Any:
+        """Запрос к одной модели с повторами"""
+        breaker = self.breaker(name)
+        for attempt in range(self.retries + 1):
+            if not breaker.allow():
+                raise UpstreamError(f"Модель {name} временно исключена после серии ошибок",
+                                    kind="circuit_open", model=name)
+            try:
+                with UpstreamLatencies() as latencies:
+                    result = await call(model)
+            except UpstreamError as e:
+                if e.retryable:
+                    breaker.record_failure()
+                else:
+                    breaker.release()
+                delay = self._delay(attempt, e.retry_after) if e.retryable else None
+                left = deadline.remaining()
+                if delay is None or attempt == self.retries or (left is not None and delay >= left):
+                    raise
+                self.retries_total += 1
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                breaker.release()
+                raise
+            # Ответ из кэша или общего вызова (single-flight) о провайдере не говорит
+            samples = latencies.samples
+            breaker.record_success(sum(samples) / len(samples) if samples else None)
+            return result
+
+    async def _hedged(self, primary: Tuple[str, AIModel], secondary: Tuple[str, AIModel],
+                      call: Callable[[AIModel], Awaitable[Any]]) -> Tuple[Any, str]:
+        """Основной запрос; если он долго не отвечает — параллельно запасной
+
+        Если основной запрос успел завершиться ошибкой раньше, запасной
+        запускается сразу, так что обе модели пары всегда опробованы.
+        """
+        first = asyncio.ensure_future(self._attempt(primary[0], primary[1], call))
+        tasks = {first: primary[0]}
+        try:
+            done, _ = await asyncio.wait({first}, timeout=self.hedge_after)
+            if done and first.exception() is None:
+                return first.result(), primary[0]
+            if not done:
+                self.hedges_total += 1
+            tasks[asyncio.ensure_future(self._attempt(secondary[0], secondary[1], call))] = secondary[0]
+
+            pending = set(tasks)
+            last_error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result(), tasks[task]
+                    last_error = task.exception()
+            raise last_error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def run(self, primary: str, get_model: Callable[[str], AIModel],
+                  call: Callable[[AIModel], Awaitable[Any]]) -> Tuple[Any, str]:
+        """Результат и имя модели, которая его дала; иначе — последняя ошибка"""
+        candidates = []
+        for name in self.chain(primary):
+            model = get_model(name)
+            if model.is_available() and self.breaker(name).state != "open":
+                candidates.append((name, model))
+
+        if not candidates:
+            raise UpstreamError("Текущая модель недоступна. Проверьте подключение к Mistral API или установку локальной модели.",
+                                kind="unavailable", model=primary)
+
+        last_error: Optional[UpstreamError] = None
+        index = 0
+        while index < len(candidates):
+            name, model = candidates[index]
+            if index > 0:
+                self.fallbacks_total += 1
+            try:
+                if self.hedge and index + 1 < len(candidates):
+                    result, used = await self._hedged(candidates[index], candidates[index + 1], call)
+                    return result, used
+                return await self._attempt(name, model, call), name
+            except UpstreamError as e:
+                last_error = e
+                # Ошибки запроса (400 и т.п.) на другой модели не исправятся, срок не продлится
+                if e.kind == "http" and not e.retryable and e.status_code not in (401, 403, 404):
+                    raise
+                if e.kind == "deadline":
+                    raise
+            index += 2 if self.hedge and index + 1 < len(candidates) else 1
+
+        raise last_error
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "retries": self.retries_total,
+            "fallbacks": self.fallbacks_total,
+            "hedges": self.hedges_total,
+            "breakers": {name: b.to_dict() for name, b in self._breakers.items()},
+        }
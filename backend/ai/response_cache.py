@@ -0,0 +1,148 @@
+"""
+Дисковый кэш ответов модели (SQLite) с вытеснением по TTL и LRU
+"""
+from typing import Dict, Any, Optional
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from .core import Config
+
+
+class ResponseCache:
+    """Кэш ответов: ключ — хэш запроса, значение — JSON
+
+    Размер ограничен числом записей и суммарным объёмом; при переполнении
+    удаляются давно не использованные записи, устаревшие — по TTL.
+    """
+
+    def __init__(self, path: str, ttl: float = 3600, max_entries: int = 1000,
+                 max_bytes: int = 50_000_000):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('''
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        ''')
+        self._db.execute('CREATE INDEX IF NOT EXISTS entries_accessed ON entries(accessed_at)')
+
+    @staticmethod
+    def make_key(payload: Dict[str, Any]) -> str:
+        """Стабильный хэш запроса (модель, сообщения с системным промптом, параметры)"""
+        normalized = {k: v for k, v in payload.items() if k != 'stream'}
+        raw = json.dumps(normalized, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Значение по ключу или None (устаревшие записи удаляются)"""
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                'SELECT value, created_at FROM entries WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                if row is not None:
+                    self._db.execute('DELETE FROM entries WHERE key = ?', (key,))
+                self.misses += 1
+                return None
+            self._db.execute('UPDATE entries SET accessed_at = ? WHERE key = ?', (now, key))
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key: str, value: Dict[str, Any]):
+        """Сохранение значения с последующим вытеснением лишнего"""
+        raw = json.dumps(value, ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO entries (key, value, size, created_at, accessed_at) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (key, raw, len(raw.encode('utf-8')), now, now)
+            )
+            self._evict(now)
+
+    def _evict(self, now: float):
+        """Удаление устаревших записей и самых старых по обращению сверх лимитов"""
+        expired = self._db.execute('DELETE FROM entries WHERE created_at < ?', (now - self.ttl,))
+        self.evictions += expired.rowcount
+
+        count, total = self._db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries').fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+
+        rows = self._db.execute('SELECT key, size FROM entries ORDER BY accessed_at').fetchall()
+        victims = []
+        for key, size in rows:
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            victims.append((key,))
+            count -= 1
+            total -= size
+        self._db.executemany('DELETE FROM entries WHERE key = ?', victims)
+        self.evictions += len(victims)
+
+    async def aget(self, key: str) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self.get, key)
+
+    async def aput(self, key: str, value: Dict[str, Any]):
+        await asyncio.to_thread(self.put, key, value)
+
+    def clear(self):
+        """Полная очистка кэша"""
+        with self._lock:
+            self._db.execute('DELETE FROM entries')
+
+    def stats(self) -> Dict[str, Any]:
+        """Счётчики попаданий/промахов и текущий размер"""
+        with self._lock:
+            count, total = self._db.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries'
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "enabled": True,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": count,
+            "bytes": total,
+        }
+
+
+_caches: Dict[str, ResponseCache] = {}
+
+
+def get_response_cache(config: Config) -> Optional[ResponseCache]:
+    """Общий кэш ответов по настройкам cache.* (None, если выключен)"""
+    if not config.get('cache.enabled', False):
+        return None
+    path = config.get('cache.path', 'data/response_cache.sqlite3')
+    if path not in _caches:
+        _caches[path] = ResponseCache(
+            path,
+            ttl=config.get('cache.ttl', 3600),
+            max_entries=config.get('cache.max_entries', 1000),
+            max_bytes=config.get('cache.max_bytes', 50_000_000),
+        )
+    return _caches[path]
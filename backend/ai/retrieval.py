@@ -0,0 +1,386 @@
+"""
+Поиск по истории записей (BM25) для контекста промпта
+"""
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+import hashlib
+import heapq
+import math
+import re
+import threading
+from .core import Config
+from .tokens import estimate_tokens
+
+
+# --- Токенизация ---
+
+_WORD = re.compile(r'[a-zа-я0-9]+')
+
+STOPWORDS = frozenset("""
+и в во не что он на я с со как а то все она так его но да ты к у же вы за бы по только ее мне было
+вот от меня еще нет о из ему теперь когда ли если уже или ни быть был него до вас нибудь уж вам
+ведь там потом себя ничего ей может они тут где есть надо ней для мы тебя их чем была сам чтоб без
+будто чего раз тоже себе под будет ж тогда кто этот того потому этого какой совсем ним здесь этом
+один почти мой тем чтобы нее сейчас были куда зачем всех никогда можно при об другой хоть после
+над больше тот через эти нас про всего них какая много разве эту моя впрочем свою этой перед
+иногда лучше чуть том нельзя такой им более всегда конечно всю между мои мой моё моей мою какие
+какое каких ли бы напомни расскажи скажи покажи
+the a an and or of to in on at for is are was were be it this that with my me i you what when
+""".split())
+
+_VOWELS = 'аеиоуыэюя'
+
+
+def _grouped(after_a: Tuple[str, ...], other: Tuple[str, ...]) -> List[Tuple[str, bool]]:
+    """Окончания по убыванию длины; True — снимается только после «а» или «я»"""
+    candidates = [(e, True) for e in after_a] + [(e, False) for e in other]
+    return sorted(candidates, key=lambda c: -len(c[0]))
+
+
+_PERFECTIVE_GERUND = _grouped(('вшись', 'вши', 'в'), ('ившись', 'ывшись', 'ивши', 'ывши', 'ив', 'ыв'))
+_REFLEXIVE = ('ся', 'сь')
+_ADJECTIVE = ('ими', 'ыми', 'его', 'ого', 'ему', 'ому', 'ее', 'ие', 'ые', 'ое', 'ей', 'ий', 'ый',
+              'ой', 'ем', 'им', 'ым', 'ом', 'их', 'ых', 'ую', 'юю', 'ая', 'яя', 'ою', 'ею')
+_PARTICIPLE = _grouped(('ем', 'нн', 'вш', 'ющ', 'щ'), ('ивш', 'ывш', 'ующ'))
+_VERB = _grouped(('ете', 'йте', 'ешь', 'нно', 'ла', 'на', 'ли', 'ем', 'ло', 'но', 'ет', 'ют', 'ны', 'ть',
+                  'й', 'л', 'н'),
+                 ('ейте', 'уйте', 'ила', 'ыла', 'ена', 'ите', 'или', 'ыли', 'ило', 'ыло', 'ено', 'ует', 'уют',
+                  'ены', 'ить', 'ыть', 'ишь', 'ей', 'уй', 'ил', 'ыл', 'им', 'ым', 'ен', 'ят', 'ит', 'ыт', 'ую',
+                  'ю'))
+_NOUN = ('иями', 'ями', 'ами', 'ией', 'иям', 'ием', 'иях', 'ев', 'ов', 'ие', 'ье', 'еи', 'ии', 'ей',
+         'ой', 'ий', 'ям', 'ем', 'ам', 'ом', 'ах', 'ях', 'ию', 'ью', 'ия', 'ья', 'а', 'е', 'и', 'й',
+         'о', 'у', 'ы', 'ь', 'ю', 'я')
+_SUPERLATIVE = ('ейше', 'ейш')
+_DERIVATIONAL = ('ость', 'ост')
+
+
+def _regions(word: str) -> Tuple[int, int]:
+    """Начала областей RV и R2 (алгоритм Snowball для русского)"""
+    rv = r1 = r2 = len(word)
+    for i, ch in enumerate(word):
+        if ch in _VOWELS:
+            rv = i + 1
+            break
+    for i in range(1, len(word)):
+        if word[i] not in _VOWELS and word[i - 1] in _VOWELS:
+            r1 = i + 1
+            break
+    for i in range(r1 + 1, len(word)):
+        if word[i] not in _VOWELS and word[i - 1] in _VOWELS:
+            r2 = i + 1
+            break
+    return rv, r2
+
+
+def _strip(word: str, start: int, endings: Iterable[str]) -> Optional[str]:
+    """Слово без первого подходящего окончания из области start.. или None"""
+    for ending in endings:
+        if word.endswith(ending) and len(word) - len(ending) >= start:
+            return word[:-len(ending)]
+    return None
+
+
+def _strip_grouped(word: str, start: int, endings: List[Tuple[str, bool]]) -> Optional[str]:
+    """Как _strip, но часть окончаний снимается только после «а» или «я» из RV"""
+    for ending, needs_a in endings:
+        if not word.endswith(ending) or len(word) - len(ending) < start:
+            continue
+        stem = word[:-len(ending)]
+        if needs_a and not (stem[-1:] in ('а', 'я') and len(stem) - 1 >= start):
+            continue
+        return stem
+    return None
+
+
+# Словарь пользователя невелик, а слова повторяются: основа считается один раз
+@lru_cache(maxsize=65536)
+def stem_ru(word: str) -> str:
+    """Основа русского слова (стеммер Портера/Snowball)"""
+    rv, r2 = _regions(word)
+    if rv >= len(word):
+        return word
+
+    stem = _strip_grouped(word, rv, _PERFECTIVE_GERUND)
+    if stem is None:
+        word = _strip(word, rv, _REFLEXIVE) or word
+        stem = _strip(word, rv, _ADJECTIVE)
+        if stem is not None:
+            stem = _strip_grouped(stem, rv, _PARTICIPLE) or stem
+        else:
+            stem = _strip_grouped(word, rv, _VERB) or _strip(word, rv, _NOUN)
+    word = stem if stem is not None else word
+
+    if word.endswith('и') and len(word) - 1 >= rv:
+        word = word[:-1]
+    word = _strip(word, r2, _DERIVATIONAL) or word
+
+    if word.endswith('нн') and len(word) - 1 >= rv:
+        return word[:-1]
+    superlative = _strip(word, rv, _SUPERLATIVE)
+    if superlative is not None:
+        word = superlative[:-1] if superlative.endswith('нн') else superlative
+    elif word.endswith('ь') and len(word) - 1 >= rv:
+        word = word[:-1]
+    return word
+
+
+def tokenize(text: str) -> List[str]:
+    """Термы для индекса: нижний регистр, ё→е, без стоп-слов, основы слов"""
+    terms = []
+    for word in _WORD.findall(text.lower().replace('ё', 'е')):
+        if word in STOPWORDS or (len(word) < 2 and not word.isdigit()):
+            continue
+        if word[0] >= 'а':
+            word = stem_ru(word)
+        elif len(word) > 3 and word.endswith('s'):
+            word = word[:-1]
+        terms.append(word)
+    return terms
+
+
+# --- Документы ---
+
+def _join(*parts: Any) -> str:
+    return " ".join(str(p) for p in parts if p)
+
+
+def _tags(item: Dict[str, Any]) -> str:
+    return " ".join(item.get('tags') or [])
+
+
+# Какие поля записей индексируются и как запись выглядит в промпте
+COLLECTION_TEXT = {
+    'notes': lambda n: (_join(n.get('title'), n.get('content'), _tags(n)),
+                        _join(n.get('title'), "—", n.get('content'))),
+    'diary': lambda d: (_join(d.get('content'), d.get('mood'), _tags(d)),
+                        _join(f"[{d['mood']}]" if d.get('mood') else None, d.get('content'))),
+    'tasks': lambda t: (_join(t.get('title'), t.get('notes')),
+                        _join("✅" if t.get('completed') or t.get('done') else "❌", t.get('title'),
+                              f"— {t['notes']}" if t.get('notes') else None)),
+    'events': lambda e: (_join(e.get('title'), e.get('description'), e.get('location')),
+                         _join(e.get('time'), e.get('title'), f"— {e['description']}" if e.get('description') else None,
+                               f"({e['location']})" if e.get('location') else None)),
+}
+
+COLLECTION_TITLES = {
+    'notes': 'заметка',
+    'diary': 'дневник',
+    'tasks': 'задача',
+    'events': 'событие',
+}
+
+
+class Document(NamedTuple):
+    """Запись в индексе"""
+    date: str
+    collection: str
+    text: str
+    length: int
+    digest: str
+
+
+class SearchHit(NamedTuple):
+    """Найденная запись и её вес"""
+    date: str
+    collection: str
+    text: str
+    score: float
+
+
+class BM25Index:
+    """Инвертированный индекс BM25 с добавлением и удалением отдельных документов
+
+    Длины документов и частоты термов поддерживаются на лету, поэтому
+    изменение одной записи не требует перестройки индекса.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Dict[str, int]] = {}
+        self.docs: Dict[str, Document] = {}
+        self._terms: Dict[str, Dict[str, int]] = {}
+        self.total_length = 0
+
+    def add(self, doc_id: str, doc: Document, terms: List[str]):
+        self.remove(doc_id)
+        counts: Dict[str, int] = {}
+        for term in terms:
+            counts[term] = counts.get(term, 0) + 1
+        for term, tf in counts.items():
+            self.postings.setdefault(term, {})[doc_id] = tf
+        self.docs[doc_id] = doc._replace(length=len(terms))
+        self._terms[doc_id] = counts
+        self.total_length += len(terms)
+
+    def remove(self, doc_id: str):
+        doc = self.docs.pop(doc_id, None)
+        if doc is None:
+            return
+        for term in self._terms.pop(doc_id):
+            postings = self.postings[term]
+            del postings[doc_id]
+            if not postings:
+                del self.postings[term]
+        self.total_length -= doc.length
+
+    def search(self, terms: List[str], limit: int, exclude: Optional[Set[str]] = None) -> List[Tuple[str, float]]:
+        """(id, вес) лучших документов по убыванию веса"""
+        if not self.docs:
+            return []
+        n = len(self.docs)
+        avg_length = self.total_length / n or 1
+        scores: Dict[str, float] = {}
+        for term in set(terms):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, tf in postings.items():
+                length = self.docs[doc_id].length
+                weight = tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * length / avg_length))
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * weight
+        if exclude:
+            for doc_id in exclude & scores.keys():
+                del scores[doc_id]
+        return heapq.nlargest(limit, scores.items(), key=lambda s: s[1])
+
+
+def _snippet(text: str, terms: Set[str], max_chars: int) -> str:
+    """Фрагмент записи вокруг первого совпадения с запросом"""
+    if len(text) <= max_chars:
+        return text
+    start = 0
+    for match in _WORD.finditer(text.lower().replace('ё', 'е')):
+        if terms.intersection(tokenize(match.group())):
+            start = max(0, match.start() - max_chars // 4)
+            break
+    start = min(start, len(text) - max_chars)
+    fragment = text[start:start + max_chars]
+    return ("…" if start else "") + fragment + ("…" if start + max_chars < len(text) else "")
+
+
+class HistoryIndex:
+    """Индекс заметок, дневника, задач и событий всех дней
+
+    Источник — серверное хранилище контекстов: при каждом поиске индекс
+    дочитывает только дни, изменившиеся с прошлого раза (в том числе
+    записанные другими воркерами), а внутри дня переиндексирует только
+    записи, чей текст поменялся. Контексты, пришедшие в запросах чата,
+    тоже попадают в индекс (в памяти процесса).
+    """
+
+    def __init__(self, config: Config, store=None):
+        self.store = store
+        self.top_k = config.get('retrieval.top_k', 5)
+        self.max_tokens = config.get('retrieval.max_tokens', 400)
+        self.snippet_chars = config.get('retrieval.snippet_chars', 300)
+        self.index = BM25Index(config.get('retrieval.k1', 1.5), config.get('retrieval.b', 0.75))
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._days: Dict[str, Set[str]] = {}
+        self._versions: Dict[str, int] = {}
+        self._seen_at = 0.0
+        self.searches = 0
+        self.reindexed = 0
+
+    def update_day(self, date: str, sections: Dict[str, List[Dict[str, Any]]]) -> int:
+        """Синхронизировать записи дня; возвращает число переиндексированных"""
+        changed = 0
+        with self._lock:
+            previous = self._days.get(date, set())
+            current: Set[str] = set()
+            for collection, to_text in COLLECTION_TEXT.items():
+                for position, item in enumerate(sections.get(collection) or []):
+                    doc_id = f"{date}:{collection}:{item.get('id', position)}"
+                    text, shown = to_text(item)
+                    if not text:
+                        continue
+                    current.add(doc_id)
+                    digest = hashlib.blake2b(text.encode('utf-8') + b'\0' + shown.encode('utf-8'),
+                                             digest_size=8).hexdigest()
+                    existing = self.index.docs.get(doc_id)
+                    if existing is not None and existing.digest == digest:
+                        continue
+                    self.index.add(doc_id, Document(date, collection, shown, 0, digest), tokenize(text))
+                    changed += 1
+            for doc_id in previous - current:
+                self.index.remove(doc_id)
+            self._days[date] = current
+            self.reindexed += changed
+        return changed
+
+    def refresh(self):
+        """Дочитать изменённые в хранилище дни"""
+        if self.store is None:
+            return
+        with self._refresh_lock:
+            for date, version, updated_at in self.store.changed_since(self._seen_at):
+                self._seen_at = max(self._seen_at, updated_at)
+                if self._versions.get(date) == version:
+                    continue
+                stored = self.store.get(date)
+                if stored is not None:
+                    self.update_day(date, stored.context)
+                    self._versions[date] = stored.version
+
+    def search(self, query: str, exclude_date: Optional[str] = None,
+               limit: Optional[int] = None) -> List[SearchHit]:
+        """Лучшие записи по запросу
+
+        Задачи, события и дневник дня exclude_date уже целиком есть в промпте
+        и не повторяются; заметки этого дня остаются — в промпте они обрезаны.
+        """
+        self.refresh()
+        terms = tokenize(query)
+        if not terms:
+            return []
+        with self._lock:
+            self.searches += 1
+            exclude = None
+            if exclude_date:
+                exclude = {d for d in self._days.get(exclude_date, ()) if not d.startswith(f"{exclude_date}:notes:")}
+            found = self.index.search(terms, limit or self.top_k, exclude)
+            return [
+                SearchHit(doc.date, doc.collection, doc.text, round(score, 3))
+                for doc, score in ((self.index.docs[doc_id], score) for doc_id, score in found)
+            ]
+
+    def snippets(self, query: str, exclude_date: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Фрагменты для промпта в пределах retrieval.max_tokens"""
+        terms = set(tokenize(query))
+        snippets = []
+        remaining = self.max_tokens
+        for hit in self.search(query, exclude_date):
+            text = _snippet(hit.text, terms, self.snippet_chars)
+            tokens = estimate_tokens(text) + 8
+            if tokens > remaining:
+                break
+            remaining -= tokens
+            snippets.append({
+                "date": hit.date,
+                "type": COLLECTION_TITLES[hit.collection],
+                "text": text,
+                "score": hit.score,
+            })
+        return snippets
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "documents": len(self.index.docs),
+            "terms": len(self.index.postings),
+            "days": len(self._days),
+            "searches": self.searches,
+            "reindexed": self.reindexed,
+        }
+
+
+_indexes: Dict[int, HistoryIndex] = {}
+
+
+def get_history_index(config: Config, store=None) -> HistoryIndex:
+    """Общий индекс для хранилища контекстов"""
+    key = id(store)
+    if key not in _indexes:
+        _indexes[key] = HistoryIndex(config, store)
+    return _indexes[key]
@@ -0,0 +1,90 @@
+"""
+Типы записей контекста дня (как в src/lib/api-types.ts)
+
+Записи — TypedDict: pydantic проверяет типы полей, но результат остаётся
+обычным dict, поэтому дальше (промпт, хранилище, индекс истории) контекст
+используется без копирования в модели и обратно. Все поля необязательны,
+лишние поля сохраняются: старые клиенты присылают completed вместо done,
+sets числом и т. п.
+"""
+from typing import List, Optional, Union
+from pydantic import ConfigDict
+from typing_extensions import TypedDict
+
+
+# Число как в JSON: целые остаются int (иначе в промпте «5000.0 ₽»)
+Number = Union[int, float]
+
+
+class _Record(TypedDict, total=False):
+    __pydantic_config__ = ConfigDict(extra='allow')  # type: ignore[misc]
+
+    id: Optional[Union[str, int]]
+    createdAt: Optional[str]
+    updatedAt: Optional[str]
+
+
+class Task(_Record, total=False):
+    title: Optional[str]
+    notes: Optional[str]
+    done: Optional[bool]
+    priority: Optional[str]
+    tags: Optional[List[str]]
+    dueDate: Optional[str]
+
+
+class WorkoutSet(TypedDict, total=False):
+    __pydantic_config__ = ConfigDict(extra='allow')  # type: ignore[misc]
+
+    reps: Optional[Number]
+    weight: Optional[Number]
+
+
+class WorkoutExercise(TypedDict, total=False):
+    __pydantic_config__ = ConfigDict(extra='allow')  # type: ignore[misc]
+
+    name: Optional[str]
+    # Список подходов; старый формат — число подходов и общие reps/weight
+    sets: Union[List[WorkoutSet], int, None]
+
+
+class WorkoutSession(_Record, total=False):
+    date: Optional[str]
+    title: Optional[str]
+    notes: Optional[str]
+    exercises: Optional[List[WorkoutExercise]]
+
+
+class MoneyTransaction(_Record, total=False):
+    date: Optional[str]
+    type: Optional[str]
+    amount: Optional[Number]
+    category: Optional[str]
+    accountId: Optional[str]
+    note: Optional[str]
+
+
+class DiaryEntry(_Record, total=False):
+    date: Optional[str]
+    content: Optional[str]
+    mood: Optional[str]
+    tags: Optional[List[str]]
+
+
+class CalendarEvent(_Record, total=False):
+    title: Optional[str]
+    date: Optional[str]
+    time: Optional[str]
+    duration: Optional[Number]
+    description: Optional[str]
+    location: Optional[str]
+    color: Optional[str]
+    tags: Optional[List[str]]
+
+
+class Note(_Record, total=False):
+    title: Optional[str]
+    content: Optional[str]
+    folder: Optional[str]
+    tags: Optional[List[str]]
+
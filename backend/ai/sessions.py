@@ -0,0 +1,260 @@
+"""
+Серверные сессии диалога: журнал сообщений только на дозапись
+"""
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from .core import Config
+
+
+class SessionLog(NamedTuple):
+    """Сообщения сессии в памяти: base — номер первого хранимого сообщения"""
+    base: int
+    length: int
+    messages: Tuple[Dict[str, str], ...]
+
+
+class SessionStore:
+    """Сессии в SQLite и LRU горячих сессий в памяти
+
+    Сообщения только дописываются (строка на сообщение с порядковым
+    номером), поэтому ход диалога — одна короткая транзакция, а клиент
+    присылает лишь новые сообщения. Горячая сессия сверяет с базой длину
+    журнала и дочитывает только недостающий хвост, так что изменения
+    других воркеров видны сразу.
+
+    Сессия без активности дольше ttl считается несуществующей сразу (при
+    любом обращении), а удаляется при обращении или при плановой чистке.
+    Журнал длиннее max_messages сжимается до последних keep_messages
+    сообщений: более старые удаляются безвозвратно (без резюме), и модель
+    их больше не видит; номер первого хранимого — compacted в history().
+    """
+
+    def __init__(self, path: str, hot_sessions: int = 256, ttl: float = 30 * 24 * 3600,
+                 max_messages: int = 400, keep_messages: int = 200):
+        self.path = path
+        self.hot_sessions = hot_sessions
+        self.ttl = ttl
+        self.max_messages = max_messages
+        self.keep_messages = min(keep_messages, max_messages)
+        self._db: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._hot: "OrderedDict[str, SessionLog]" = OrderedDict()
+        self.hits = 0
+        self.loads = 0
+        self.compactions = 0
+        self.expired = 0
+
+    @classmethod
+    def from_config(cls, config: Config) -> "SessionStore":
+        return cls(
+            config.get('sessions.path', 'data/sessions.sqlite3'),
+            hot_sessions=config.get('sessions.hot_sessions', 256),
+            ttl=config.get('sessions.ttl_days', 30) * 24 * 3600,
+            max_messages=config.get('sessions.max_messages', 400),
+            keep_messages=config.get('sessions.keep_messages', 200),
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        """Ленивое открытие базы"""
+        if self._db is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA busy_timeout=5000')
+            db.execute('''
+                CREATE TABLE IF NOT EXISTS sessions (
+                    id TEXT PRIMARY KEY,
+                    base INTEGER NOT NULL,
+                    length INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            ''')
+            db.execute('''
+                CREATE TABLE IF NOT EXISTS messages (
+                    session_id TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    role TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (session_id, seq)
+                ) WITHOUT ROWID
+            ''')
+            db.execute('CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (updated_at)')
+            self._db = db
+        return self._db
+
+    def _remember(self, session_id: str, log: SessionLog):
+        self._hot[session_id] = log
+        self._hot.move_to_end(session_id)
+        if len(self._hot) > self.hot_sessions:
+            self._hot.popitem(last=False)
+
+    def _live_row(self, db: sqlite3.Connection, session_id: str, columns: str) -> Optional[tuple]:
+        """Строка сессии (updated_at — последний столбец) или None; истёкшая удаляется"""
+        row = db.execute(f'SELECT {columns}, updated_at FROM sessions WHERE id = ?', (session_id,)).fetchone()
+        if row is not None and row[-1] < time.time() - self.ttl:
+            self._drop(db, session_id)
+            self.expired += 1
+            row = None
+        if row is None:
+            self._hot.pop(session_id, None)
+        return row
+
+    def _load(self, db: sqlite3.Connection, session_id: str) -> Optional[SessionLog]:
+        """Журнал сессии: из памяти, дочитав хвост, или из базы целиком"""
+        row = self._live_row(db, session_id, 'base, length')
+        if row is None:
+            return None
+        base, length, _ = row
+
+        cached = self._hot.get(session_id)
+        if cached is not None and cached.base == base and cached.length == length:
+            self.hits += 1
+            self._hot.move_to_end(session_id)
+            return cached
+
+        self.loads += 1
+        if cached is not None and cached.base == base and cached.length < length:
+            start, messages = cached.length, list(cached.messages)
+        else:
+            start, messages = base, []
+        messages.extend(
+            {"role": role, "content": content}
+            for role, content in db.execute(
+                'SELECT role, content FROM messages WHERE session_id = ? AND seq >= ? AND seq < ? ORDER BY seq',
+                (session_id, start, length)
+            )
+        )
+        log = SessionLog(base, length, tuple(messages))
+        self._remember(session_id, log)
+        return log
+
+    def create(self, messages: Optional[List[Dict[str, str]]] = None) -> str:
+        """Новая сессия (можно сразу с начальными сообщениями)"""
+        session_id = uuid.uuid4().hex
+        with self._lock:
+            db = self._conn()
+            now = time.time()
+            db.execute(
+                'INSERT INTO sessions (id, base, length, created_at, updated_at) VALUES (?, 0, 0, ?, ?)',
+                (session_id, now, now)
+            )
+            self._purge(db, now)
+        if messages:
+            self.append(session_id, messages)
+        return session_id
+
+    def messages(self, session_id: str) -> Optional[List[Dict[str, str]]]:
+        """Сообщения сессии для модели или None, если сессии нет"""
+        with self._lock:
+            log = self._load(self._conn(), session_id)
+        return list(log.messages) if log is not None else None
+
+    def append(self, session_id: str, messages: List[Dict[str, str]]) -> Optional[int]:
+        """Дописать сообщения; новая длина журнала или None, если сессии нет"""
+        with self._lock:
+            db = self._conn()
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._live_row(db, session_id, 'base, length')
+                if row is None:
+                    db.execute('COMMIT')
+                    return None
+                base, length, _ = row
+                now = time.time()
+                db.executemany(
+                    'INSERT INTO messages (session_id, seq, role, content, created_at) VALUES (?, ?, ?, ?, ?)',
+                    [(session_id, length + i, m['role'], m['content'], now) for i, m in enumerate(messages)]
+                )
+                length += len(messages)
+                if length - base > self.max_messages:
+                    base = length - self.keep_messages
+                    db.execute('DELETE FROM messages WHERE session_id = ? AND seq < ?', (session_id, base))
+                    self.compactions += 1
+                db.execute(
+                    'UPDATE sessions SET base = ?, length = ?, updated_at = ? WHERE id = ?',
+                    (base, length, now, session_id)
+                )
+                db.execute('COMMIT')
+            except Exception:
+                db.execute('ROLLBACK')
+                raise
+
+            # Горячую сессию продлеваем без перечитывания базы
+            cached = self._hot.get(session_id)
+            if cached is not None and cached.length == length - len(messages):
+                kept = (cached.messages + tuple({"role": m['role'], "content": m['content']} for m in messages))
+                self._remember(session_id, SessionLog(base, length, kept[len(kept) - (length - base):]))
+            return length
+
+    def history(self, session_id: str, after: int = 0) -> Optional[Dict[str, Any]]:
+        """Сессия для клиента: сообщения с номерами и временем (начиная с after)"""
+        with self._lock:
+            db = self._conn()
+            row = self._live_row(db, session_id, 'base, length, created_at')
+            if row is None:
+                return None
+            base, length, created_at, updated_at = row
+            rows = db.execute(
+                'SELECT seq, role, content, created_at FROM messages WHERE session_id = ? AND seq >= ? ORDER BY seq',
+                (session_id, max(base, after))
+            ).fetchall()
+        return {
+            "session_id": session_id,
+            "length": length,
+            "compacted": base,
+            "created_at": datetime.fromtimestamp(created_at).isoformat(),
+            "updated_at": datetime.fromtimestamp(updated_at).isoformat(),
+            "messages": [
+                {"seq": seq, "role": role, "content": content,
+                 "timestamp": datetime.fromtimestamp(ts).isoformat()}
+                for seq, role, content, ts in rows
+            ],
+        }
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            db = self._conn()
+            db.execute('BEGIN IMMEDIATE')
+            deleted = db.execute('DELETE FROM sessions WHERE id = ?', (session_id,)).rowcount
+            db.execute('DELETE FROM messages WHERE session_id = ?', (session_id,))
+            db.execute('COMMIT')
+            self._hot.pop(session_id, None)
+        return bool(deleted)
+
+    def _purge(self, db: sqlite3.Connection, now: float):
+        """Удаление сессий без активности дольше ttl"""
+        expired = [row[0] for row in db.execute(
+            'SELECT id FROM sessions WHERE updated_at < ?', (now - self.ttl,)
+        )]
+        for session_id in expired:
+            self._drop(db, session_id)
+            self._hot.pop(session_id, None)
+        self.expired += len(expired)
+
+    @staticmethod
+    def _drop(db: sqlite3.Connection, session_id: str):
+        db.execute('DELETE FROM messages WHERE session_id = ?', (session_id,))
+        db.execute('DELETE FROM sessions WHERE id = ?', (session_id,))
+
+    def purge_expired(self):
+        with self._lock:
+            self._purge(self._conn(), time.time())
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "hot": len(self._hot),
+            "hits": self.hits,
+            "loads": self.loads,
+            "compactions": self.compactions,
+            "expired": self.expired,
+        }
@@ -0,0 +1,110 @@
+"""
+Общие для всех воркеров настройки: модель по умолчанию и модели сессий
+"""
+from typing import Dict, Optional
+import os
+import sqlite3
+import threading
+import time
+
+
+class SharedSettings:
+    """Небольшое хранилище ключ-значение в SQLite
+
+    Чтение почти бесплатное: значения отдаются из снимка в памяти
+    процесса, а база опрашивается не чаще раза в refresh_interval секунд
+    (PRAGMA data_version меняется, только когда другое соединение — другой
+    воркер — что-то записал). Если база занята записью в другом потоке,
+    чтение не ждёт её и отдаёт снимок: цикл событий не блокируется.
+    """
+
+    DEFAULT_MODEL_KEY = 'default_model'
+    SESSION_PREFIX = 'session_model:'
+
+    def __init__(self, path: str, session_ttl: float = 7 * 24 * 3600, refresh_interval: float = 0.5):
+        self.path = path
+        self.session_ttl = session_ttl
+        self.refresh_interval = refresh_interval
+        self._db: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._values: Dict[str, str] = {}
+        self._data_version: Optional[int] = None
+        self._checked_at = 0.0
+
+    def _conn(self) -> sqlite3.Connection:
+        """Ленивое открытие базы"""
+        if self._db is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA busy_timeout=5000')
+            db.execute('''
+                CREATE TABLE IF NOT EXISTS settings (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            ''')
+            self._db = db
+        return self._db
+
+    def _refresh(self, db: sqlite3.Connection):
+        version = db.execute('PRAGMA data_version').fetchone()[0]
+        if version != self._data_version:
+            self._values = dict(db.execute('SELECT key, value FROM settings'))
+            self._data_version = version
+        self._checked_at = time.monotonic()
+
+    def get(self, key: str) -> Optional[str]:
+        if time.monotonic() - self._checked_at >= self.refresh_interval and self._lock.acquire(blocking=False):
+            try:
+                self._refresh(self._conn())
+            finally:
+                self._lock.release()
+        return self._values.get(key)
+
+    def peek(self, key: str) -> Optional[str]:
+        """Значение из снимка, без обращения к базе (для /health)"""
+        return self._values.get(key)
+
+    def set(self, key: str, value: str):
+        with self._lock:
+            db = self._conn()
+            now = time.time()
+            db.execute(
+                'INSERT OR REPLACE INTO settings (key, value, updated_at) VALUES (?, ?, ?)',
+                (key, value, now)
+            )
+            # Заодно чистим давно не менявшиеся привязки сессий
+            db.execute(
+                'DELETE FROM settings WHERE key LIKE ? AND updated_at < ?',
+                (self.SESSION_PREFIX + '%', now - self.session_ttl)
+            )
+            # data_version не меняется от записей своего же соединения
+            self._values[key] = value
+            self._data_version = None
+
+    def get_default_model(self) -> Optional[str]:
+        return self.get(self.DEFAULT_MODEL_KEY)
+
+    def set_default_model(self, model_name: str):
+        self.set(self.DEFAULT_MODEL_KEY, model_name)
+
+    def get_session_model(self, session_id: str) -> Optional[str]:
+        return self.get(self.SESSION_PREFIX + session_id)
+
+    def set_session_model(self, session_id: str, model_name: str):
+        self.set(self.SESSION_PREFIX + session_id, model_name)
+
+
+_settings: Dict[str, SharedSettings] = {}
+
+
+def get_shared_settings(path: str, session_ttl: float = 7 * 24 * 3600,
+                        refresh_interval: float = 0.5) -> SharedSettings:
+    """Общее хранилище для пути к базе"""
+    if path not in _settings:
+        _settings[path] = SharedSettings(path, session_ttl, refresh_interval)
+    return _settings[path]
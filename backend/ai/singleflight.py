@@ -0,0 +1,84 @@
+"""
+Объединение одинаковых одновременных запросов (single-flight)
+"""
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+import asyncio
+import contextvars
+from . import deadline
+from .admission import current_priority
+from .metrics import singleflight_requests
+
+
+class SingleFlight:
+    """Один вызов на ключ: одновременные запросы с тем же ключом ждут общий результат
+
+    Вызов выполняется отдельной задачей, поэтому отмена одного из ожидающих
+    не отменяет работу для остальных; задача отменяется, только когда её
+    результат больше никто не ждёт.
+
+    Задача не наследует срок первого запроса: у вызова срока нет, а каждый
+    ожидающий ждёт не дольше своего. Запросы с разным приоритетом допуска
+    не объединяются, чтобы пакет не поставил живой чат в свою очередь.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Tuple[str, str], "_Flight"] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]], model: Optional[str] = None) -> Any:
+        flight_key = (current_priority(), key)
+        flight = self._inflight.get(flight_key)
+        if flight is None:
+            self.calls += 1
+            singleflight_requests.inc(model or '', 'call')
+            context = contextvars.copy_context()
+            context.run(deadline.start, None)
+            # Задача копирует текущий контекст; create_task(context=...) есть только с 3.11
+            flight = _Flight(context.run(asyncio.get_running_loop().create_task, fn()))
+            self._inflight[flight_key] = flight
+            flight.task.add_done_callback(lambda _: self._forget(flight_key, flight))
+        else:
+            self.coalesced += 1
+            singleflight_requests.inc(model or '', 'coalesced')
+
+        flight.waiters += 1
+        try:
+            left = deadline.remaining()
+            if left is None:
+                return await asyncio.shield(flight.task)
+            try:
+                return await asyncio.wait_for(asyncio.shield(flight.task), max(0.0, left))
+            except asyncio.TimeoutError:
+                if flight.task.done() and not flight.task.cancelled():
+                    return flight.task.result()
+                raise deadline.expired(model) from None
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                flight.task.cancel()
+
+    def _forget(self, key: Tuple[str, str], flight: "_Flight"):
+        if self._inflight.get(key) is flight:
+            del self._inflight[key]
+        # Результат может остаться незабранным (все ожидающие отменены)
+        if not flight.task.cancelled():
+            flight.task.exception()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "inflight": len(self._inflight),
+        }
+
+
+class _Flight:
+    """Выполняющийся вызов и число ожидающих его запросов"""
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+singleflight = SingleFlight()
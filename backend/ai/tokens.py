@@ -0,0 +1,26 @@
+"""
+Грубая оценка числа токенов без токенизатора
+"""
+from typing import Dict, List
+
+
+# Токенизаторы Mistral дают в среднем ~3 символа на токен для русского
+# текста и ~4 для английского; берём консервативную оценку.
+CHARS_PER_TOKEN = 3
+
+
+def estimate_tokens(text: str) -> int:
+    """Оценка числа токенов в строке"""
+    if not text:
+        return 0
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def estimate_message_tokens(message: Dict[str, str]) -> int:
+    """Оценка токенов сообщения с учётом служебной разметки роли"""
+    return estimate_tokens(message.get('content') or '') + 4
+
+
+def estimate_messages_tokens(messages: List[Dict[str, str]]) -> int:
+    """Оценка токенов списка сообщений"""
+    return sum(estimate_message_tokens(m) for m in messages)
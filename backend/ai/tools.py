@@ -0,0 +1,254 @@
+"""
+Режим инструментов: краткий обзор дня в промпте, подробности модель запрашивает сама
+"""
+from typing import Any, Dict, List, Optional, Tuple
+import hashlib
+import json
+import marshal
+from .core import Config
+from .prompt import PROMPT_INSTRUCTIONS, SECTIONS
+from .retrieval import tokenize
+from .tokens import estimate_tokens
+
+
+TOOLS_PROMPT_HEADER = """Ты — полезный персональный AI-ассистент. Ниже краткий обзор дня пользователя.
+Подробные записи получай инструментами (get_tasks, get_finances, get_workouts, get_events,
+get_diary, search_notes) — только те, что нужны для ответа. Не выдумывай данные, которых нет.
+
+Обзор дня:"""
+
+# Функции в формате Mistral API (tools в /chat/completions)
+TOOL_SPECS: List[Dict[str, Any]] = [
+    {"type": "function", "function": {
+        "name": "get_tasks",
+        "description": "Задачи дня с приоритетом, статусом и заметками",
+        "parameters": {"type": "object", "properties": {
+            "status": {"type": "string", "enum": ["all", "open", "done"],
+                       "description": "open — невыполненные, done — выполненные"},
+        }},
+    }},
+    {"type": "function", "function": {
+        "name": "get_finances",
+        "description": "Транзакции дня: суммы по категориям и итог; можно отфильтровать категорию",
+        "parameters": {"type": "object", "properties": {
+            "category": {"type": "string", "description": "Категория (без учёта регистра), например «Еда»"},
+            "type": {"type": "string", "enum": ["all", "income", "expense"]},
+        }},
+    }},
+    {"type": "function", "function": {
+        "name": "get_workouts",
+        "description": "Тренировки дня: упражнения, подходы, повторения и вес",
+        "parameters": {"type": "object", "properties": {}},
+    }},
+    {"type": "function", "function": {
+        "name": "get_events",
+        "description": "События календаря на день: время, описание, место",
+        "parameters": {"type": "object", "properties": {}},
+    }},
+    {"type": "function", "function": {
+        "name": "get_diary",
+        "description": "Записи дневника за день с настроением и тегами",
+        "parameters": {"type": "object", "properties": {}},
+    }},
+    {"type": "function", "function": {
+        "name": "search_notes",
+        "description": "Поиск по заметкам и дневнику (за этот день и прошлые дни)",
+        "parameters": {"type": "object", "properties": {
+            "query": {"type": "string", "description": "Что искать, несколько слов"},
+            "limit": {"type": "integer", "description": "Сколько записей вернуть (по умолчанию 5)"},
+        }, "required": ["query"]},
+    }},
+]
+
+_SPECS = {spec.name: spec for spec in SECTIONS}
+
+
+def record_count(context: Dict[str, Any]) -> int:
+    """Число записей дня во всех секциях (для выбора режима)"""
+    return sum(len(_SPECS[name].select(context)) for name in ('tasks', 'finances', 'workouts', 'diary', 'events', 'notes'))
+
+
+def _titles(items: List[Dict[str, Any]], key: str, limit: int) -> str:
+    titles = [str(item.get(key)) for item in items[:limit] if item.get(key)]
+    if len(items) > limit:
+        titles.append(f"… ещё {len(items) - limit}")
+    return ", ".join(titles)
+
+
+def day_overview(context: Dict[str, Any]) -> str:
+    """Обзор дня: счётчики и итоги без самих записей"""
+    lines = [f"\nДата: {context.get('date') or 'Не указана'}"]
+
+    tasks = _SPECS['tasks'].select(context)
+    done = sum(1 for t in tasks if t.get('completed') or t.get('done'))
+    lines.append(f"- Задачи: {len(tasks)} (выполнено {done}, осталось {len(tasks) - done})" if tasks else "- Задач нет")
+
+    finances = _SPECS['finances'].select(context)
+    if finances:
+        income = sum(f.get('amount') or 0 for f in finances if f.get('type') == 'income')
+        expense = sum(f.get('amount') or 0 for f in finances if f.get('type') == 'expense')
+        categories = sorted({f.get('category') or 'Без категории' for f in finances})
+        lines.append(f"- Финансы: {len(finances)} транзакций, доход {income} ₽, расход {expense} ₽; "
+                     f"категории: {', '.join(categories)}")
+    else:
+        lines.append("- Транзакций нет")
+
+    workouts = _SPECS['workouts'].select(context)
+    lines.append(f"- Тренировки: {len(workouts)} ({_titles(workouts, 'title', 5)})" if workouts else "- Тренировок нет")
+
+    events = _SPECS['events'].select(context)
+    lines.append(f"- События: {len(events)} ({_titles(events, 'title', 5)})" if events else "- Событий нет")
+
+    diary = _SPECS['diary'].select(context)
+    if diary:
+        moods = _titles(diary, 'mood', 3)
+        lines.append(f"- Дневник: {len(diary)} записей" + (f", настроение: {moods}" if moods else ""))
+    else:
+        lines.append("- Записей в дневнике нет")
+
+    notes = _SPECS['notes'].select(context)
+    lines.append(f"- Заметки: {len(notes)} ({_titles(notes, 'title', 10)})" if notes else "- Заметок нет")
+
+    stats = _SPECS['stats'].select(context)
+    if stats:
+        lines.append(f"\n### {_SPECS['stats'].title}:")
+        lines.extend(_SPECS['stats'].render(stats)[0])
+    return "\n".join(lines) + "\n"
+
+
+class DayTools:
+    """Инструменты одного хода диалога над контекстом дня
+
+    Данные берутся из того же контекста, что и для полного промпта
+    (из запроса или серверного хранилища), search_notes — ещё и из
+    индекса истории. Результаты кэшируются на время хода: повтор вызова
+    (в том числе при повторе запроса к модели) не пересчитывается.
+    Ответ инструмента ограничен max_result_tokens.
+    """
+
+    def __init__(self, context: Dict[str, Any], history_index=None, max_result_tokens: int = 1500):
+        self.context = context
+        self.history_index = history_index
+        self.max_result_tokens = max_result_tokens
+        self._results: Dict[Tuple[str, str], str] = {}
+        self.calls: List[str] = []
+        self.cache_hits = 0
+
+    @classmethod
+    def from_config(cls, config: Config, context: Dict[str, Any], history_index=None) -> "DayTools":
+        return cls(context, history_index, config.get('tools.max_result_tokens', 1500))
+
+    def system_prompt(self) -> str:
+        return TOOLS_PROMPT_HEADER + day_overview(self.context) + PROMPT_INSTRUCTIONS
+
+    def fingerprint(self) -> str:
+        """Хэш данных дня для ключа кэша ответов (промпт их не содержит)"""
+        data = [self.context.get(name) for name in ('date', 'tasks', 'finances', 'money', 'workouts',
+                                                     'diary', 'events', 'notes', 'stats')]
+        try:
+            raw = marshal.dumps(data)
+        except ValueError:
+            raw = repr(data).encode('utf-8')
+        return hashlib.blake2b(raw, digest_size=16).hexdigest()
+
+    def call(self, name: str, arguments: Any) -> str:
+        """Результат инструмента текстом (ошибки — тоже текстом, для модели)"""
+        if isinstance(arguments, str):
+            try:
+                arguments = json.loads(arguments) if arguments.strip() else {}
+            except json.JSONDecodeError:
+                return f"Ошибка: аргументы {name} — не JSON"
+        arguments = arguments if isinstance(arguments, dict) else {}
+        key = (name, json.dumps(arguments, sort_keys=True, ensure_ascii=False))
+        self.calls.append(name)
+        if key in self._results:
+            self.cache_hits += 1
+            return self._results[key]
+
+        handler = getattr(self, f"_tool_{name}", None)
+        if handler is None:
+            result = f"Ошибка: неизвестный инструмент {name}"
+        else:
+            try:
+                result = handler(**arguments)
+            except (TypeError, ValueError) as e:
+                result = f"Ошибка: неверные аргументы {name}: {e}"
+        self._results[key] = result
+        return result
+
+    def _section(self, name: str, items: List[Dict[str, Any]], empty: str) -> str:
+        """Записи секции как в полном промпте, в пределах max_result_tokens"""
+        if not items:
+            return empty
+        blocks, summary = _SPECS[name].render(items)
+        lines, remaining = [], self.max_result_tokens - estimate_tokens(summary)
+        for block in blocks:
+            remaining -= estimate_tokens(block) + 1
+            if remaining < 0:
+                lines.append(f"… ещё {len(blocks) - len(lines)} из {len(blocks)} записей не показано")
+                break
+            lines.append(block)
+        if summary:
+            lines.append(summary)
+        return "\n".join(lines)
+
+    def _tool_get_tasks(self, status: str = 'all') -> str:
+        tasks = _SPECS['tasks'].select(self.context)
+        if status in ('open', 'done'):
+            want_done = status == 'done'
+            tasks = [t for t in tasks if bool(t.get('completed') or t.get('done')) == want_done]
+        return self._section('tasks', tasks, "Нет задач")
+
+    def _tool_get_finances(self, category: Optional[str] = None, type: str = 'all') -> str:
+        finances = _SPECS['finances'].select(self.context)
+        if type in ('income', 'expense'):
+            finances = [f for f in finances if f.get('type') == type]
+        if category:
+            wanted = category.strip().lower()
+            exact = [f for f in finances if (f.get('category') or '').lower() == wanted]
+            finances = exact or [f for f in finances if wanted in (f.get('category') or '').lower()]
+            if not finances:
+                return f"Нет транзакций в категории «{category}»"
+        return self._section('finances', finances, "Нет финансовых транзакций")
+
+    def _tool_get_workouts(self) -> str:
+        return self._section('workouts', _SPECS['workouts'].select(self.context), "Нет тренировок")
+
+    def _tool_get_events(self) -> str:
+        return self._section('events', _SPECS['events'].select(self.context), "Нет событий")
+
+    def _tool_get_diary(self) -> str:
+        return self._section('diary', _SPECS['diary'].select(self.context), "Нет записей в дневнике")
+
+    def _tool_search_notes(self, query: str = '', limit: int = 5) -> str:
+        limit = max(1, min(int(limit or 5), 20))
+        if self.history_index is not None:
+            hits = [
+                (hit.date, hit.collection, hit.text)
+                for hit in self.history_index.search(query, limit=limit * 2)
+                if hit.collection in ('notes', 'diary')
+            ][:limit]
+        else:
+            # Без индекса истории — совпадения слов в заметках и дневнике этого дня
+            terms = set(tokenize(query))
+            date = self.context.get('date')
+            scored = []
+            for collection, key in (('notes', 'content'), ('diary', 'content')):
+                for item in _SPECS[collection].select(self.context):
+                    text = " ".join(str(item.get(k) or '') for k in ('title', key))
+                    score = len(terms & set(tokenize(text)))
+                    if score:
+                        scored.append((score, (date, collection, text.strip())))
+            scored.sort(key=lambda pair: -pair[0])
+            hits = [hit for _, hit in scored[:limit]]
+        if not hits:
+            return f"Ничего не найдено по запросу «{query}»"
+        titles = {'notes': 'заметка', 'diary': 'дневник'}
+        lines, remaining = [], self.max_result_tokens
+        for date, collection, text in hits:
+            line = f"- {date}, {titles[collection]}: {text[:600]}"
+            remaining -= estimate_tokens(line) + 1
+            if remaining < 0:
+                break
+            lines.append(line)
+        return "\n".join(lines)
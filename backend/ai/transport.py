@@ -0,0 +1,127 @@
+"""
+HTTP-уровень: разбор JSON через orjson и сжатие больших ответов
+"""
+from typing import Any, Callable, Optional
+import asyncio
+import gzip
+import orjson
+from fastapi import Request
+from fastapi.routing import APIRoute
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:  # brotli необязателен: без него только gzip
+    brotli = None
+
+
+class ORJSONRequest(Request):
+    """Тело запроса разбирается orjson (в несколько раз быстрее json.loads)"""
+
+    async def json(self) -> Any:
+        if not hasattr(self, '_json'):
+            # orjson.JSONDecodeError — наследник json.JSONDecodeError, FastAPI ответит 422
+            self._json = orjson.loads(await self.body())
+        return self._json
+
+
+class ORJSONRoute(APIRoute):
+    """Маршрут FastAPI, который отдаёт обработчику ORJSONRequest"""
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+
+        async def route_handler(request: Request):
+            return await handler(ORJSONRequest(request.scope, request.receive))
+
+        return route_handler
+
+
+# Крупные ответы сжимаются в потоке, чтобы не задерживать цикл событий
+THREAD_THRESHOLD = 256 * 1024
+
+# Потоки отдаются по мере генерации — их не сжимаем, иначе события застрянут в буфере
+STREAMING_TYPES = ('text/event-stream', 'application/x-ndjson')
+
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """br или gzip по заголовку Accept-Encoding (с учётом q=0)"""
+    accepted = {}
+    for part in accept_encoding.split(','):
+        name, _, params = part.strip().partition(';')
+        quality = 1.0
+        if params.strip().startswith('q='):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    for encoding in (('br', 'gzip') if brotli is not None else ('gzip',)):
+        if accepted.get(encoding, accepted.get('*', 0)) > 0:
+            return encoding
+    return None
+
+
+class CompressionMiddleware:
+    """Сжатие ответов целиком (gzip или brotli по Accept-Encoding)
+
+    Сжимаются только ответы, пришедшие одним куском, не меньше
+    minimum_size байт. Потоковые ответы (SSE, NDJSON) и уже сжатые
+    проходят без изменений.
+    """
+
+    def __init__(self, app, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    def compress(self, body: bytes, encoding: str) -> bytes:
+        if encoding == 'br':
+            return brotli.compress(body, quality=self.brotli_quality)
+        return gzip.compress(body, compresslevel=self.gzip_level, mtime=0)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate_encoding(Headers(scope=scope).get('accept-encoding', ''))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start: Optional[dict] = None
+
+        async def send_compressed(message):
+            nonlocal start
+            if message['type'] == 'http.response.start':
+                headers = Headers(raw=message['headers'])
+                if headers.get('content-type', '').startswith(STREAMING_TYPES) or 'content-encoding' in headers:
+                    await send(message)
+                else:
+                    start = message
+                return
+            if start is None or message['type'] != 'http.response.body':
+                await send(message)
+                return
+
+            response_start, start = start, None
+            body = message.get('body', b'')
+            if message.get('more_body') or len(body) < self.minimum_size:
+                await send(response_start)
+                await send(message)
+                return
+
+            if len(body) >= THREAD_THRESHOLD:
+                compressed = await asyncio.to_thread(self.compress, body, encoding)
+            else:
+                compressed = self.compress(body, encoding)
+            headers = MutableHeaders(raw=response_start['headers'])
+            headers['Content-Encoding'] = encoding
+            headers['Content-Length'] = str(len(compressed))
+            headers.add_vary_header('Accept-Encoding')
+            await send(response_start)
+            await send({'type': 'http.response.body', 'body': compressed})
+
+        await self.app(scope, receive, send_compressed)
+
@@ -0,0 +1,172 @@
+"""
+JSON-путь до и после: разбор и проверка контекста дня, сериализация и сжатие ответа
+
+«До» — json.loads, DailyContext со списками Dict[str, Any] и копия .dict(),
+ответ через jsonable_encoder и стандартный JSONResponse. «После» — orjson,
+типизированные записи (ai/schemas.py) без копии, ORJSONResponse и сжатие.
+Сервер не запускается: приложение вызывается в процессе через ASGI.
+
+Запуск из каталога backend:
+    python -m benchmarks.bench_json [--sizes small,large,xl] [--repeat 20] [--json]
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import httpx
+import orjson
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse
+from pydantic import BaseModel
+
+from benchmarks.bench_load import SIZES
+from benchmarks.bench_prompt import heavy_day
+from benchmarks.bench_startup import BACKEND_DIR
+from ai.transport import brotli
+
+
+BENCH_CONFIG = """
+defaults:
+  provider: api
+  model: mistral-small-latest
+mistral:
+  api_key: bench
+cache:
+  enabled: false
+context_store:
+  path: {workdir}/contexts.sqlite3
+sessions:
+  path: {workdir}/sessions.sqlite3
+routing:
+  store_path: {workdir}/settings.sqlite3
+"""
+
+
+class LegacyDailyContext(BaseModel):
+    """DailyContext до типизации записей"""
+    date: str
+    tasks: List[Dict[str, Any]] = []
+    finances: Optional[List[Dict[str, Any]]] = []
+    money: Optional[List[Dict[str, Any]]] = []
+    workouts: List[Dict[str, Any]] = []
+    diary: List[Dict[str, Any]] = []
+    events: List[Dict[str, Any]] = []
+    notes: List[Dict[str, Any]] = []
+
+
+def measure(fn: Callable[[], Any], repeat: int) -> float:
+    """Медиана времени вызова, мс"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    times.sort()
+    return round(times[len(times) // 2], 3)
+
+
+def run_size(main_module, size: str, repeat: int) -> Dict[str, Any]:
+    context = heavy_day(SIZES[size])
+    body = json.dumps(context, ensure_ascii=False).encode('utf-8')
+    payload = {"date": context['date'], "version": 1, "context": context}
+
+    before_request = measure(lambda: LegacyDailyContext(**json.loads(body)).model_dump(), repeat)
+    after_request = measure(lambda: main_module.DailyContext(**orjson.loads(body)).to_context(), repeat)
+    before_response = measure(lambda: JSONResponse(jsonable_encoder(payload)).body, repeat)
+    after_response = measure(lambda: ORJSONResponse(payload).body, repeat)
+
+    raw = ORJSONResponse(payload).body
+    result = {
+        "size": size,
+        "request_bytes": len(body),
+        "request_before_ms": before_request,
+        "request_after_ms": after_request,
+        "response_before_ms": before_response,
+        "response_after_ms": after_response,
+        "response_bytes": len(raw),
+        "gzip_bytes": len(gzip.compress(raw, compresslevel=6)),
+        "gzip_ms": measure(lambda: gzip.compress(raw, compresslevel=6), repeat),
+    }
+    if brotli is not None:
+        result["br_bytes"] = len(brotli.compress(raw, quality=4))
+        result["br_ms"] = measure(lambda: brotli.compress(raw, quality=4), repeat)
+    result.update(asyncio.run(_end_to_end(main_module, context, repeat)))
+    return result
+
+
+async def _end_to_end(main_module, context: Dict[str, Any], repeat: int) -> Dict[str, Any]:
+    """PUT и GET /api/context через приложение целиком (после)"""
+    transport = httpx.ASGITransport(app=main_module.app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+        date = context['date']
+        put_times, plain_times, gzip_times = [], [], []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            response = await client.put(f'/api/context/{date}', content=orjson.dumps(context),
+                                        headers={'Content-Type': 'application/json'})
+            put_times.append((time.perf_counter() - start) * 1000)
+            response.raise_for_status()
+        for encoding, times in (('identity', plain_times), ('gzip', gzip_times)):
+            for _ in range(repeat):
+                start = time.perf_counter()
+                response = await client.get(f'/api/context/{date}', headers={'Accept-Encoding': encoding})
+                times.append((time.perf_counter() - start) * 1000)
+                response.raise_for_status()
+        for times in (put_times, plain_times, gzip_times):
+            times.sort()
+        return {
+            "put_ms": round(put_times[len(put_times) // 2], 3),
+            "get_ms": round(plain_times[len(plain_times) // 2], 3),
+            "get_gzip_ms": round(gzip_times[len(gzip_times) // 2], 3),
+        }
+
+
+def _print_report(report: List[Dict[str, Any]]):
+    for r in report:
+        print(f"\n{r['size']}: запрос {r['request_bytes'] / 1024:.0f} КБ, ответ {r['response_bytes'] / 1024:.0f} КБ")
+        print(f"  разбор и проверка контекста: {r['request_before_ms']} → {r['request_after_ms']} мс")
+        print(f"  сериализация ответа:         {r['response_before_ms']} → {r['response_after_ms']} мс")
+        print(f"  gzip: {r['gzip_bytes'] / 1024:.0f} КБ за {r['gzip_ms']} мс", end='')
+        if 'br_bytes' in r:
+            print(f", brotli: {r['br_bytes'] / 1024:.0f} КБ за {r['br_ms']} мс", end='')
+        print()
+        print(f"  через приложение: PUT {r['put_ms']} мс, GET {r['get_ms']} мс, GET с gzip {r['get_gzip_ms']} мс")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='small,large,xl', help=f"из {', '.join(SIZES)}")
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--json', action='store_true', help='вывести результат JSON')
+    args = parser.parse_args()
+
+    sizes = args.sizes.split(',')
+    unknown = [s for s in sizes if s not in SIZES]
+    if unknown:
+        parser.error(f"неизвестные размеры: {', '.join(unknown)}")
+
+    with tempfile.TemporaryDirectory(prefix='bench-json-') as workdir:
+        with open(os.path.join(workdir, 'config.yaml'), 'w', encoding='utf-8') as f:
+            f.write(BENCH_CONFIG.format(workdir=workdir))
+        # main читает config.yaml из текущего каталога
+        os.chdir(workdir)
+        sys.path.insert(0, BACKEND_DIR)
+        import main as main_module
+
+        report = [run_size(main_module, size, args.repeat) for size in sizes]
+        os.chdir(BACKEND_DIR)
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        _print_report(report)
+
+
+if __name__ == '__main__':
+    main()
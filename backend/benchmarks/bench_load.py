@@ -0,0 +1,275 @@
+"""
+Нагрузочный тест /api/chat и /api/chat/stream против локальной заглушки Mistral
+
+Бэкенд и заглушка запускаются отдельными процессами uvicorn во временном
+каталоге, так что тест не тратит кредиты API и работает без сети.
+Для каждого сценария (режим × размер дня × число клиентов) выводятся
+p50/p95/p99 задержки, RPS, ошибки по статусам и пиковый RSS бэкенда.
+
+Запуск из каталога backend:
+    python -m benchmarks.bench_load [--sizes small,large] [--concurrency 1,16] [--requests 200]
+    python -m benchmarks.bench_load --json > baseline.json
+    python -m benchmarks.bench_load --baseline baseline.json --tolerance 0.25   # код 1 при регрессии
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+import httpx
+import psutil
+
+from benchmarks.bench_prompt import heavy_day
+from benchmarks.bench_startup import BACKEND_DIR, backend_env, free_port
+from benchmarks import fake_mistral
+
+
+# Размер дня — число задач; остальные секции heavy_day растут пропорционально
+SIZES = {'small': 5, 'medium': 50, 'large': 300, 'xl': 1500}
+
+BENCH_CONFIG = """
+defaults:
+  provider: api
+  model: mistral-small-latest
+models:
+  api:
+    available:
+      - name: mistral-small-latest
+        id: mistral-small
+mistral:
+  api_key: bench
+  base_url: http://127.0.0.1:{port}/v1
+  timeout: 30
+  pool:
+    max_connections: 200
+    max_keepalive_connections: 100
+cache:
+  enabled: false
+admission:
+  enabled: false
+"""
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    """Перцентиль по ближайшему рангу"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(p / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def _wait_ready(url: str, proc: subprocess.Popen, deadline: float = 60):
+    started = time.monotonic()
+    while time.monotonic() - started < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"Процесс для {url} завершился с кодом {proc.returncode}")
+        try:
+            if httpx.get(url, timeout=2).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        time.sleep(0.05)
+    raise RuntimeError(f"{url} не ответил за {deadline} с")
+
+
+def _stop(proc: subprocess.Popen):
+    proc.terminate()
+    try:
+        proc.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+
+def _chat_body(context: Dict[str, Any], index: int) -> Dict[str, Any]:
+    # Уникальный вопрос: иначе одинаковые запросы объединит single-flight
+    return {
+        "messages": [{"role": "user", "content": f"Как прошёл мой день? Запрос {index}"}],
+        "context": context,
+        "use_cache": False,
+    }
+
+
+async def _one_request(client: httpx.AsyncClient, mode: str, body: Dict[str, Any]) -> Dict[str, Any]:
+    """Один запрос: статус, полное время и (для потока) время до первого токена"""
+    started = time.perf_counter()
+    first_token = None
+    try:
+        if mode == 'chat':
+            response = await client.post('/api/chat', json=body)
+            status = response.status_code
+        else:
+            async with client.stream('POST', '/api/chat/stream', json=body) as response:
+                status = response.status_code
+                async for line in response.aiter_lines():
+                    if first_token is None and line.startswith('event: token'):
+                        first_token = time.perf_counter() - started
+                    if line.startswith('event: error'):
+                        status = 'stream_error'
+    except httpx.TransportError as e:
+        status = type(e).__name__
+    return {"status": status, "latency": time.perf_counter() - started, "ttft": first_token}
+
+
+async def run_scenario(base_url: str, backend: psutil.Process, mode: str, size: str,
+                       concurrency: int, requests: int, warmup: int) -> Dict[str, Any]:
+    context = heavy_day(SIZES[size])
+    results: List[Dict[str, Any]] = []
+    rss_peak = backend.memory_info().rss
+    counter = iter(range(warmup + requests))
+
+    async def sample_rss():
+        nonlocal rss_peak
+        while True:
+            rss_peak = max(rss_peak, backend.memory_info().rss)
+            await asyncio.sleep(0.05)
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+        for index in range(warmup):
+            next(counter)
+            await _one_request(client, mode, _chat_body(context, -index - 1))
+
+        async def worker():
+            for index in counter:
+                results.append(await _one_request(client, mode, _chat_body(context, index)))
+
+        sampler = asyncio.create_task(sample_rss())
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        sampler.cancel()
+
+    ok = [r for r in results if r["status"] == 200]
+    latencies = [r["latency"] for r in ok]
+    ttfts = [r["ttft"] for r in ok if r["ttft"] is not None]
+
+    def ms(value: Optional[float]) -> Optional[float]:
+        return None if value is None else round(value * 1000, 2)
+
+    return {
+        "name": f"{mode}/{size}/c{concurrency}",
+        "mode": mode,
+        "size": size,
+        "concurrency": concurrency,
+        "requests": len(results),
+        "ok": len(ok),
+        "errors": {str(k): v for k, v in Counter(r["status"] for r in results if r["status"] != 200).items()},
+        "rps": round(len(ok) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": ms(percentile(latencies, 50)),
+        "p95_ms": ms(percentile(latencies, 95)),
+        "p99_ms": ms(percentile(latencies, 99)),
+        "ttft_p50_ms": ms(percentile(ttfts, 50)),
+        "ttft_p95_ms": ms(percentile(ttfts, 95)),
+        "rss_peak_mb": round(rss_peak / 2 ** 20, 1),
+    }
+
+
+def compare(report: List[Dict[str, Any]], baseline: List[Dict[str, Any]], tolerance: float) -> List[str]:
+    """Регрессии относительно базового прогона: p95 выше или RPS ниже допуска"""
+    previous = {s["name"]: s for s in baseline}
+    problems = []
+    for scenario in report:
+        base = previous.get(scenario["name"])
+        if base is None:
+            continue
+        if base.get("p95_ms") and scenario["p95_ms"] and scenario["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            problems.append(f"{scenario['name']}: p95 {scenario['p95_ms']} мс, было {base['p95_ms']} мс")
+        if base.get("rps") and scenario["rps"] < base["rps"] * (1 - tolerance):
+            problems.append(f"{scenario['name']}: RPS {scenario['rps']}, было {base['rps']}")
+        if scenario["ok"] < scenario["requests"] and base.get("ok") == base.get("requests"):
+            problems.append(f"{scenario['name']}: ошибки {scenario['errors']}")
+    return problems
+
+
+def _print_report(report: List[Dict[str, Any]]):
+    header = f"{'сценарий':<22}{'ok':>7}{'RPS':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'TTFT p50':>10}{'RSS МБ':>9}  ошибки"
+    print(header)
+    print('-' * len(header))
+    for s in report:
+        def col(value, width):
+            return f"{'-' if value is None else value:>{width}}"
+        print(f"{s['name']:<22}{s['ok']:>4}/{s['requests']:<3}{col(s['rps'], 8)}{col(s['p50_ms'], 9)}"
+              f"{col(s['p95_ms'], 9)}{col(s['p99_ms'], 9)}{col(s['ttft_p50_ms'], 10)}{col(s['rss_peak_mb'], 9)}"
+              f"  {s['errors'] or ''}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modes', default='chat,stream', help='chat, stream или оба через запятую')
+    parser.add_argument('--sizes', default='small,medium,large', help=f"из {', '.join(SIZES)}")
+    parser.add_argument('--concurrency', default='1,16', help='число одновременных клиентов через запятую')
+    parser.add_argument('--requests', type=int, default=100, help='запросов на сценарий')
+    parser.add_argument('--warmup', type=int, default=5, help='прогревочных запросов на сценарий')
+    parser.add_argument('--json', action='store_true', help='вывести результат JSON (для --baseline)')
+    parser.add_argument('--baseline', help='JSON прошлого прогона: код возврата 1 при регрессии')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='допустимое ухудшение, доля')
+    fake_mistral.add_arguments(parser)
+    args = parser.parse_args()
+
+    modes = args.modes.split(',')
+    sizes = args.sizes.split(',')
+    levels = [int(c) for c in args.concurrency.split(',')]
+    unknown = [s for s in sizes if s not in SIZES]
+    if unknown:
+        parser.error(f"неизвестные размеры: {', '.join(unknown)}")
+
+    fake_port, app_port = free_port(), free_port()
+    fake_cmd = [sys.executable, '-W', 'ignore', '-m', 'benchmarks.fake_mistral', '--port', str(fake_port),
+                '--latency', str(args.latency), '--jitter', str(args.jitter),
+                '--error-rate', str(args.error_rate), '--rate-limit-rate', str(args.rate_limit_rate),
+                '--retry-after', str(args.retry_after), '--chunk-delay', str(args.chunk_delay),
+                '--seed', str(args.seed)]
+    app_cmd = [sys.executable, '-W', 'ignore', '-m', 'uvicorn', 'main:app',
+               '--host', '127.0.0.1', '--port', str(app_port), '--log-level', 'warning']
+
+    report = []
+    with tempfile.TemporaryDirectory(prefix='bench-load-') as workdir:
+        with open(os.path.join(workdir, 'config.yaml'), 'w', encoding='utf-8') as f:
+            f.write(BENCH_CONFIG.format(port=fake_port))
+
+        quiet = dict(stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        fake = subprocess.Popen(fake_cmd, cwd=BACKEND_DIR, env=backend_env(), **quiet)
+        app = subprocess.Popen(app_cmd, cwd=workdir, env=backend_env(), **quiet)
+        try:
+            _wait_ready(f'http://127.0.0.1:{fake_port}/v1/models', fake)
+            _wait_ready(f'http://127.0.0.1:{app_port}/health', app)
+            backend = psutil.Process(app.pid)
+            for mode in modes:
+                for size in sizes:
+                    for concurrency in levels:
+                        scenario = asyncio.run(run_scenario(
+                            f'http://127.0.0.1:{app_port}', backend, mode, size,
+                            concurrency, args.requests, args.warmup
+                        ))
+                        report.append(scenario)
+                        if not args.json:
+                            print(f"  {scenario['name']}: {scenario['rps']} RPS, p95 {scenario['p95_ms']} мс",
+                                  file=sys.stderr)
+        finally:
+            _stop(app)
+            _stop(fake)
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        _print_report(report)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            problems = compare(report, json.load(f), args.tolerance)
+        for problem in problems:
+            print(f"❌ Регрессия: {problem}", file=sys.stderr)
+        if problems:
+            sys.exit(1)
+        print(f"✅ Регрессий относительно {args.baseline} нет (допуск {args.tolerance:.0%})", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+Микробенчмарк компилятора системного промпта на синтетическом «тяжёлом» дне
+
+Запуск из каталога backend:
+    python -m benchmarks.bench_prompt [--tasks 500] [--repeat 50] [--max-tokens 3000]
+"""
+import argparse
+import random
+import time
+from typing import Dict, Any
+
+from ai.prompt import PromptCompiler
+from ai.tokens import estimate_tokens
+
+
+def heavy_day(tasks: int, seed: int = 42) -> Dict[str, Any]:
+    """Синтетический контекст дня: объёмы остальных секций пропорциональны задачам"""
+    rnd = random.Random(seed)
+    categories = ['Еда', 'Транспорт', 'Развлечения', 'Здоровье', 'Дом', 'Подписки']
+    return {
+        'date': '2026-01-15',
+        'tasks': [
+            {'id': f't{i}', 'title': f'Задача {i}', 'completed': rnd.random() < 0.3,
+             'priority': rnd.choice(['low', 'med', 'high']), 'notes': 'заметка ' * rnd.randint(0, 5)}
+            for i in range(tasks)
+        ],
+        'finances': [
+            {'id': f'f{i}', 'type': rnd.choice(['income', 'expense', 'expense']),
+             'amount': rnd.randint(50, 5000), 'category': rnd.choice(categories)}
+            for i in range(tasks * 4)
+        ],
+        'workouts': [
+            {'id': f'w{i}', 'title': f'Тренировка {i}',
+             'exercises': [{'name': f'Упражнение {j}', 'sets': 4, 'reps': 10, 'weight': 60} for j in range(8)]}
+            for i in range(tasks // 50 + 1)
+        ],
+        'diary': [
+            {'id': f'd{i}', 'mood': 'good', 'content': 'Сегодня был насыщенный день. ' * 10, 'tags': ['работа']}
+            for i in range(tasks // 20 + 1)
+        ],
+        'events': [
+            {'id': f'e{i}', 'time': f'{i % 24:02d}:00', 'title': f'Событие {i}',
+             'description': 'описание события', 'location': 'офис'}
+            for i in range(tasks // 5)
+        ],
+        'notes': [
+            {'id': f'n{i}', 'title': f'Заметка {i}', 'content': 'текст заметки ' * 20, 'tags': ['идеи']}
+            for i in range(tasks // 10)
+        ],
+    }
+
+
+def measure(fn, repeat: int) -> float:
+    """Среднее время вызова, мс"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--tasks', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--max-tokens', type=int, default=3000)
+    args = parser.parse_args()
+
+    context = heavy_day(args.tasks)
+    print(f"Синтетический день: {args.tasks} задач, {len(context['finances'])} транзакций, "
+          f"{len(context['events'])} событий, {len(context['notes'])} заметок")
+
+    def cold():
+        PromptCompiler().compile(context)
+
+    warm_compiler = PromptCompiler()
+    warm_compiler.compile(context)
+
+    budget_compiler = PromptCompiler(max_tokens=args.max_tokens)
+    budget_compiler.compile(context)
+
+    # Типичный ход диалога: поменялась одна задача, остальные секции из мемо
+    changed = dict(context, tasks=[dict(t) for t in context['tasks']])
+
+    def one_section_changed():
+        changed['tasks'][0]['completed'] = not changed['tasks'][0]['completed']
+        warm_compiler.compile(changed)
+
+    full_prompt = PromptCompiler().compile(context)
+    budget_prompt = budget_compiler.compile(context)
+
+    print(f"  холодная сборка:           {measure(cold, args.repeat):8.2f} мс")
+    print(f"  повтор (все секции в мемо): {measure(lambda: warm_compiler.compile(context), args.repeat):8.2f} мс")
+    print(f"  изменилась одна секция:    {measure(one_section_changed, args.repeat):8.2f} мс")
+    print(f"  с бюджетом {args.max_tokens} токенов:  {measure(lambda: budget_compiler.compile(context), args.repeat):8.2f} мс")
+    print(f"  размер промпта: {estimate_tokens(full_prompt)} токенов без лимита, "
+          f"{estimate_tokens(budget_prompt)} с лимитом")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""
+Бенчмарк холодного старта: время импорта main и время до первого 200 от /health
+
+Каждый замер — новый процесс в отдельном каталоге с собственным config.yaml,
+API указывает на закрытый локальный порт, так что сеть не нужна.
+
+Запуск из каталога backend:
+    python -m benchmarks.bench_startup [--repeat 5] [--json]
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BENCH_CONFIG = """
+defaults:
+  provider: api
+  model: mistral-small-latest
+models:
+  api:
+    available:
+      - name: mistral-small-latest
+        id: mistral-small
+mistral:
+  api_key: bench
+  base_url: http://127.0.0.1:9/v1
+  timeout: 30
+"""
+
+IMPORT_SNIPPET = (
+    "import time; t = time.perf_counter(); import main; "
+    "print(time.perf_counter() - t)"
+)
+
+
+def backend_env() -> dict:
+    """Окружение дочернего процесса: backend в PYTHONPATH, без настоящего ключа API"""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = BACKEND_DIR + os.pathsep + env.get('PYTHONPATH', '')
+    env.pop('MISTRAL_API_KEY', None)
+    return env
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def measure_import(workdir: str) -> float:
+    """Секунды на import main в новом интерпретаторе"""
+    out = subprocess.run(
+        [sys.executable, '-W', 'ignore', '-c', IMPORT_SNIPPET],
+        cwd=workdir, env=backend_env(), capture_output=True, text=True, check=True
+    )
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def measure_first_response(workdir: str, deadline: float = 60) -> dict:
+    """Секунды от запуска uvicorn до первого 200 от /health и время самого ответа"""
+    port = free_port()
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, '-W', 'ignore', '-m', 'uvicorn', 'main:app',
+         '--host', '127.0.0.1', '--port', str(port), '--log-level', 'warning'],
+        cwd=workdir, env=backend_env(), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        with httpx.Client(timeout=5) as client:
+            while time.perf_counter() - started < deadline:
+                if proc.poll() is not None:
+                    raise RuntimeError(f"uvicorn завершился с кодом {proc.returncode}")
+                request_started = time.perf_counter()
+                try:
+                    response = client.get(f'http://127.0.0.1:{port}/health')
+                except httpx.TransportError:
+                    time.sleep(0.005)
+                    continue
+                if response.status_code == 200:
+                    now = time.perf_counter()
+                    return {"first_200": now - started, "health": now - request_started}
+        raise RuntimeError(f"Нет ответа 200 за {deadline} с")
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def _summary(values) -> dict:
+    return {
+        "min_ms": min(values) * 1000,
+        "median_ms": statistics.median(values) * 1000,
+        "max_ms": max(values) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--json', action='store_true', help='вывести результат одной строкой JSON')
+    args = parser.parse_args()
+
+    imports, first, health = [], [], []
+    with tempfile.TemporaryDirectory(prefix='bench-startup-') as workdir:
+        with open(os.path.join(workdir, 'config.yaml'), 'w', encoding='utf-8') as f:
+            f.write(BENCH_CONFIG)
+        for _ in range(args.repeat):
+            imports.append(measure_import(workdir))
+            result = measure_first_response(workdir)
+            first.append(result["first_200"])
+            health.append(result["health"])
+
+    report = {
+        "python": sys.version.split()[0],
+        "repeat": args.repeat,
+        "import_main": _summary(imports),
+        "first_200": _summary(first),
+        "health_request": _summary(health),
+    }
+    if args.json:
+        print(json.dumps(report))
+        return
+
+    print(f"Python {report['python']}, повторов: {args.repeat}")
+    for title, key in (("import main", "import_main"),
+                       ("до первого 200 /health", "first_200"),
+                       ("запрос /health", "health_request")):
+        s = report[key]
+        print(f"{title:<24} min {s['min_ms']:8.1f} мс   median {s['median_ms']:8.1f} мс   max {s['max_ms']:8.1f} мс")
+
+
+if __name__ == '__main__':
+    main()
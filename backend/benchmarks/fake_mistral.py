@@ -0,0 +1,126 @@
+"""
+Локальная замена Mistral API для нагрузочных тестов: /v1/models и /v1/chat/completions
+
+Задержка, потоковая выдача и доля ошибок (5xx и 429) задаются параметрами;
+случайность детерминирована (--seed), сеть не нужна.
+
+Запуск из каталога backend:
+    python -m benchmarks.fake_mistral --port 9999 [--latency 0.2] [--error-rate 0.05] [--rate-limit-rate 0.05]
+"""
+import argparse
+import asyncio
+import json
+import random
+from typing import Any, Dict
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from ai.tokens import estimate_messages_tokens, estimate_tokens
+
+
+MODELS = [
+    {"id": "mistral-small-latest", "object": "model", "max_context_length": 32768,
+     "capabilities": {"completion_chat": True, "function_calling": True}},
+    {"id": "mistral-medium-latest", "object": "model", "max_context_length": 131072,
+     "capabilities": {"completion_chat": True, "function_calling": True}},
+    {"id": "mistral-large-latest", "object": "model", "max_context_length": 131072,
+     "capabilities": {"completion_chat": True, "function_calling": True}},
+]
+
+REPLY = ("Сегодня вы закрыли большую часть задач. Расходы в пределах обычного, "
+         "тренировка выполнена. Завтра начните с задач высокого приоритета.")
+
+
+def create_app(latency: float = 0.2, jitter: float = 0.2, error_rate: float = 0.0,
+               rate_limit_rate: float = 0.0, retry_after: int = 1,
+               chunk_delay: float = 0.01, seed: int = 42) -> FastAPI:
+    """Приложение-заглушка; latency — до заголовков ответа, chunk_delay — между чанками потока"""
+    app = FastAPI(title="Fake Mistral API")
+    rnd = random.Random(seed)
+    stats = {"requests": 0, "errors": 0, "rate_limited": 0}
+
+    def delay() -> float:
+        return max(0.0, latency * rnd.uniform(1 - jitter, 1 + jitter))
+
+    @app.get("/v1/models")
+    async def models():
+        return {"object": "list", "data": MODELS}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body: Dict[str, Any] = await request.json()
+        stats["requests"] += 1
+
+        roll = rnd.random()
+        if roll < rate_limit_rate:
+            stats["rate_limited"] += 1
+            return JSONResponse({"message": "Requests rate limit exceeded"}, status_code=429,
+                                headers={"Retry-After": str(retry_after)})
+        if roll < rate_limit_rate + error_rate:
+            stats["errors"] += 1
+            return JSONResponse({"message": "Service unavailable"}, status_code=503)
+
+        await asyncio.sleep(delay())
+        usage = {
+            "prompt_tokens": estimate_messages_tokens(body.get("messages", [])),
+            "completion_tokens": estimate_tokens(REPLY),
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+
+        if not body.get("stream"):
+            return {
+                "id": f"cmpl-{stats['requests']}",
+                "object": "chat.completion",
+                "model": body.get("model"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": REPLY},
+                             "finish_reason": "stop"}],
+                "usage": usage,
+            }
+
+        async def events():
+            for word in REPLY.split(' '):
+                chunk = {"choices": [{"index": 0, "delta": {"content": word + ' '}}]}
+                yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+                if chunk_delay:
+                    await asyncio.sleep(chunk_delay)
+            final = {"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "usage": usage}
+            yield f"data: {json.dumps(final)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats
+
+    return app
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """Параметры заглушки (общие с bench_load)"""
+    parser.add_argument('--latency', type=float, default=0.2, help='сек до ответа')
+    parser.add_argument('--jitter', type=float, default=0.2, help='разброс задержки, доля')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='доля ответов 503')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='доля ответов 429')
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After для 429, сек')
+    parser.add_argument('--chunk-delay', type=float, default=0.01, help='пауза между чанками потока, сек')
+    parser.add_argument('--seed', type=int, default=42)
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9999)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    app = create_app(args.latency, args.jitter, args.error_rate, args.rate_limit_rate,
+                     args.retry_after, args.chunk_delay, args.seed)
+    uvicorn.run(app, host=args.host, port=args.port, log_level='warning')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,21 +1,47 @@
 """
 Основной FastAPI сервер с поддержкой Mistral API
 """
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Header, Response, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Dict, Any, Optional
+from fastapi.responses import StreamingResponse, PlainTextResponse, ORJSONResponse
+from pydantic import BaseModel, ConfigDict
+from typing import List, Dict, Any, Optional, Union
 import uvicorn
-from datetime import datetime
+import asyncio
+import json
+from datetime import datetime, date as date_cls, timedelta
 
-from ai.core import Config
+from ai.core import Config, UpstreamError
 from ai.model_manager import ModelManager
+from ai.local_model import get_local_pool, shutdown_local_pool
+from ai.http_client import shared_client
+from ai.availability import availability
+from ai.response_cache import get_response_cache
+from ai.history import HistoryManager
+from ai.context_store import get_context_store, ContextConflict
+from ai.retrieval import get_history_index
+from ai.sessions import SessionStore
+from ai.analytics import get_analytics_store
+from ai.analysis import DayAnalyzer
+from ai.singleflight import singleflight
+from ai.admission import get_admission, set_priority
+from ai import metrics
+from ai.batch import BatchRunner
+from ai.schemas import Task, MoneyTransaction, WorkoutSession, DiaryEntry, CalendarEvent, Note
+from ai.transport import ORJSONRoute, CompressionMiddleware
+from ai.profiling import ProfileStore, ProfilingMiddleware
+from ai.tools import DayTools, record_count
+from ai import deadline
+from ai.deadline import ClientDisconnected
 
 app = FastAPI(
     title="Personal Assistant AI API",
     description="AI ассистент с Mistral API",
-    version="4.0.0"
+    version="4.0.0",
+    default_response_class=ORJSONResponse
 )
+# Тела запросов разбираются orjson (до объявления маршрутов)
+app.router.route_class = ORJSONRoute
 
 # Настройка CORS
 app.add_middleware(
@@ -33,34 +59,215 @@ class ChatMessage(BaseModel):
     timestamp: Optional[str] = None
 
 class DailyContext(BaseModel):
+    """Контекст дня; записи проверяются по типам из ai/schemas.py, но остаются dict"""
     date: str
-    tasks: List[Dict[str, Any]] = []
-    finances: Optional[List[Dict[str, Any]]] = []
-    money: Optional[List[Dict[str, Any]]] = []
-    workouts: List[Dict[str, Any]] = []
-    diary: List[Dict[str, Any]] = []
-    events: List[Dict[str, Any]] = []
-    notes: List[Dict[str, Any]] = []
+    tasks: List[Task] = []
+    finances: Optional[List[MoneyTransaction]] = []
+    money: Optional[List[MoneyTransaction]] = []
+    workouts: List[WorkoutSession] = []
+    diary: List[DiaryEntry] = []
+    events: List[CalendarEvent] = []
+    notes: List[Note] = []
+
+    def to_context(self) -> Dict[str, Any]:
+        """Контекст для промпта и хранилища без копирования записей"""
+        return dict(self)
+
+class ContextRef(BaseModel):
+    """Ссылка на контекст из серверного хранилища"""
+    date: str
+    version: Optional[int] = None
+
+class ContextUpserts(BaseModel):
+    """Новые и изменённые записи по коллекциям (типы как в DailyContext)"""
+    model_config = ConfigDict(extra='forbid')
+    tasks: List[Task] = []
+    finances: List[MoneyTransaction] = []
+    workouts: List[WorkoutSession] = []
+    diary: List[DiaryEntry] = []
+    events: List[CalendarEvent] = []
+    notes: List[Note] = []
+
+    def to_sections(self) -> Dict[str, List[Dict[str, Any]]]:
+        """Только переданные коллекции"""
+        return {name: getattr(self, name) for name in self.model_fields_set}
+
+class ContextDelta(BaseModel):
+    """Изменения контекста дня относительно base_version"""
+    base_version: int
+    upserts: ContextUpserts = ContextUpserts()
+    deletes: Dict[str, List[Union[str, int]]] = {}
 
 class ChatRequest(BaseModel):
     messages: List[ChatMessage]
-    context: DailyContext
+    # Либо контекст целиком, либо ссылка на сохранённый на сервере
+    context: Optional[DailyContext] = None
+    context_ref: Optional[ContextRef] = None
+    # False — не брать ответ из кэша (например, «перегенерировать»)
+    use_cache: bool = True
+    # Модель только для этого запроса (иначе — модель сессии или по умолчанию)
+    model: Optional[str] = None
+    # Серверная сессия диалога: messages содержат только новые сообщения
+    session_id: Optional[str] = None
+    # Режим инструментов (None — по tools.enabled и размеру дня)
+    tools: Optional[bool] = None
+
+class BatchChatRequest(BaseModel):
+    """Несколько запросов чата; stream — отдавать результаты NDJSON по мере готовности"""
+    requests: List[ChatRequest]
+    stream: bool = False
+
+class SessionCreateRequest(BaseModel):
+    """Новая серверная сессия; messages — начальная часть диалога (например, с клиента)"""
+    messages: List[ChatMessage] = []
+
+class RangeAnalysisRequest(BaseModel):
+    """Анализ периода: контексты дней или диапазон дат из серверного хранилища"""
+    contexts: Optional[List[DailyContext]] = None
+    start: Optional[str] = None
+    end: Optional[str] = None
 
 class ModelSwitchRequest(BaseModel):
+    """Смена модели по умолчанию; с заголовком X-Session-Id — только для сессии"""
     model_name: str
 
 # Глобальные объекты
 config = Config()
 model_manager = ModelManager(config)
+history_manager = HistoryManager.from_config(config)
+context_store = get_context_store(config.get('context_store.path', 'data/contexts.sqlite3'),
+                                  config.get('context_store.max_parsed', 64))
+history_index = get_history_index(config, context_store) if config.get('retrieval.enabled', True) else None
+session_store = SessionStore.from_config(config)
+analytics_store = get_analytics_store(config)
+day_analyzer = DayAnalyzer(config)
+batch_runner = BatchRunner(config)
+admission = get_admission(config)
 
-@app.on_event("startup")
-async def startup_event():
-    print("=" * 60)
-    print("🚀 Запуск AI бэкенда с Mistral API")
-    print("=" * 60)
+# Сжатие больших ответов (gzip, brotli — если установлен)
+if config.get('compression.enabled', True):
+    app.add_middleware(
+        CompressionMiddleware,
+        minimum_size=config.get('compression.minimum_size', 1024),
+        gzip_level=config.get('compression.gzip_level', 6),
+        brotli_quality=config.get('compression.brotli_quality', 4),
+    )
+
+# Метрики Prometheus (GET /metrics): middleware внешний, учитывает и CORS
+if config.get('metrics.enabled', True):
+    app.add_middleware(metrics.MetricsMiddleware)
+
+# Профиль запроса по X-Profile (только с profiling.enabled; иначе middleware нет вовсе)
+profile_store = ProfileStore(config.get('profiling.capacity', 20)) if config.get('profiling.enabled', False) else None
+if profile_store is not None:
+    app.add_middleware(
+        ProfilingMiddleware,
+        store=profile_store,
+        token=config.get('profiling.token'),
+        interval=config.get('profiling.interval_ms', 5) / 1000,
+    )
+
+def _resolve_model(requested: Optional[str] = None, session_id: Optional[str] = None) -> str:
+    """Имя модели для запроса (неизвестная модель — 400)"""
+    if requested and not model_manager.is_known_model(requested):
+        raise HTTPException(status_code=400, detail=f"Неизвестная модель: {requested}")
+    return model_manager.resolve_model_name(requested, session_id)
+
+def route_model(requested: Optional[str] = None, session_id: Optional[str] = None):
+    """Имя и экземпляр модели для запроса (неизвестная модель — 400)"""
+    model_name = _resolve_model(requested, session_id)
+    metrics.enter_handler(model_name)
+    return model_name, model_manager.get_model(model_name)
+
+def _new_messages(request: ChatRequest) -> List[Dict[str, str]]:
+    return [{"role": msg.role, "content": msg.content} for msg in request.messages]
+
+async def prepare_messages(request: ChatRequest, model_name: str) -> List[Dict[str, str]]:
+    """Сообщения для модели: история сессии + новые; старая часть сворачивается в резюме"""
+    messages = _new_messages(request)
+    if request.session_id is not None:
+        history = await asyncio.to_thread(session_store.messages, request.session_id)
+        if history is None:
+            raise HTTPException(status_code=404, detail=f"Сессия {request.session_id} не найдена или истекла")
+        messages = history + messages
+    if history_manager is not None:
+        messages = await history_manager.compact(messages, model_manager, model_name)
+    return messages
+
+async def remember_turn(request: ChatRequest, reply: str) -> Optional[Dict[str, Any]]:
+    """Дописать в сессию новые сообщения и ответ (только после успешного ответа)"""
+    if request.session_id is None:
+        return None
+    turn = _new_messages(request) + [{"role": "assistant", "content": reply}]
+    length = await asyncio.to_thread(session_store.append, request.session_id, turn)
+    return {"id": request.session_id, "length": length}
+
+def _use_tools(request: ChatRequest, context: Dict[str, Any]) -> bool:
+    """Режим инструментов: явно в запросе или для больших дней при tools.enabled"""
+    if request.tools is not None:
+        return request.tools
+    return config.get('tools.enabled', False) and record_count(context) >= config.get('tools.min_records', 40)
+
+async def resolve_context(request: ChatRequest) -> Dict[str, Any]:
+    """Контекст дня из запроса или из серверного хранилища (с найденным в истории)"""
+    if request.context_ref is not None:
+        ref = request.context_ref
+        stored = await asyncio.to_thread(context_store.get, ref.date)
+        if stored is None:
+            raise HTTPException(status_code=404, detail=f"Контекст за {ref.date} не загружен")
+        if ref.version is not None and ref.version != stored.version:
+            raise HTTPException(
+                status_code=409,
+                detail=f"Версия контекста {ref.date} на сервере: {stored.version}, в запросе: {ref.version}"
+            )
+        # Копия верхнего уровня: кэшированный контекст хранилища не меняем
+        context = dict(stored.context, _section_keys=stored.section_keys())
+        inline = False
+    elif request.context is not None:
+        context = request.context.to_context()
+        inline = True
+    else:
+        raise HTTPException(status_code=422, detail="Нужно передать context или context_ref")
+    
+    # Найденное нужно и в режиме инструментов: его промпт не берёт, но запасная
+    # модель без function calling получает полный промпт с этим разделом
+    question = next((m.content for m in reversed(request.messages) if m.role == 'user'), '')
+    return await asyncio.to_thread(_enrich_context, context, question, inline)
+
+def _enrich_context(context: Dict[str, Any], question: str, inline: bool) -> Dict[str, Any]:
+    """Найденное в истории по последнему вопросу и сводка статистики (в потоке)"""
+    if history_index is not None:
+        if inline and config.get('retrieval.index_inline', True):
+            history_index.update_day(context['date'], context_store.normalize(context))
+        snippets = history_index.snippets(question, exclude_date=context.get('date')) if question else []
+        if snippets:
+            context['retrieved'] = snippets
+    if config.get('stats.in_prompt', True):
+        lines = analytics_store.prompt_lines(context.get('date'), config.get('stats.window_days', 30))
+        if lines:
+            context['stats'] = lines
+    return context
+
+_startup_task: Optional[asyncio.Task] = None
+
+async def _startup_report():
+    """Прогрев модели по умолчанию и баннер; сервер в это время уже отвечает"""
+    try:
+        await shared_client.prepare(config)
+        # Модель регистрируется в опросе доступности — только из цикла событий
+        model_name = model_manager.warm_up()
+        # Процессы локальных моделей с preload запускаются и загружают модели заранее
+        get_local_pool(config).warm_up()
+        # Индекс истории строится один раз, дальше дочитываются только изменения
+        if history_index is not None:
+            await asyncio.to_thread(history_index.refresh)
+        await asyncio.to_thread(session_store.purge_expired)
+        system_info = await asyncio.to_thread(model_manager.get_system_info, model_name)
+    except Exception as e:
+        print(f"⚠️ Не удалось подготовить модель при старте: {e}")
+        return
     
-    # Показываем информацию о системе
-    system_info = model_manager.get_system_info()
+    state = availability.get(model_manager.get_model(model_name).provider, model_name)
     
     print(f"\n📊 Информация о системе:")
     print(f"  CPU: {system_info['system']['cpu_cores']} ядер")
@@ -69,10 +276,35 @@ async def startup_event():
     print(f"\n🤖 Текущая модель:")
     print(f"  Провайдер: {system_info['current_model']['provider']}")
     print(f"  Модель: {system_info['current_model']['name']}")
-    print(f"  Доступна: {system_info['current_model']['available']}")
+    print(f"  Доступна: {'проверяется в фоне' if state.available is None else state.available}")
     
     print("\n" + "=" * 60)
 
+@app.on_event("startup")
+async def startup_event():
+    global _startup_task
+    
+    print("=" * 60)
+    print("🚀 Запуск AI бэкенда с Mistral API")
+    print("=" * 60)
+    
+    # Фоновая проверка доступности моделей
+    availability.start(config)
+    
+    # Ничего не ждём: прогрев и информация о системе — в фоне
+    _startup_task = asyncio.create_task(_startup_report())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if _startup_task is not None and not _startup_task.done():
+        _startup_task.cancel()
+    # Останавливаем опрос, закрываем общий пул соединений, клиенты моделей
+    # и процессы локальных моделей
+    await availability.stop()
+    await shared_client.aclose()
+    model_manager.close()
+    shutdown_local_pool()
+
 @app.get("/")
 async def root():
     current_model = model_manager.get_current_model()
@@ -86,127 +318,567 @@ async def root():
 
 @app.get("/health")
 async def health():
-    current_model = model_manager.get_current_model()
+    # Без обращения к базе настроек: проверка жизни не должна ждать SQLite
+    model_name = model_manager.cached_model_name
+    current_model = model_manager.get_model(model_name)
     
     return {
         "status": "healthy",
         "timestamp": datetime.now().isoformat(),
         "current_model": {
-            "provider": model_manager.current_provider,
-            "name": model_manager.current_model_name,
+            "provider": model_manager.provider_of(model_name),
+            "name": model_name,
             "available": current_model.is_available() if current_model else False
         },
         "system": model_manager.get_system_info()['system']
     }
 
+def start_deadline(x_request_timeout: Optional[str], default: Optional[float] = None):
+    """Срок ответа: X-Request-Timeout (сек) или default, не больше deadline.max"""
+    try:
+        seconds = deadline.parse_timeout(x_request_timeout) or default
+    except ValueError:
+        raise HTTPException(status_code=400, detail="X-Request-Timeout: положительное число секунд")
+    deadline.start(min(seconds, config.get('deadline.max', 300)) if seconds else None)
+
+def chat_deadline() -> float:
+    """Срок ответа чата по умолчанию: deadline.default или mistral.timeout"""
+    return config.get('deadline.default') or config.get('mistral.timeout', 30)
+
+# Ответа уже никто не ждёт; статус — для логов и метрик (как 499 у nginx)
+CLIENT_CLOSED = 499
+
 @app.post("/api/chat")
-async def chat(request: ChatRequest):
-    """Основной эндпоинт для чата"""
-    current_model = model_manager.get_current_model()
+async def chat(request: ChatRequest, http_request: Request, x_session_id: Optional[str] = Header(None),
+               x_request_timeout: Optional[str] = Header(None)):
+    """Основной эндпоинт для чата
     
-    if not current_model or not current_model.is_available():
-        raise HTTPException(
-            status_code=503,
-            detail="Текущая модель недоступна. Проверьте подключение к Mistral API."
-        )
+    Срок ответа — X-Request-Timeout или deadline.default; если клиент
+    отключился раньше, запрос к провайдеру отменяется.
+    """
+    start_deadline(x_request_timeout, chat_deadline())
+    model_name, current_model = route_model(request.model, x_session_id or request.session_id)
+    try:
+        return await deadline.guard(_chat_once(request, model_name, current_model),
+                                    http_request.receive, "/api/chat", model_name)
+    except ClientDisconnected:
+        return Response(status_code=CLIENT_CLOSED)
+    except UpstreamError as e:
+        raise upstream_http_error(e)
+
+async def _chat_once(request: ChatRequest, model_name: str, current_model) -> Dict[str, Any]:
+    """Один ответ чата; ошибки — HTTPException с настоящим статусом"""
+    # Контекст: из запроса или из серверного хранилища (ошибки — 404/409/422)
+    context = await resolve_context(request)
+    tools = DayTools.from_config(config, context, history_index) if _use_tools(request, context) else None
     
     try:
         # Преобразуем сообщения в формат для модели
-        messages = [
-            {"role": msg.role, "content": msg.content}
-            for msg in request.messages
-        ]
-        
-        # Преобразуем контекст
-        context = request.context.dict()
+        messages = await prepare_messages(request, model_name)
         
-        # Генерация ответа
-        response_text = current_model.generate(messages, context)
+        # Генерация ответа (с повторами и запасными моделями)
+        result = await model_manager.agenerate(
+            messages, context, use_cache=request.use_cache, model_name=model_name, tools=tools
+        )
+        session = await remember_turn(request, result["content"])
         
-        return {
+        response = {
             "success": True,
-            "response": response_text,
+            "response": result["content"],
             "model": {
-                "provider": model_manager.current_provider,
-                "name": model_manager.current_model_name
+                "provider": model_manager.provider_of(result["model"]),
+                "name": result["model"]
             },
             "timestamp": datetime.now().isoformat()
         }
-        
+        if "tools" in result:
+            response["tools"] = result["tools"]
+        if session is not None:
+            response["session"] = session
+        return response
+    
+    except UpstreamError as e:
+        raise upstream_http_error(e)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"Ошибка генерации: {str(e)}"
         )
 
+@app.post("/api/chat/batch")
+async def chat_batch(batch: BatchChatRequest, http_request: Request, x_session_id: Optional[str] = Header(None),
+                     x_request_timeout: Optional[str] = Header(None)):
+    """Пакет запросов чата: параллельно (batch.concurrency) и с лимитом частоты на модель
+    
+    Ошибка одного элемента не прерывает пакет: элемент получает success=false,
+    status и error. Без stream ответ — results в порядке запросов, со stream —
+    NDJSON-строки {"index": ..., ...} по мере готовности и итоговая {"done": true}.
+    X-Request-Timeout ограничивает весь пакет, без него у каждого элемента
+    свой срок чата по умолчанию.
+    """
+    start_deadline(x_request_timeout)
+    if not batch.requests:
+        raise HTTPException(status_code=422, detail="Пакет пуст")
+    if len(batch.requests) > batch_runner.max_items:
+        raise HTTPException(
+            status_code=413,
+            detail=f"В пакете больше {batch_runner.max_items} запросов"
+        )
+    
+    # Модели определяем заранее: неизвестная модель — ошибка элемента, а не пакета
+    model_names: List[Optional[str]] = []
+    for item in batch.requests:
+        try:
+            model_names.append(_resolve_model(item.model, x_session_id or item.session_id))
+        except HTTPException:
+            model_names.append(None)
+    metrics.enter_handler(model_names[0] or "")
+    # Пакеты уступают живому чату в очереди к провайдеру
+    set_priority("batch")
+    
+    async def call(index: int, item: ChatRequest) -> Dict[str, Any]:
+        model_name = model_names[index]
+        if model_name is None:
+            return {"success": False, "status": 400, "error": f"Неизвестная модель: {item.model}"}
+        if x_request_timeout is None:
+            # Своя копия контекста у задачи элемента: срок только для него
+            deadline.start(chat_deadline())
+        try:
+            try:
+                return await deadline.guard(_chat_once(item, model_name, model_manager.get_model(model_name)),
+                                            model=model_name)
+            except UpstreamError as e:
+                raise upstream_http_error(e)
+        except HTTPException as e:
+            result = {"success": False, "status": e.status_code, "error": e.detail}
+            if e.headers and "Retry-After" in e.headers:
+                result["retry_after"] = int(e.headers["Retry-After"])
+            return result
+    
+    results = batch_runner.run(batch.requests, lambda index, item: model_names[index], call)
+    
+    if batch.stream:
+        async def ndjson():
+            failed = 0
+            try:
+                async for index, result in results:
+                    failed += not result.get("success")
+                    yield json.dumps({"index": index, **result}, ensure_ascii=False) + "\n"
+            except asyncio.CancelledError:
+                # Клиент отключился: незавершённые элементы отменяются вместе с results
+                deadline.record_cancelled("/api/chat/batch")
+                raise
+            yield json.dumps({"done": True, "total": len(batch.requests), "failed": failed}) + "\n"
+        
+        return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+    
+    async def collect() -> List[Optional[Dict[str, Any]]]:
+        ordered: List[Optional[Dict[str, Any]]] = [None] * len(batch.requests)
+        async for index, result in results:
+            ordered[index] = result
+        return ordered
+    
+    try:
+        ordered = await deadline.guard(collect(), http_request.receive, "/api/chat/batch", enforce=False)
+    except ClientDisconnected:
+        return Response(status_code=CLIENT_CLOSED)
+    except UpstreamError as e:
+        raise upstream_http_error(e)
+    
+    return {
+        "success": True,
+        "results": ordered,
+        "total": len(ordered),
+        "failed": sum(1 for r in ordered if not r.get("success")),
+        "timestamp": datetime.now().isoformat()
+    }
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    """Форматирование Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/api/chat/stream")
+async def chat_stream(request: ChatRequest, http_request: Request, x_session_id: Optional[str] = Header(None),
+                      x_request_timeout: Optional[str] = Header(None)):
+    """Потоковый чат: токены приходят событиями SSE по мере генерации
+    
+    Срок (X-Request-Timeout или deadline.default) действует на весь поток;
+    при отключении клиента поток и запрос к провайдеру прерываются.
+    """
+    start_deadline(x_request_timeout, chat_deadline())
+    model_name, current_model = route_model(request.model, x_session_id or request.session_id)
+    
+    if not await current_model.ais_available():
+        raise HTTPException(
+            status_code=503,
+            detail="Текущая модель недоступна. Проверьте подключение к Mistral API или установку локальной модели."
+        )
+    
+    context = await resolve_context(request)
+    messages = await prepare_messages(request, model_name)
+    model_info = {
+        "provider": model_manager.provider_of(model_name),
+        "name": model_name
+    }
+    
+    events = current_model.astream(messages, context, use_cache=request.use_cache)
+    
+    # Ошибку до первого токена отдаём настоящим HTTP статусом, а не событием;
+    # пока ждём первый токен, следим за отключением клиента сами
+    try:
+        first_event = await deadline.guard(events.__anext__(), http_request.receive,
+                                           "/api/chat/stream", model_name)
+    except ClientDisconnected:
+        await events.aclose()
+        return Response(status_code=CLIENT_CLOSED)
+    except UpstreamError as e:
+        await events.aclose()
+        raise upstream_http_error(e)
+    if first_event["type"] == "error":
+        await events.aclose()
+        raise upstream_http_error(first_event.get("error") or UpstreamError(first_event["message"]))
+    
+    async def relay():
+        yield first_event
+        async for event in events:
+            yield event
+    
+    async def event_stream():
+        reply = []
+        try:
+            async for event in relay():
+                if event["type"] == "token":
+                    reply.append(event["content"])
+                    yield _sse("token", {"content": event["content"]})
+                elif event["type"] == "error":
+                    yield _sse("error", {"message": event["message"]})
+                elif event["type"] == "done":
+                    done = {
+                        "usage": event.get("usage"),
+                        "finish_reason": event.get("finish_reason"),
+                        "cached": event.get("cached", False),
+                        "model": model_info,
+                        "timestamp": datetime.now().isoformat()
+                    }
+                    session = await remember_turn(request, "".join(reply))
+                    if session is not None:
+                        done["session"] = session
+                    yield _sse("done", done)
+        except asyncio.CancelledError:
+            # StreamingResponse отменяет поток при отключении клиента;
+            # закрытие генератора закрывает и соединение с провайдером
+            deadline.record_cancelled("/api/chat/stream")
+            raise
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def upstream_http_error(error: UpstreamError) -> HTTPException:
+    """Ошибка провайдера → HTTP ответ с настоящим статусом (и Retry-After)"""
+    headers = {}
+    if error.retry_after is not None and error.http_status in (429, 503):
+        headers["Retry-After"] = str(int(error.retry_after + 0.999))
+    return HTTPException(status_code=error.http_status, detail=error.message, headers=headers or None)
+
+@app.post("/api/analyze/day")
+async def analyze_day(context: DailyContext, http_request: Request, x_session_id: Optional[str] = Header(None),
+                      x_request_timeout: Optional[str] = Header(None)):
+    """Анализ одного дня"""
+    start_deadline(x_request_timeout)
+    model_name, _ = route_model(session_id=x_session_id)
+    set_priority("analysis")
+    
+    try:
+        result = await deadline.guard(day_analyzer.summarize_day(model_manager, model_name, context.to_context()),
+                                      http_request.receive, "/api/analyze/day", model_name)
+    except ClientDisconnected:
+        return Response(status_code=CLIENT_CLOSED)
+    except UpstreamError as e:
+        raise upstream_http_error(e)
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=f"Ошибка анализа: {str(e)}")
+    
+    return {
+        "success": True,
+        "date": result["date"],
+        "analysis": result["summary"],
+        "cached": result["cached"],
+        "model": {
+            "provider": model_manager.provider_of(result.get("model", model_name)),
+            "name": result.get("model", model_name)
+        },
+        "timestamp": datetime.now().isoformat()
+    }
+
+MAX_RANGE_DAYS = 93
+
+async def _contexts_for_range(start: str, end: str) -> List[Dict[str, Any]]:
+    """Контексты дней из хранилища; незагруженные дни — пустые"""
+    try:
+        first, last = date_cls.fromisoformat(start), date_cls.fromisoformat(end)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Даты должны быть в формате YYYY-MM-DD")
+    if last < first or (last - first).days >= MAX_RANGE_DAYS:
+        raise HTTPException(status_code=400, detail=f"Период должен быть от 1 до {MAX_RANGE_DAYS} дней")
+    
+    contexts = []
+    for offset in range((last - first).days + 1):
+        day = (first + timedelta(days=offset)).isoformat()
+        stored = await asyncio.to_thread(context_store.get, day)
+        contexts.append(stored.context if stored else {"date": day})
+    return contexts
+
+@app.post("/api/analyze/range")
+async def analyze_range(request: RangeAnalysisRequest, http_request: Request,
+                        x_session_id: Optional[str] = Header(None),
+                        x_request_timeout: Optional[str] = Header(None)):
+    """Анализ периода (неделя, месяц): итоги дней параллельно и общий обзор"""
+    start_deadline(x_request_timeout)
+    model_name, _ = route_model(session_id=x_session_id)
+    set_priority("analysis")
+    
+    if request.contexts:
+        contexts = [c.to_context() for c in request.contexts]
+    elif request.start and request.end:
+        contexts = await _contexts_for_range(request.start, request.end)
+    else:
+        raise HTTPException(status_code=422, detail="Нужно передать contexts или start и end")
+    
+    try:
+        result = await deadline.guard(day_analyzer.analyze_range(model_manager, model_name, contexts),
+                                      http_request.receive, "/api/analyze/range", model_name)
+    except ClientDisconnected:
+        return Response(status_code=CLIENT_CLOSED)
+    except UpstreamError as e:
+        raise upstream_http_error(e)
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=f"Ошибка анализа: {str(e)}")
+    
+    return {
+        "success": True,
+        "start": contexts[0].get("date"),
+        "end": contexts[-1].get("date"),
+        "days": result["days"],
+        "analysis": result["analysis"],
+        "model": {
+            "provider": model_manager.provider_of(result.get("model", model_name)),
+            "name": result.get("model", model_name)
+        },
+        "timestamp": datetime.now().isoformat()
+    }
+
+@app.get("/api/context/{date}")
+async def get_context(date: str, if_none_match: Optional[str] = Header(None)):
+    """Сохранённый контекст дня (поддерживает If-None-Match)"""
+    stored = await asyncio.to_thread(context_store.get, date)
+    if stored is None:
+        raise HTTPException(status_code=404, detail=f"Контекст за {date} не загружен")
+    if if_none_match == stored.etag:
+        return Response(status_code=304, headers={"ETag": stored.etag})
+    
+    # Крупный ответ: сразу orjson, без обхода jsonable_encoder (данные и так JSON)
+    return ORJSONResponse(
+        {"date": date, "version": stored.version, "context": stored.context},
+        headers={"ETag": stored.etag}
+    )
+
+@app.put("/api/context/{date}")
+async def put_context(date: str, context: DailyContext, response: Response,
+                      if_match: Optional[str] = Header(None)):
+    """Полная загрузка контекста дня"""
+    base_version = None
+    if if_match:
+        # ETag вида "2024-01-15:3"
+        try:
+            base_version = int(if_match.strip('"').rsplit(':', 1)[-1])
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Некорректный If-Match")
+    
+    try:
+        stored = await asyncio.to_thread(context_store.put, date, context.to_context(), base_version)
+    except ContextConflict as e:
+        raise HTTPException(status_code=412, detail=str(e))
+    
+    response.headers["ETag"] = stored.etag
+    return {"date": date, "version": stored.version}
+
+@app.patch("/api/context/{date}")
+async def patch_context(date: str, delta: ContextDelta, response: Response):
+    """Дельта контекста: upsert/удаление по id в коллекциях"""
+    try:
+        stored = await asyncio.to_thread(
+            context_store.apply_delta, date, delta.base_version, delta.upserts.to_sections(), delta.deletes
+        )
+    except ContextConflict as e:
+        raise HTTPException(
+            status_code=409,
+            detail={"message": str(e), "current_version": e.current_version}
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    response.headers["ETag"] = stored.etag
+    return {"date": date, "version": stored.version}
+
+@app.post("/api/sessions")
+async def create_session(request: SessionCreateRequest):
+    """Новая серверная сессия диалога"""
+    messages = [{"role": m.role, "content": m.content} for m in request.messages]
+    session_id = await asyncio.to_thread(session_store.create, messages)
+    return {"session_id": session_id, "length": len(messages)}
+
+@app.get("/api/sessions/{session_id}")
+async def get_session(session_id: str, after: int = 0):
+    """Сообщения сессии (after — номер первого нужного сообщения)"""
+    session = await asyncio.to_thread(session_store.history, session_id, after)
+    if session is None:
+        raise HTTPException(status_code=404, detail=f"Сессия {session_id} не найдена или истекла")
+    return ORJSONResponse(session)
+
+@app.delete("/api/sessions/{session_id}")
+async def delete_session(session_id: str):
+    """Удаление сессии со всеми сообщениями"""
+    if not await asyncio.to_thread(session_store.delete, session_id):
+        raise HTTPException(status_code=404, detail=f"Сессия {session_id} не найдена или истекла")
+    return {"success": True}
+
+@app.post("/api/stats/import")
+async def import_stats(request: Request):
+    """Загрузка полной выгрузки приложения (AppDataV1 из экспорта JSON)"""
+    raw = await request.body()
+    try:
+        analytics = await asyncio.to_thread(analytics_store.ingest, raw)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Некорректная выгрузка: {e}")
+    return {"success": True, "build_ms": analytics_store.build_ms, **analytics.counts()}
+
+async def _require_analytics():
+    """Колонки загруженной выгрузки или 404"""
+    analytics = await asyncio.to_thread(analytics_store.get)
+    if analytics is None:
+        raise HTTPException(status_code=404, detail="Выгрузка данных не загружена (POST /api/stats/import)")
+    return analytics
+
+@app.get("/api/stats/summary")
+async def stats_summary(date: Optional[str] = None, window: int = 30):
+    """Главное за месяц и последние window дней"""
+    analytics = await _require_analytics()
+    try:
+        return analytics.summary(date, window)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/api/stats/finance/monthly")
+async def stats_monthly(months: Optional[int] = None):
+    """Доходы, расходы и баланс по месяцам (months — последние N)"""
+    analytics = await _require_analytics()
+    return {"months": analytics.monthly(months)}
+
+@app.get("/api/stats/finance/categories")
+async def stats_categories(month: Optional[str] = None, type: str = "expense", top: Optional[int] = None):
+    """Суммы по категориям за месяц YYYY-MM или за всё время"""
+    analytics = await _require_analytics()
+    try:
+        return {"month": month, "type": type, "categories": analytics.categories_rollup(month, type, top)}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/api/stats/finance/rolling")
+async def stats_rolling(window: int = 30, days: int = 90, end: Optional[str] = None):
+    """Расходы по дням и скользящая сумма за window дней"""
+    if window < 1 or days < 1:
+        raise HTTPException(status_code=400, detail="window и days должны быть положительными")
+    analytics = await _require_analytics()
+    try:
+        return {"window": window, "days": analytics.rolling_spend(window, days, end)}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/api/stats/workouts/volume")
+async def stats_volume(by: str = "month", periods: Optional[int] = None):
+    """Тоннаж, подходы и тренировки по месяцам или неделям (by=week)"""
+    if by not in ("month", "week"):
+        raise HTTPException(status_code=400, detail="by: month или week")
+    analytics = await _require_analytics()
+    return {"by": by, "periods": analytics.training_volume(by, periods)}
+
+@app.get("/api/stats/workouts/records")
+async def stats_records(top: Optional[int] = 8):
+    """Лучший оценочный 1ПМ (формула Эпли) по упражнениям"""
+    analytics = await _require_analytics()
+    return {"records": analytics.personal_records(top)}
+
 @app.get("/api/models/available")
-async def get_available_models():
+async def get_available_models(x_session_id: Optional[str] = Header(None)):
     """Получение списка доступных моделей"""
-    available = model_manager.get_available_models()
-    system_info = model_manager.get_system_info()
+    await model_manager.refresh_catalog()
+    model_name = model_manager.resolve_model_name(session_id=x_session_id)
+    available = model_manager.get_available_models(model_name)
+    system_info = model_manager.get_system_info(model_name)
     
     return {
-        "api": available['api'],
+        **available,
         "current": {
-            "provider": model_manager.current_provider,
-            "name": model_manager.current_model_name
+            "provider": model_manager.provider_of(model_name),
+            "name": model_name
         },
         "system": system_info['system']
     }
 
 @app.post("/api/models/switch")
-async def switch_model(request: ModelSwitchRequest):
-    """Переключение модели"""
+async def switch_model(request: ModelSwitchRequest, x_session_id: Optional[str] = Header(None)):
+    """Переключение модели (по умолчанию или только для сессии X-Session-Id)"""
+    if not model_manager.is_known_model(request.model_name):
+        raise HTTPException(status_code=400, detail=f"Неизвестная модель: {request.model_name}")
+    
     try:
-        success = model_manager.switch_to_api(request.model_name)
-        
-        if success:
-            current_model = model_manager.get_current_model()
-            
-            return {
-                "success": True,
-                "message": f"Модель переключена на {request.model_name}",
-                "current_model": {
-                    "provider": model_manager.current_provider,
-                    "name": model_manager.current_model_name,
-                    "info": current_model.get_info() if current_model else {}
-                }
-            }
-        else:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Не удалось переключиться на модель {request.model_name}"
-            )
-            
+        success = await model_manager.aswitch_to_api(request.model_name, x_session_id)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    
+    if not success:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Не удалось переключиться на модель {request.model_name}"
+        )
+    
+    current_model = model_manager.get_model(request.model_name)
+    return {
+        "success": True,
+        "message": f"Модель переключена на {request.model_name}",
+        "session_id": x_session_id,
+        "current_model": {
+            "provider": model_manager.provider_of(request.model_name),
+            "name": request.model_name,
+            "info": current_model.get_info()
+        }
+    }
 
 @app.get("/api/models/current")
-async def get_current_model():
+async def get_current_model(x_session_id: Optional[str] = Header(None)):
     """Получение информации о текущей модели"""
-    current_model = model_manager.get_current_model()
-    
-    if not current_model:
-        raise HTTPException(status_code=404, detail="Модель не загружена")
+    model_name, current_model = route_model(session_id=x_session_id)
     
     return {
-        "provider": model_manager.current_provider,
-        "name": model_manager.current_model_name,
+        "provider": model_manager.provider_of(model_name),
+        "name": model_name,
         "info": current_model.get_info(),
         "available": current_model.is_available()
     }
 
 @app.get("/api/model/status")
-async def get_model_status():
+async def get_model_status(x_session_id: Optional[str] = Header(None)):
     """Получение статуса текущей модели"""
-    current_model = model_manager.get_current_model()
-    
-    if not current_model:
-        raise HTTPException(status_code=404, detail="Модель не загружена")
+    model_name, current_model = route_model(session_id=x_session_id)
     
     return {
         "loaded": current_model.is_available(),
-        "model_name": model_manager.current_model_name,
+        "model_name": model_name,
         "device": "api",
         "estimated_memory": "N/A",
         "cuda_available": False
@@ -217,6 +889,66 @@ async def get_system_info():
     """Получение информации о системе"""
     return model_manager.get_system_info()
 
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Метрики в текстовом формате Prometheus"""
+    if not config.get('metrics.enabled', True):
+        raise HTTPException(status_code=404, detail="Метрики отключены")
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+def _require_profiles(token: Optional[str]) -> ProfileStore:
+    if profile_store is None:
+        raise HTTPException(status_code=404, detail="Профилирование отключено")
+    if config.get('profiling.token') and token != config.get('profiling.token'):
+        raise HTTPException(status_code=403, detail="Нужен X-Profile-Token")
+    return profile_store
+
+@app.get("/debug/profiles", include_in_schema=False)
+async def list_profiles(x_profile_token: Optional[str] = Header(None)):
+    """Последние снятые профили (новые первыми)"""
+    return {"profiles": _require_profiles(x_profile_token).summaries()}
+
+@app.get("/debug/profiles/{profile_id}", include_in_schema=False)
+async def get_profile(profile_id: str, format: Optional[str] = None,
+                      x_profile_token: Optional[str] = Header(None)):
+    """Профиль запроса: pstats или text (cProfile), speedscope или text (sample)"""
+    profile = _require_profiles(x_profile_token).get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Профиль не найден (буфер хранит последние)")
+    format = format or profile.formats[0]
+    if format not in profile.formats:
+        raise HTTPException(status_code=400, detail=f"Для профиля {profile.mode}: format={' или '.join(profile.formats)}")
+    
+    filename = f"profile-{profile.id}"
+    if format == 'pstats':
+        return Response(profile.pstats(), media_type="application/octet-stream",
+                        headers={"Content-Disposition": f'attachment; filename="{filename}.prof"'})
+    if format == 'speedscope':
+        return ORJSONResponse(profile.speedscope(),
+                              headers={"Content-Disposition": f'attachment; filename="{filename}.speedscope.json"'})
+    return PlainTextResponse(profile.text())
+
+@app.get("/api/system/stats")
+async def get_system_stats():
+    """Счётчики внутренних кэшей"""
+    response_cache = get_response_cache(config)
+    
+    return {
+        "cache": response_cache.stats() if response_cache else {"enabled": False},
+        "history": history_manager.stats() if history_manager else {"enabled": False},
+        "analysis": day_analyzer.stats(),
+        "singleflight": singleflight.stats(),
+        "resilience": model_manager.resilience.stats(),
+        "batch": batch_runner.stats(),
+        "admission": admission.stats() if admission else {"enabled": False},
+        "profiling": profile_store.stats() if profile_store else {"enabled": False},
+        "deadlines": deadline.stats(),
+        "local": get_local_pool(config).stats(),
+        "retrieval": history_index.stats() if history_index else {"enabled": False},
+        "sessions": session_store.stats(),
+        "stats": analytics_store.stats()
+    }
+
 if __name__ == "__main__":
     print("\n🌐 Сервер запускается...")
     print("📍 http://localhost:8000")
@@ -0,0 +1,16 @@
+"""
+Общие фикстуры тестов бэкенда
+"""
+import pytest
+import yaml
+from ai.core import Config
+
+
+@pytest.fixture
+def make_config(tmp_path):
+    """Config из словаря (через временный config.yaml)"""
+    def make(data):
+        path = tmp_path / "config.yaml"
+        path.write_text(yaml.safe_dump(data, allow_unicode=True), encoding='utf-8')
+        return Config(str(path))
+    return make
@@ -0,0 +1,109 @@
+"""
+Допуск запросов: отказы при переполнении очереди, приоритеты, отменённые ожидающие
+"""
+import asyncio
+import pytest
+from ai.admission import AdmissionController, set_priority
+from ai.core import UpstreamError
+
+MODEL = "mistral-small-latest"
+
+
+def controller(make_config, **admission):
+    return AdmissionController(make_config({"admission": {"enabled": True, **admission}}))
+
+
+def test_full_queue_rejected_as_overloaded(make_config):
+    admission = controller(make_config, rps=1, burst=1, max_queue=1, max_wait=10)
+
+    async def scenario():
+        await admission.acquire(MODEL, 0)
+        queued = asyncio.create_task(admission.acquire(MODEL, 0))
+        await asyncio.sleep(0)
+        with pytest.raises(UpstreamError) as error:
+            await admission.acquire(MODEL, 0)
+        queued.cancel()
+        await asyncio.gather(queued, return_exceptions=True)
+        return error.value
+
+    error = asyncio.run(scenario())
+    assert error.kind == "overloaded"
+    assert error.retry_after >= 1
+    assert admission.rejected["queue"] == 1
+
+
+def test_wait_longer_than_max_wait_rejected_as_rate_limited(make_config):
+    admission = controller(make_config, rps=0.1, burst=1, max_wait=1)
+
+    async def scenario():
+        await admission.acquire(MODEL, 0)
+        with pytest.raises(UpstreamError) as error:
+            await admission.acquire(MODEL, 0)
+        return error.value
+
+    error = asyncio.run(scenario())
+    assert error.kind == "rate_limited"
+    assert error.retry_after > 1
+    assert admission.rejected["rate"] == 1
+    assert not admission.gate(MODEL).queue
+
+
+def test_queue_timeout_rejected(make_config):
+    # Ожидание оценено в 0.5 с, но после постановки в очередь ведро уходит в долг
+    admission = controller(make_config, rps=2, burst=1, max_wait=0.6)
+
+    async def scenario():
+        await admission.acquire(MODEL, 0)
+        queued = asyncio.create_task(admission.acquire(MODEL, 0))
+        await asyncio.sleep(0)
+        gate = admission.gate(MODEL)
+        gate.requests.tokens = -10
+        gate.wakeup.set()
+        with pytest.raises(UpstreamError) as error:
+            await queued
+        return error.value
+
+    error = asyncio.run(scenario())
+    assert error.kind == "overloaded"
+    assert admission.rejected["timeout"] == 1
+
+
+def test_interactive_overtakes_batch(make_config):
+    admission = controller(make_config, rps=20, burst=1, max_wait=5)
+    order = []
+
+    async def request(priority):
+        set_priority(priority)
+        await admission.acquire(MODEL, 0)
+        order.append(priority)
+
+    async def scenario():
+        await admission.acquire(MODEL, 0)
+        batch = asyncio.create_task(request("batch"))
+        await asyncio.sleep(0)
+        interactive = asyncio.create_task(request("interactive"))
+        await asyncio.gather(batch, interactive)
+
+    asyncio.run(scenario())
+    assert order == ["interactive", "batch"]
+
+
+def test_cancelled_waiter_skipped(make_config):
+    admission = controller(make_config, rps=20, burst=1, max_wait=5)
+
+    async def scenario():
+        await admission.acquire(MODEL, 0)
+        gone = asyncio.create_task(admission.acquire(MODEL, 0))
+        await asyncio.sleep(0)
+        waiting = asyncio.create_task(admission.acquire(MODEL, 0))
+        await asyncio.sleep(0)
+        gone.cancel()
+        await asyncio.wait_for(waiting, 1)
+        assert gone.cancelled()
+
+    asyncio.run(scenario())
+    gate = admission.gate(MODEL)
+    assert not gate.queue
+    # Допущены первый и оставшийся; ушедший токен не потратил
+    assert admission.admitted == 2
+    assert gate.requests.tokens < 1
@@ -0,0 +1,29 @@
+"""
+Вёдра токенов и бюджет пакета
+"""
+import asyncio
+from ai.rate_limit import RateBudget, TokenBucket, spend_budget, use_budget
+
+
+def test_bucket_burst_then_wait():
+    bucket = TokenBucket(rate=10, capacity=2)
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() == 0
+    wait = bucket.try_acquire()
+    assert 0 < wait <= 0.1
+
+
+def test_budget_spent_only_inside_batch():
+    budget = RateBudget(rate_per_minute=60, burst=1)
+
+    async def outside():
+        await spend_budget("m")
+
+    async def inside():
+        use_budget(budget)
+        await spend_budget("m")
+
+    asyncio.run(outside())
+    assert budget.bucket("m").tokens == 1
+    asyncio.run(inside())
+    assert budget.bucket("m").tokens < 1
@@ -0,0 +1,61 @@
+"""
+Предохранитель модели: closed → open → half_open → closed
+"""
+from ai.resilience import CircuitBreaker
+
+
+def expire(breaker: CircuitBreaker):
+    """Сдвинуть момент открытия на reset_timeout назад"""
+    breaker.opened_at -= breaker.reset_timeout
+
+
+def test_opens_after_failure_threshold():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+
+def test_half_open_trial_closes_on_success():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    expire(breaker)
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+    # Пока идёт пробный запрос, остальные не пропускаются
+    assert not breaker.allow()
+    breaker.record_success(0.1)
+    assert breaker.state == "closed"
+    assert breaker.allow()
+
+
+def test_half_open_trial_failure_reopens():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    expire(breaker)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+
+def test_released_trial_allows_next():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    expire(breaker)
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.allow()
+
+
+def test_stale_latency_not_degraded():
+    breaker = CircuitBreaker(latency_slo=1, degraded_retry=60)
+    breaker.record_success(5)
+    assert breaker.degraded
+    breaker.latency_at -= 60
+    assert not breaker.degraded
+    # Новая оценка начинается заново, без старого среднего
+    breaker.record_success(0.5)
+    assert breaker.latency_ewma == 0.5
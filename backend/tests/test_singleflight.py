@@ -0,0 +1,79 @@
+"""
+Single-flight: общий вызов для одинаковых запросов и его отмена
+"""
+import asyncio
+from ai import deadline
+from ai.singleflight import SingleFlight
+
+
+def test_concurrent_calls_coalesced():
+    flights = SingleFlight()
+    calls = 0
+
+    async def fn():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return "ok"
+
+    async def scenario():
+        return await asyncio.gather(*(flights.do("key", fn) for _ in range(3)))
+
+    assert asyncio.run(scenario()) == ["ok"] * 3
+    assert calls == 1
+    assert flights.stats() == {"calls": 1, "coalesced": 2, "inflight": 0}
+
+
+def test_call_survives_one_waiter_leaving():
+    flights = SingleFlight()
+
+    async def fn():
+        await asyncio.sleep(0.05)
+        return "ok"
+
+    async def scenario():
+        first = asyncio.create_task(flights.do("key", fn))
+        second = asyncio.create_task(flights.do("key", fn))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(scenario()) == "ok"
+
+
+def test_call_cancelled_when_last_waiter_leaves():
+    flights = SingleFlight()
+
+    async def scenario():
+        stopped = asyncio.Event()
+
+        async def fn():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                stopped.set()
+                raise
+
+        waiters = [asyncio.create_task(flights.do("key", fn)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        await asyncio.wait_for(stopped.wait(), 1)
+        await asyncio.sleep(0)
+
+    asyncio.run(scenario())
+    assert flights.stats()["inflight"] == 0
+
+
+def test_call_runs_without_waiter_deadline():
+    flights = SingleFlight()
+
+    async def fn():
+        return deadline.remaining()
+
+    async def scenario():
+        deadline.start(5)
+        return await flights.do("key", fn)
+
+    assert asyncio.run(scenario()) is None